@@ -3,6 +3,7 @@ import os, sys
 sys.path.append(os.getcwd())
 import bpy
 import random
+import meshbuilder
 
 
 bl_info = {
@@ -183,85 +184,70 @@ class BridgeOperator(bpy.types.Operator):
         wm = context.window_manager
         return wm.invoke_props_dialog(self)
 
-    def polygonize_parametric(self, f, vertices, faces):
-        i = len(vertices)
-        for u in (self.u_step*i for i in range(0, round(1/self.u_step))):
-            for v in (self.v_step*j for j in range(0, round(1/self.v_step))):
-                vertices.append(f(            u,             v))
-                vertices.append(f(            u, v+self.v_step))
-                vertices.append(f(u+self.u_step, v+self.v_step))
-                vertices.append(f(u+self.u_step,             v))
-                faces.append([i, i+1, i+2, i+3])
-                i += 4
-        return vertices, faces
-
-    def polygonize_alternate_v(self, f, g, v, vertices, faces):
-        i = len(vertices)
-        for u in (self.u_step*i for i in range(0, round(1/self.u_step))):
-            vertices.append(f(            u, v))
-            vertices.append(g(            u, v))
-            vertices.append(g(u+self.u_step, v))
-            vertices.append(f(u+self.u_step, v))
-            faces.append([i, i+1, i+2, i+3])
-            i += 4
-        return vertices, faces
+    def polygonize_parametric(self, f, builder):
+        us = [self.u_step*i for i in range(0, round(1/self.u_step) + 1)]
+        vs = [self.v_step*j for j in range(0, round(1/self.v_step) + 1)]
+        builder.add_grid([[f(u, v) for v in vs] for u in us])
+
+    def polygonize_alternate_v(self, f, g, v, builder):
+        us = [self.u_step*i for i in range(0, round(1/self.u_step) + 1)]
+        builder.add_grid([[f(u, v), g(u, v)] for u in us])
 
     def execute(self, context):
         bridge_parametric = BridgeParametric(self.width, self.length, self.height, self.thickness, self.railing_height, self.railing_width, self.railing_length)
-        vertices, faces = [], []
-        vertices, faces = self.polygonize_parametric(bridge_parametric.walkway0, vertices, faces)
-        vertices, faces = self.polygonize_parametric(bridge_parametric.walkway1, vertices, faces)
-        vertices, faces = self.polygonize_parametric(bridge_parametric.bottom0, vertices, faces)
-        vertices, faces = self.polygonize_parametric(bridge_parametric.bottom1, vertices, faces)
-        vertices, faces = self.polygonize_alternate_v(bridge_parametric.walkway0, bridge_parametric.bottom0, 0, vertices, faces)
-        vertices, faces = self.polygonize_alternate_v(bridge_parametric.walkway0, bridge_parametric.bottom0, 1, vertices, faces)
-        vertices, faces = self.polygonize_alternate_v(bridge_parametric.walkway1, bridge_parametric.bottom1, 0, vertices, faces)
-        vertices, faces = self.polygonize_alternate_v(bridge_parametric.walkway1, bridge_parametric.bottom1, 1, vertices, faces)
+        builder = meshbuilder.MeshBuilder()
+        self.polygonize_parametric(bridge_parametric.walkway0, builder)
+        self.polygonize_parametric(bridge_parametric.walkway1, builder)
+        self.polygonize_parametric(bridge_parametric.bottom0, builder)
+        self.polygonize_parametric(bridge_parametric.bottom1, builder)
+        self.polygonize_alternate_v(bridge_parametric.walkway0, bridge_parametric.bottom0, 0, builder)
+        self.polygonize_alternate_v(bridge_parametric.walkway0, bridge_parametric.bottom0, 1, builder)
+        self.polygonize_alternate_v(bridge_parametric.walkway1, bridge_parametric.bottom1, 0, builder)
+        self.polygonize_alternate_v(bridge_parametric.walkway1, bridge_parametric.bottom1, 1, builder)
         if self.addrailings:
-            vertices, faces = self.polygonize_parametric(bridge_parametric.railingbottom0, vertices, faces)
-            vertices, faces = self.polygonize_parametric(bridge_parametric.railingtop0, vertices, faces)
-            vertices, faces = self.polygonize_parametric(bridge_parametric.railingbottom1, vertices, faces)
-            vertices, faces = self.polygonize_parametric(bridge_parametric.railingtop1, vertices, faces)
-            vertices, faces = self.polygonize_alternate_v(bridge_parametric.railingbottom0, bridge_parametric.railingtop0, 0, vertices, faces)
-            vertices, faces = self.polygonize_alternate_v(bridge_parametric.railingbottom0, bridge_parametric.railingtop0, 1, vertices, faces)
-            vertices, faces = self.polygonize_alternate_v(bridge_parametric.railingbottom1, bridge_parametric.railingtop1, 0, vertices, faces)
-            vertices, faces = self.polygonize_alternate_v(bridge_parametric.railingbottom1, bridge_parametric.railingtop1, 1, vertices, faces)
-
-            vertices, faces = self.polygonize_parametric(bridge_parametric.railingbottom2, vertices, faces)
-            vertices, faces = self.polygonize_parametric(bridge_parametric.railingtop2, vertices, faces)
-            vertices, faces = self.polygonize_parametric(bridge_parametric.railingbottom3, vertices, faces)
-            vertices, faces = self.polygonize_parametric(bridge_parametric.railingtop3, vertices, faces)
-            vertices, faces = self.polygonize_alternate_v(bridge_parametric.railingbottom2, bridge_parametric.railingtop2, 0, vertices, faces)
-            vertices, faces = self.polygonize_alternate_v(bridge_parametric.railingbottom2, bridge_parametric.railingtop2, 1, vertices, faces)
-            vertices, faces = self.polygonize_alternate_v(bridge_parametric.railingbottom3, bridge_parametric.railingtop3, 0, vertices, faces)
-            vertices, faces = self.polygonize_alternate_v(bridge_parametric.railingbottom3, bridge_parametric.railingtop3, 1, vertices, faces)
+            self.polygonize_parametric(bridge_parametric.railingbottom0, builder)
+            self.polygonize_parametric(bridge_parametric.railingtop0, builder)
+            self.polygonize_parametric(bridge_parametric.railingbottom1, builder)
+            self.polygonize_parametric(bridge_parametric.railingtop1, builder)
+            self.polygonize_alternate_v(bridge_parametric.railingbottom0, bridge_parametric.railingtop0, 0, builder)
+            self.polygonize_alternate_v(bridge_parametric.railingbottom0, bridge_parametric.railingtop0, 1, builder)
+            self.polygonize_alternate_v(bridge_parametric.railingbottom1, bridge_parametric.railingtop1, 0, builder)
+            self.polygonize_alternate_v(bridge_parametric.railingbottom1, bridge_parametric.railingtop1, 1, builder)
+
+            self.polygonize_parametric(bridge_parametric.railingbottom2, builder)
+            self.polygonize_parametric(bridge_parametric.railingtop2, builder)
+            self.polygonize_parametric(bridge_parametric.railingbottom3, builder)
+            self.polygonize_parametric(bridge_parametric.railingtop3, builder)
+            self.polygonize_alternate_v(bridge_parametric.railingbottom2, bridge_parametric.railingtop2, 0, builder)
+            self.polygonize_alternate_v(bridge_parametric.railingbottom2, bridge_parametric.railingtop2, 1, builder)
+            self.polygonize_alternate_v(bridge_parametric.railingbottom3, bridge_parametric.railingtop3, 0, builder)
+            self.polygonize_alternate_v(bridge_parametric.railingbottom3, bridge_parametric.railingtop3, 1, builder)
 
             post_step = 1 / (self.nposts+1)
             for i in range(1, self.nposts+1):
-                vertices, faces = self.polygonize_parametric(bridge_parametric.railingpostfront0(i*post_step, 0, 0), vertices, faces)
-                vertices, faces = self.polygonize_parametric(bridge_parametric.railingpostfront0(i*post_step, 0, self.railing_length), vertices, faces)
-                vertices, faces = self.polygonize_parametric(bridge_parametric.railingpostside0(i*post_step, 0, 0), vertices, faces)
-                vertices, faces = self.polygonize_parametric(bridge_parametric.railingpostside0(i*post_step, 0, self.railing_width*(2*self.width)), vertices, faces)
-
-                vertices, faces = self.polygonize_parametric(bridge_parametric.railingpostfront1(i*post_step, 0, 0), vertices, faces)
-                vertices, faces = self.polygonize_parametric(bridge_parametric.railingpostfront1(i*post_step, 0, -self.railing_width), vertices, faces)
-                vertices, faces = self.polygonize_parametric(bridge_parametric.railingpostside1(i*post_step, 0, 0), vertices, faces)
-                vertices, faces = self.polygonize_parametric(bridge_parametric.railingpostside1(i*post_step, 0, self.railing_width*(2*self.width)), vertices, faces)
-
-                vertices, faces = self.polygonize_parametric(bridge_parametric.railingpostfront0(i*post_step, 1, 0), vertices, faces)
-                vertices, faces = self.polygonize_parametric(bridge_parametric.railingpostfront0(i*post_step, 1, self.railing_width), vertices, faces)
-                vertices, faces = self.polygonize_parametric(bridge_parametric.railingpostside0(i*post_step, 1, 0), vertices, faces)
-                vertices, faces = self.polygonize_parametric(bridge_parametric.railingpostside0(i*post_step, 1, self.railing_width*(-2*self.width)), vertices, faces)
-
-                vertices, faces = self.polygonize_parametric(bridge_parametric.railingpostfront1(i*post_step, 1, 0), vertices, faces)
-                vertices, faces = self.polygonize_parametric(bridge_parametric.railingpostfront1(i*post_step, 1, -self.railing_length), vertices, faces)
-                vertices, faces = self.polygonize_parametric(bridge_parametric.railingpostside1(i*post_step, 1, 0), vertices, faces)
-                vertices, faces = self.polygonize_parametric(bridge_parametric.railingpostside1(i*post_step, 1, self.railing_width*(-2*self.width)), vertices, faces)
-
-        # Generate the mesh from (vertices, faces)
+                self.polygonize_parametric(bridge_parametric.railingpostfront0(i*post_step, 0, 0), builder)
+                self.polygonize_parametric(bridge_parametric.railingpostfront0(i*post_step, 0, self.railing_length), builder)
+                self.polygonize_parametric(bridge_parametric.railingpostside0(i*post_step, 0, 0), builder)
+                self.polygonize_parametric(bridge_parametric.railingpostside0(i*post_step, 0, self.railing_width*(2*self.width)), builder)
+
+                self.polygonize_parametric(bridge_parametric.railingpostfront1(i*post_step, 0, 0), builder)
+                self.polygonize_parametric(bridge_parametric.railingpostfront1(i*post_step, 0, -self.railing_width), builder)
+                self.polygonize_parametric(bridge_parametric.railingpostside1(i*post_step, 0, 0), builder)
+                self.polygonize_parametric(bridge_parametric.railingpostside1(i*post_step, 0, self.railing_width*(2*self.width)), builder)
+
+                self.polygonize_parametric(bridge_parametric.railingpostfront0(i*post_step, 1, 0), builder)
+                self.polygonize_parametric(bridge_parametric.railingpostfront0(i*post_step, 1, self.railing_width), builder)
+                self.polygonize_parametric(bridge_parametric.railingpostside0(i*post_step, 1, 0), builder)
+                self.polygonize_parametric(bridge_parametric.railingpostside0(i*post_step, 1, self.railing_width*(-2*self.width)), builder)
+
+                self.polygonize_parametric(bridge_parametric.railingpostfront1(i*post_step, 1, 0), builder)
+                self.polygonize_parametric(bridge_parametric.railingpostfront1(i*post_step, 1, -self.railing_length), builder)
+                self.polygonize_parametric(bridge_parametric.railingpostside1(i*post_step, 1, 0), builder)
+                self.polygonize_parametric(bridge_parametric.railingpostside1(i*post_step, 1, self.railing_width*(-2*self.width)), builder)
+
+        # Generate the mesh from the builder's buffers
         mesh = bpy.data.meshes.new("Generated")
-        mesh.from_pydata(vertices, [], faces)
-        mesh.update()
+        builder.tomesh(mesh)
         obj = bpy.data.objects.new("Generated", mesh)
         context.collection.objects.link(obj)
         bpy.ops.object.select_all(action="DESELECT")
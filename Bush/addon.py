@@ -6,7 +6,13 @@ import bpy
 import mathutils
 import lturtle
 import lsystems
+import lstring
+import batchturtle
+import peephole
+import meshbuilder
+import decimate
 import lturtlealphabet as la
+import grammar
 
 
 bl_info = {
@@ -21,174 +27,56 @@ class BushOperator(bpy.types.Operator):
     bl_idname = "mesh.bush_generator"
     bl_label = "Bush Generator"
 
-    axiom = [la.TurtleA()]
-    rules = [
-        # + yaw_left
-        # - yaw_right
-        # & pitch_down
-        # ^ pitch_up
-        # \ roll_left
-        # / roll_right
-        # | yaw_left(pi)
-
-        ((0.34, la.TurtleA), lambda _: [
-            la.TurtlePush(),            # [
-            la.TurtlePitchDown(),       # &
-            la.TurtleForward(),         # F
-            la.TurtleL(),               # L
-            la.TurtleA(),               # A
-            la.TurtlePop(),             # ]
-            la.TurtleRollRight(),       # /
-            la.TurtleRollRight(),       # /
-            la.TurtleRollRight(),       # /
-            la.TurtleRollRight(),       # /
-            la.TurtleRollRight(),       # /
-            la.TurtlePush(),            # [
-            la.TurtlePitchDown(),       # &
-            la.TurtleForward(),         # F
-            la.TurtleL(),               # L
-            la.TurtleA(),               # A
-            la.TurtlePop(),             # ]
-            la.TurtleRollRight(),       # /
-            la.TurtleRollRight(),       # /
-            la.TurtleRollRight(),       # /
-            la.TurtleRollRight(),       # /
-            la.TurtleRollRight(),       # /
-            la.TurtleRollRight(),       # /
-            la.TurtleRollRight(),       # /
-            la.TurtlePush(),            # [
-            la.TurtleForward(),         # F
-            la.TurtleB(),               # B
-            la.TurtleA(),               # A
-            la.TurtlePop(),             # ]
-        ]),
-        ((0.33, la.TurtleA), lambda _: [
-            la.TurtlePush(),            # [
-            la.TurtlePitchDown(),       # &
-            la.TurtleL(),               # L
-            la.TurtleA(),               # A
-            la.TurtlePop(),             # ]
-            la.TurtleRollRight(),       # /
-            la.TurtleRollRight(),       # /
-            la.TurtleRollRight(),       # /
-            la.TurtleRollRight(),       # /
-            la.TurtleRollRight(),       # /
-            la.TurtlePush(),            # [
-            la.TurtlePitchDown(),       # &
-            la.TurtleForward(),         # F
-            la.TurtleL(),               # L
-            la.TurtleA(),               # A
-            la.TurtlePop(),             # ]
-            la.TurtleRollRight(),       # /
-            la.TurtleRollRight(),       # /
-            la.TurtleRollRight(),       # /
-            la.TurtleRollRight(),       # /
-            la.TurtleRollRight(),       # /
-            la.TurtleRollRight(),       # /
-            la.TurtleRollRight(),       # /
-            la.TurtlePush(),            # [
-            la.TurtleForward(),         # F
-            la.TurtleB(),               # B
-            la.TurtleA(),               # A
-            la.TurtlePop(),             # ]
-        ]),
-        ((0.33, la.TurtleA), lambda _: [
-            la.TurtlePush(),            # [
-            la.TurtlePitchDown(),       # &
-            la.TurtleForward(),         # F
-            la.TurtleL(),               # L
-            la.TurtleA(),               # A
-            la.TurtlePop(),             # ]
-            la.TurtleRollRight(),       # /
-            la.TurtleRollRight(),       # /
-            la.TurtleRollRight(),       # /
-            la.TurtleRollRight(),       # /
-            la.TurtleRollRight(),       # /
-            la.TurtlePush(),            # [
-            la.TurtlePitchDown(),       # &
-            la.TurtleL(),               # L
-            la.TurtleA(),               # A
-            la.TurtlePop(),             # ]
-        ]),
-        ((1, la.TurtleForward), lambda _: [
-            la.TurtleS(),               # S
-            la.TurtleRollRight(),       # /
-            la.TurtleRollRight(),       # /
-            la.TurtleRollRight(),       # /
-            la.TurtleRollRight(),       # /
-            la.TurtleRollRight(),       # /
-            la.TurtleForward(),         # F
-        ]),
-        ((1, la.TurtleS), lambda _: [
-            la.TurtleForward(),         # F
-            la.TurtleL(),               # L
-        ]),
-        ((1, la.TurtleL), lambda _: [
-            la.TurtlePush(),            # [
-            la.TurtlePitchUp(),         # ^
-            la.TurtlePitchUp(),         # ^
-            la.TurtleStartPoly(),       # {
-            la.TurtleYawRight(),        # -
-            la.TurtleSkip(),            # f
-            la.TurtleYawLeft(),         # +
-            la.TurtleSkip(),            # f
-            la.TurtleYawLeft(),         # +
-            la.TurtleSkip(),            # f
-            la.TurtleYawRight(),        # -
-            la.TurtleYawLeft(math.pi),  # |
-            la.TurtleYawRight(),        # -
-            la.TurtleSkip(),            # f
-            la.TurtleYawLeft(),         # +
-            la.TurtleSkip(),            # f
-            la.TurtleYawLeft(),         # +
-            la.TurtleSkip(),            # f
-            la.TurtleEndPoly(),         # }
-            la.TurtlePop(),             # ]
-        ]),
-        ((1, la.TurtleB), lambda _: [
-            la.TurtlePush(),            # [
-            la.TurtleYawRight(),        # -
-            la.TurtleForward(),         # F
-            la.TurtleFlower(),          # Flower
-            la.TurtlePop(),             # ]
-        ]),
-    ]
+    axiom = grammar.axiom
+    rules = lsystems.compile_rules(grammar.rules, stochastic=True)
+
+    alphabet = lstring.Alphabet.frommodule(la)
 
     depth: bpy.props.IntProperty(name="Depth", min=1, max=10, default=7)
     stepsize: bpy.props.FloatProperty(name="Step Size", default=0.5)
     stepangle: bpy.props.FloatProperty(name="Step Angle", min=0, max=360, default=22.5)
     radius: bpy.props.FloatProperty(name="Radius", default=0.1)
+    decimate_target: bpy.props.IntProperty(name="Decimate to Faces (0 = Off)", min=0, default=0)
+    decimate_tolerance: bpy.props.FloatProperty(name="Decimate Tolerance (0 = Off)", min=0, default=0, precision=4)
 
     def invoke(self, context, event):
         wm = context.window_manager
         return wm.invoke_props_dialog(self)
 
-    def addface(self, *verts):
-        i = len(self.vertices)
-        for vert in verts:
-            self.vertices.append(vert)
-        self.faces.append([i+k for k in range(len(verts))])
-
     def execute(self, context):
-        instructions = lsystems.lsystem_stochastic_evolve(self.axiom, self.rules, self.depth)
-
-        self.vertices = []
-        self.faces = []
-        turtle = lturtle.Turtle(mathutils.Vector((0, 0, 0)),
-                                mathutils.Vector((0, 0, 1)),
-                                mathutils.Vector((0, 1, 0)),
-                                mathutils.Vector((1, 0, 0)),
-                                self.stepsize,
-                                math.radians(self.stepangle),
-                                self.radius,
-                                self.addface)
-
-        lsystems.doturtle(instructions, turtle, [])
-
-        # Generate the mesh from (vertices, faces)
+        optimizer = peephole.Peephole(math.radians(self.stepangle), self.stepsize)
+        instructions = lstring.SymbolString.fromlist(self.alphabet, optimizer.optimize(lsystems.lsystem_stochastic_expand(self.axiom, self.rules, self.depth)))
+
+        turtle = batchturtle.BatchTurtle((0, 0, 0), (0, 0, 1), (0, 1, 0), (1, 0, 0),
+                                         self.stepsize,
+                                         math.radians(self.stepangle),
+                                         self.radius)
+        turtle.run(instructions)
+        self.report({"INFO"}, "Peephole: " + optimizer.summary())
+        builder = turtle.tobuilder(meshbuilder.MeshBuilder())
+
+        # Symbols with their own geometry (flowers) are replayed on a regular
+        # turtle placed where the batch turtle met them
+        for symbol, position, direction, up, left in turtle.markers:
+            marker = lturtle.Turtle(mathutils.Vector(position),
+                                    mathutils.Vector(direction),
+                                    mathutils.Vector(up),
+                                    mathutils.Vector(left),
+                                    self.stepsize,
+                                    math.radians(self.stepangle),
+                                    self.radius,
+                                    builder.addface)
+            symbol.do(marker, [])
+
+        if self.decimate_target or self.decimate_tolerance:
+            builder = decimate.decimate(builder, self.decimate_target or None, self.decimate_tolerance or None)
+            message = decimate.missed(builder, self.decimate_target)
+            if message:
+                self.report({"WARNING"}, message)
+
+        # Generate the mesh from the builder's buffers
         mesh = bpy.data.meshes.new("Generated")
-        mesh.from_pydata(self.vertices, [], self.faces)
-        mesh.update()
+        builder.tomesh(mesh)
         obj = bpy.data.objects.new("Generated", mesh)
         context.collection.objects.link(obj)
         bpy.ops.object.select_all(action="DESELECT")
@@ -0,0 +1,452 @@
+# vim: fdm=manual
+import math
+import numpy as np
+import lsystems
+import lstring
+
+
+# Batch turtle interpreter. Runs a SymbolString (see lstring.py) with the
+# same semantics as lturtle.Turtle, but keeps the turtle state in plain
+# floats and records every forward step as a row of a preallocated NumPy
+# array; the cylinder quads for all segments are then built in one pass,
+# either laid out like Turtle.forward (cylinders) or indexed (rings).
+# Needs neither bpy nor mathutils.
+
+FORWARD, SKIP, YAW_LEFT, YAW_RIGHT, PITCH_UP, PITCH_DOWN, ROLL_LEFT, ROLL_RIGHT, \
+    PUSH, POP, SET_RADIUS, START_POLY, END_POLY, HORIZ, NOP, MARKER = range(16)
+
+ACTIONS = {
+    "forward": FORWARD,
+    "skip": SKIP,
+    "yaw_left": YAW_LEFT,
+    "yaw_right": YAW_RIGHT,
+    "pitch_up": PITCH_UP,
+    "pitch_down": PITCH_DOWN,
+    "roll_left": ROLL_LEFT,
+    "roll_right": ROLL_RIGHT,
+    "push": PUSH,
+    "pop": POP,
+    "set_radius": SET_RADIUS,
+    "startpoly": START_POLY,
+    "endpoly": END_POLY,
+    "horiz": HORIZ,
+}
+
+# Segment record columns
+START = slice(0, 3)
+VECTOR = slice(3, 6)
+UP = slice(6, 9)
+LEFT = slice(9, 12)
+RADIUS = 12
+PREVIOUS = 13  # segment whose end ring this one starts on, or -1
+SEGMENT_WIDTH = 14
+
+
+def action_code(cls):
+    if cls.action is None:
+        # Symbols with a custom do() (e.g. flowers) are reported as markers
+        return NOP if cls.do is lsystems.TurtleSymbol.do else MARKER
+    if cls.action not in ACTIONS:
+        raise ValueError("Batch turtle cannot run symbol %s (action %s)" % (cls.__name__, cls.action))
+    return ACTIONS[cls.action]
+
+
+def rodrigues(v, a, c, s):
+    vx, vy, vz = v
+    ax, ay, az = a
+    k = (ax*vx + ay*vy + az*vz)*(1 - c)
+    return (vx*c + (ay*vz - az*vy)*s + ax*k,
+            vy*c + (az*vx - ax*vz)*s + ay*k,
+            vz*c + (ax*vy - ay*vx)*s + az*k)
+
+
+def cross(a, b):
+    return (a[1]*b[2] - a[2]*b[1], a[2]*b[0] - a[0]*b[2], a[0]*b[1] - a[1]*b[0])
+
+
+def normalized(v):
+    length = math.sqrt(v[0]*v[0] + v[1]*v[1] + v[2]*v[2])
+    if length == 0:
+        return v
+    return (v[0]/length, v[1]/length, v[2]/length)
+
+
+class BatchTurtle(object):
+    """ Interprets a whole SymbolString and produces NumPy geometry buffers """
+    def __init__(self, position, direction, up, left, stepsize, stepangle, radius):
+        self.position = tuple(position)
+        self.direction = tuple(direction)
+        self.up = tuple(up)
+        self.left = tuple(left)
+        self.stepsize = stepsize
+        self.stepangle = stepangle
+        self.radius = radius
+
+        self.segments = np.empty((0, SEGMENT_WIDTH))
+        self.polygons = []
+        self.markers = []
+
+    def run(self, string):
+        alphabet = string.alphabet
+        codes = [action_code(cls) for cls in alphabet.classes]
+        opcodes = np.frombuffer(string.opcodes, dtype=np.uint8)
+        table = np.array(codes, dtype=np.int8)[opcodes] if len(opcodes) else np.empty(0, dtype=np.int8)
+
+        # Size the segment buffer and the branch stack exactly up front
+        segments = np.empty((int(np.count_nonzero(table == FORWARD)), SEGMENT_WIDTH))
+        nesting = np.cumsum((table == PUSH).astype(np.int64) - (table == POP))
+        stack = [None]*(int(nesting.max()) if len(nesting) and nesting.max() > 0 else 0)
+        depth = 0
+        nsegments = 0
+
+        P, D, U, L = self.position, self.direction, self.up, self.left
+        stepsize, stepangle, radius = self.stepsize, self.stepangle, self.radius
+        inpoly, polyverts = False, []
+        ring = -1
+        trig = {}
+
+        for op, code, value in zip(string.opcodes, table.tolist(), string.params):
+            if code == NOP:
+                continue
+            amount = None if value != value else value
+
+            if code <= ROLL_RIGHT and code >= YAW_LEFT:
+                theta = stepangle if amount is None else amount
+                if code == YAW_LEFT or code == PITCH_DOWN or code == ROLL_LEFT:
+                    theta = -theta
+                try:
+                    c, s = trig[theta]
+                except KeyError:
+                    c, s = trig[theta] = math.cos(theta), math.sin(theta)
+                if code == YAW_LEFT or code == YAW_RIGHT:
+                    D, L = rodrigues(D, U, c, s), rodrigues(L, U, c, s)
+                elif code == PITCH_UP or code == PITCH_DOWN:
+                    D, U = rodrigues(D, L, c, s), rodrigues(U, L, c, s)
+                else:
+                    U, L = rodrigues(U, D, c, s), rodrigues(L, D, c, s)
+                ring = -1
+            elif code == FORWARD or code == SKIP:
+                step = stepsize if amount is None else amount
+                V = (step*D[0], step*D[1], step*D[2])
+                if code == FORWARD:
+                    segments[nsegments] = (P[0], P[1], P[2], V[0], V[1], V[2],
+                                           U[0], U[1], U[2], L[0], L[1], L[2], radius, ring)
+                    ring = nsegments
+                    nsegments += 1
+                else:
+                    ring = -1
+                P = (P[0] + V[0], P[1] + V[1], P[2] + V[2])
+                if inpoly:
+                    polyverts.append(P)
+            elif code == PUSH:
+                stack[depth] = (P, D, U, L, stepsize, radius, inpoly, polyverts, ring)
+                depth += 1
+            elif code == POP:
+                if depth == 0:
+                    raise IndexError("pop from empty turtle stack")
+                depth -= 1
+                P, D, U, L, stepsize, radius, inpoly, polyverts, ring = stack[depth]
+            elif code == SET_RADIUS:
+                radius = amount
+                ring = -1
+            elif code == START_POLY:
+                inpoly = True
+                polyverts = [P]
+            elif code == END_POLY:
+                self.polygons.append(polyverts)
+                inpoly = False
+            elif code == HORIZ:
+                U, L = cross(D, L), normalized(cross(L, D))
+                ring = -1
+            elif code == MARKER:
+                self.markers.append((alphabet.decode(op, value), P, D, U, L))
+
+        self.position, self.direction, self.up, self.left = P, D, U, L
+        self.radius = radius
+        self.segments = segments[:nsegments]
+        return self
+
+    def run_memo(self, axiom, rules, depth, lengths=()):
+        """
+        Expands a deterministic L-system and runs it in one pass, without
+        building the string: the segments of every subtree are recorded
+        relative to the turtle frame it started in, and repeated subtrees are
+        emitted as rotated, translated and (see lstring.homogeneous) scaled
+        copies. Every turtle operation, horiz included, only combines the
+        turtle's own vectors, so the copies match running the string.
+        """
+        run = MemoRun(self, lsystems.compile_rules(rules), lengths)
+        state = (self.position, self.direction, self.up, self.left, self.stepsize, self.radius, -1, False, [])
+        for symbol in axiom:
+            state = run.expand(symbol, depth, state)
+        self.position, self.direction, self.up, self.left = state[:4]
+        self.radius = state[5]
+        self.segments = run.collect(0)
+        return self
+
+    def cylinders(self):
+        """ Four quads per segment, laid out exactly as Turtle.forward emits them """
+        segments = self.segments
+        start = segments[:, START]
+        vector = segments[:, VECTOR][:, None, :]
+        radius = segments[:, RADIUS:RADIUS+1]
+        up = radius*segments[:, UP]
+        left = radius*segments[:, LEFT]
+
+        # north, east, south, west
+        ring = np.stack([start - up, start - left, start + up, start + left], axis=1)
+        following = np.roll(ring, -1, axis=1)
+        vertices = np.stack([ring, ring + vector, following + vector, following], axis=2).reshape(-1, 3)
+        faces = np.arange(len(vertices), dtype=np.int32).reshape(-1, 4)
+        return vertices, faces
+
+    def rings(self):
+        """
+        Indexed cylinders: each segment owns the ring of four vertices at its
+        end and starts on the end ring of the segment it continues (when the
+        turtle moved straight on from it), so a straight run of n segments
+        has 4*(n+1) vertices instead of 16*n.
+        """
+        segments = self.segments
+        n = len(segments)
+        start = segments[:, START]
+        radius = segments[:, RADIUS:RADIUS+1]
+        up = radius*segments[:, UP]
+        left = radius*segments[:, LEFT]
+        previous = segments[:, PREVIOUS].astype(np.int64)
+
+        ring = np.stack([start - up, start - left, start + up, start + left], axis=1)
+        ends = ring + segments[:, VECTOR][:, None, :]
+        opens = np.flatnonzero(previous < 0)
+
+        # Vertices: all end rings, then the start rings of segments that
+        # do not continue another one
+        vertices = np.concatenate([ends.reshape(-1, 3), ring[opens].reshape(-1, 3)])
+        startring = np.empty(n, dtype=np.int64)
+        startring[opens] = n + np.arange(len(opens))
+        continued = previous >= 0
+        startring[continued] = previous[continued]
+
+        corner = np.arange(4)
+        s = (4*startring)[:, None] + corner
+        e = (4*np.arange(n))[:, None] + corner
+        s1 = np.roll(s, -1, axis=1)
+        e1 = np.roll(e, -1, axis=1)
+        faces = np.stack([s, e, e1, s1], axis=2).reshape(-1, 4).astype(np.int32)
+        return vertices, faces
+
+    def tobuilder(self, builder):
+        """ Adds the indexed cylinders and the polygons to a MeshBuilder """
+        builder.add_mesh(*self.rings())
+        for polygon in self.polygons:
+            builder.add_face([builder.add_vertex(vert) for vert in polygon])
+        return builder
+
+
+def basis(D, U):
+    """ Orthonormal basis (as columns) with D first and U in the plane of the first two, or None """
+    e1 = np.asarray(D, dtype=np.float64)
+    e1 = e1/np.linalg.norm(e1)
+    e2 = np.asarray(U, dtype=np.float64)
+    e2 = e2 - np.dot(e2, e1)*e1
+    norm = np.linalg.norm(e2)
+    if norm < 1e-9:
+        return None
+    e2 = e2/norm
+    return np.column_stack([e1, e2, np.cross(e1, e2)])
+
+
+class MemoRun(object):
+    """
+    State of one BatchTurtle.run_memo. The turtle state is the tuple
+    (P, D, U, L, stepsize, radius, ring, inpoly, polyverts) as in run().
+
+    A subtree is recorded when it can be replayed from its start state
+    alone: it keeps to its own pushes and pops, and adds no polygons or
+    markers. Recordings are keyed by symbol type, remaining depth, parameter
+    (or only the type for homogeneous rules), stepsize, radius and whether
+    the first segment may continue an earlier one. Subtrees of less than
+    mindepth levels are cheaper to run again than to copy.
+    """
+    def __init__(self, turtle, rules, lengths, mindepth=4):
+        self.rules = rules
+        self.lengths = tuple(lengths)
+        self.mindepth = mindepth
+        self.stepangle = turtle.stepangle
+        self.polygons = turtle.polygons
+        self.markers = turtle.markers
+        self.codes = {}
+        self.names = {}
+        self.scalable = {}
+        self.memo = {}
+        self.trig = {}
+
+        self.blocks = []
+        self.rows = []
+        self.nsegments = 0
+        self.stack = []
+        self.floor = 0
+        self.unsafe = 0
+        self.defaults = 0
+
+    def collect(self, first):
+        """ Segments from index first on, as one array """
+        if self.rows:
+            self.blocks.append((self.nsegments - len(self.rows), np.array(self.rows, dtype=np.float64).reshape(-1, SEGMENT_WIDTH)))
+            self.rows = []
+        parts = [block[max(first - start, 0):] for start, block in self.blocks if start + len(block) > first]
+        return np.concatenate(parts) if parts else np.empty((0, SEGMENT_WIDTH))
+
+    def emit(self, segments):
+        self.collect(self.nsegments)
+        self.blocks.append((self.nsegments, segments))
+        self.nsegments += len(segments)
+
+    def expand(self, symbol, remaining, state):
+        cls = type(symbol)
+        secondary = self.rules.successor(cls) if remaining > 0 else None
+        if secondary is None:
+            return self.step(symbol, state)
+
+        if remaining < self.mindepth:
+            for child in secondary(symbol):
+                state = self.expand(child, remaining - 1, state)
+            return state
+
+        scale, key = self.key(symbol, remaining, state)
+        for entry in self.memo.get(key, ()):
+            end = self.instance(entry, scale, state)
+            if end is not None:
+                return end
+
+        start, first, depth = state, self.nsegments, len(self.stack)
+        floor, unsafe, defaults = self.floor, self.unsafe, self.defaults
+        self.floor = depth
+        for child in secondary(symbol):
+            state = self.expand(child, remaining - 1, state)
+        # Default steps follow the turtle's stepsize, which does not scale
+        balanced = self.floor >= depth and len(self.stack) == depth
+        if key is not None and balanced and self.unsafe == unsafe and not state[7] \
+                and (key[2] is not None or self.defaults == defaults) and len(self.memo.get(key, ())) < 4:
+            self.record(key, scale, start, first, state)
+        self.floor = min(floor, self.floor)
+        return state
+
+    def key(self, symbol, remaining, state):
+        if state[7]:
+            return 1, None
+        cls = type(symbol)
+        if cls not in self.scalable:
+            self.names[cls] = lstring.param_name(cls)
+            self.scalable[cls] = lstring.homogeneous(self.rules, cls, self.lengths)
+        value = getattr(symbol, self.names[cls]) if self.names[cls] is not None else None
+        if self.scalable[cls] and value:
+            return value, (cls, remaining, None, state[4], state[5], state[6] >= 0)
+        return 1, (cls, remaining, value, state[4], state[5], state[6] >= 0)
+
+    def record(self, key, scale, start, first, end):
+        P0, D0, U0, L0, ring0 = np.array(start[0]), start[1], start[2], start[3], start[6]
+        B0 = basis(D0, U0)
+        if B0 is None:
+            return
+        segments = self.collect(first).copy()
+        previous = segments[:, PREVIOUS]
+        segments[:, START] = (segments[:, START] - P0)/scale
+        segments[:, VECTOR] /= scale
+        segments[:, PREVIOUS] = np.where(previous >= first, previous - first, np.where(previous < 0, -1, -2))
+        ring = end[6]
+        ring = ring - first if ring >= first else (-1 if ring < 0 else -2)
+        self.memo.setdefault(key, []).append((B0, np.array([D0, U0, L0]), segments,
+                                              (np.array(end[0]) - P0)/scale, np.array(end[1:4]), ring, end[4], end[5]))
+
+    def instance(self, entry, scale, state):
+        B0, frame, segments, position, endframe, endring, stepsize, radius = entry
+        P, ring = state[0], state[6]
+        B = basis(state[1], state[2])
+        if B is None:
+            return None
+        Q = B @ B0.T
+        if not np.allclose(frame @ Q.T, state[1:4], rtol=0, atol=1e-9):
+            return None
+
+        copies = np.empty_like(segments)
+        copies[:, START] = np.array(P) + scale*(segments[:, START] @ Q.T)
+        copies[:, VECTOR] = scale*(segments[:, VECTOR] @ Q.T)
+        copies[:, UP] = segments[:, UP] @ Q.T
+        copies[:, LEFT] = segments[:, LEFT] @ Q.T
+        copies[:, RADIUS] = segments[:, RADIUS]
+        previous = segments[:, PREVIOUS]
+        copies[:, PREVIOUS] = np.where(previous >= 0, previous + self.nsegments, np.where(previous == -2, ring, -1))
+        first = self.nsegments
+        self.emit(copies)
+
+        P = tuple((np.array(P) + scale*(Q @ position)).tolist())
+        D, U, L = [tuple(vector) for vector in (endframe @ Q.T).tolist()]
+        ring = endring + first if endring >= 0 else (ring if endring == -2 else -1)
+        return (P, D, U, L, stepsize, radius, ring, False, [])
+
+    def step(self, symbol, state):
+        """ One terminal symbol, as BatchTurtle.run runs it """
+        cls = type(symbol)
+        try:
+            code = self.codes[cls]
+        except KeyError:
+            code = self.codes[cls] = action_code(cls)
+        if code == NOP:
+            return state
+        P, D, U, L, stepsize, radius, ring, inpoly, polyverts = state
+        amount = getattr(symbol, "amount", None)
+
+        if code <= ROLL_RIGHT and code >= YAW_LEFT:
+            theta = self.stepangle if amount is None else amount
+            if code == YAW_LEFT or code == PITCH_DOWN or code == ROLL_LEFT:
+                theta = -theta
+            try:
+                c, s = self.trig[theta]
+            except KeyError:
+                c, s = self.trig[theta] = math.cos(theta), math.sin(theta)
+            if code == YAW_LEFT or code == YAW_RIGHT:
+                D, L = rodrigues(D, U, c, s), rodrigues(L, U, c, s)
+            elif code == PITCH_UP or code == PITCH_DOWN:
+                D, U = rodrigues(D, L, c, s), rodrigues(U, L, c, s)
+            else:
+                U, L = rodrigues(U, D, c, s), rodrigues(L, D, c, s)
+            ring = -1
+        elif code == FORWARD or code == SKIP:
+            if amount is None:
+                self.defaults += 1
+            step = stepsize if amount is None else amount
+            V = (step*D[0], step*D[1], step*D[2])
+            if code == FORWARD:
+                self.rows.append((P[0], P[1], P[2], V[0], V[1], V[2],
+                                  U[0], U[1], U[2], L[0], L[1], L[2], radius, ring))
+                ring = self.nsegments
+                self.nsegments += 1
+            else:
+                ring = -1
+            P = (P[0] + V[0], P[1] + V[1], P[2] + V[2])
+            if inpoly:
+                polyverts.append(P)
+        elif code == PUSH:
+            self.stack.append(state)
+        elif code == POP:
+            P, D, U, L, stepsize, radius, ring, inpoly, polyverts = self.stack.pop()
+            self.floor = min(self.floor, len(self.stack))
+        elif code == SET_RADIUS:
+            radius = amount
+            ring = -1
+        elif code == START_POLY:
+            self.unsafe += 1
+            inpoly = True
+            polyverts = [P]
+        elif code == END_POLY:
+            self.unsafe += 1
+            self.polygons.append(polyverts)
+            inpoly = False
+        elif code == HORIZ:
+            U, L = cross(D, L), normalized(cross(L, D))
+            ring = -1
+        elif code == MARKER:
+            self.unsafe += 1
+            self.markers.append((symbol, P, D, U, L))
+        return (P, D, U, L, stepsize, radius, ring, inpoly, polyverts)
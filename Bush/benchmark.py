@@ -0,0 +1,84 @@
+# vim: fdm=manual
+import random
+import sys
+import math
+import time
+import lsystems
+import lstring
+import batchturtle
+import peephole
+import grammar
+import lturtlealphabet as la
+
+
+def timeit(f, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        f()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def scan_stochastic_expand(axiom, rules, depth):
+    # Reference: linear isinstance scan over every rule for every symbol
+    stack = [(iter(axiom), depth)]
+    while stack:
+        symbols, remaining = stack[-1]
+        for symbol in symbols:
+            if remaining > 0:
+                rand = random.random()
+                rsum = 0
+                for (prob, primary), secondary in lsystems.rule_items(rules):
+                    if isinstance(symbol, primary):
+                        rsum += prob
+                        if rand < rsum:
+                            break
+                else:
+                    secondary = None
+                if secondary is not None:
+                    stack.append((iter(secondary(symbol)), remaining-1))
+                    break
+                if rsum > 0:
+                    # Missed every rule: try again next generation
+                    stack.append((iter((symbol,)), remaining-1))
+                    break
+            yield symbol
+        else:
+            stack.pop()
+
+
+def bench_rules(depth):
+    nsymbols = sum(1 for _ in lsystems.lsystem_stochastic_expand(grammar.axiom, grammar.rules, depth))
+    scan = timeit(lambda: sum(1 for _ in scan_stochastic_expand(grammar.axiom, grammar.rules, depth)))
+    table = lsystems.compile_rules(grammar.rules, stochastic=True)
+    compiled = timeit(lambda: sum(1 for _ in lsystems.lsystem_stochastic_expand(grammar.axiom, table, depth)))
+    print("rules     depth %2d  %8d symbols  scan %.3fs  compiled %.3fs  (%.2fx)" % (depth, nsymbols, scan, compiled, scan/compiled))
+
+
+def bench_string(depth):
+    symbols = lsystems.lsystem_stochastic_evolve(grammar.axiom, grammar.rules, depth)
+    objbytes = sum(sys.getsizeof(symbol) + sys.getsizeof(getattr(symbol, "__dict__", None)) for symbol in symbols)
+    string = lstring.SymbolString.fromlist(lstring.Alphabet.frommodule(la), symbols)
+    print("string    depth %2d  %8d symbols  objects %.1f B/symbol  arrays %.1f B/symbol" % (depth, len(symbols), objbytes/len(symbols), string.nbytes()/len(string)))
+
+
+def bench_peephole(depth):
+    random.seed(0)
+    symbols = lsystems.lsystem_stochastic_evolve(grammar.axiom, grammar.rules, depth)
+    optimizer = peephole.Peephole(math.radians(22.5), 0.5)
+    optimized = optimizer.optimize(symbols)
+    elapsed = timeit(lambda: peephole.optimize(symbols, math.radians(22.5), 0.5))
+    alphabet = lstring.Alphabet.frommodule(la)
+    turtle = batchturtle.BatchTurtle((0, 0, 0), (0, 0, 1), (0, 1, 0), (1, 0, 0), 0.5, math.radians(22.5), 0.1)
+    plain = timeit(lambda: turtle.run(lstring.SymbolString.fromlist(alphabet, symbols)))
+    fewer = timeit(lambda: turtle.run(lstring.SymbolString.fromlist(alphabet, optimized)))
+    print("peephole  depth %2d  %s  optimize %.3fs  turtle %.3fs -> %.3fs" % (depth, optimizer.summary(), elapsed, plain, fewer))
+
+
+if __name__ == "__main__":
+    bench_rules(7)
+    bench_string(7)
+    bench_peephole(7)
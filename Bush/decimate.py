@@ -0,0 +1,240 @@
+# vim: fdm=manual
+import numpy as np
+import meshbuilder
+
+
+# Quadric error metric simplification (Garland & Heckbert) on indexed
+# NumPy arrays. Every vertex carries the 4x4 quadric of the planes of its
+# original faces; collapsing an edge moves both ends to the point that
+# minimizes the sum of their quadrics, and the collapse costs the squared
+# distance sum at that point. Rather than popping edges off a heap one at
+# a time, every round collapses a batch of cheap edges whose neighbourhoods
+# do not touch, so all the bookkeeping stays vectorized.
+
+def triangulate(loops, starts, totals):
+    """ Fan-triangulates flat polygon buffers into an (M, 3) array """
+    ntris = np.maximum(totals - 2, 0)
+    owner = np.repeat(np.arange(len(totals)), ntris)
+    fan = np.arange(len(owner)) - np.repeat(np.cumsum(ntris) - ntris, ntris)
+    base = starts[owner]
+    return np.stack([loops[base], loops[base + fan + 1], loops[base + fan + 2]], axis=1)
+
+
+def accumulate(index, values, n):
+    """ Sums the rows of the (N, k) array values into n bins by index """
+    return np.stack([np.bincount(index, values[:, k], minlength=n) for k in range(values.shape[1])], axis=1)
+
+
+def expand(starts, counts):
+    """ Concatenated ranges starts[n]:starts[n] + counts[n], with the range number of every entry """
+    owner = np.repeat(np.arange(len(counts)), counts)
+    offsets = np.arange(len(owner)) - np.repeat(np.cumsum(counts) - counts, counts)
+    return owner, np.repeat(starts, counts) + offsets
+
+
+def planes(vertices, faces):
+    """ Unit face normals and (a, b, c, d) plane coefficients; degenerate faces get zero planes """
+    v0, v1, v2 = vertices[faces[:, 0]], vertices[faces[:, 1]], vertices[faces[:, 2]]
+    normals = np.cross(v1 - v0, v2 - v0)
+    length = np.linalg.norm(normals, axis=1)
+    normals = np.where(length[:, None] > 0, normals/np.where(length > 0, length, 1)[:, None], 0)
+    return normals, np.concatenate([normals, -np.einsum("ni,ni->n", normals, v0)[:, None]], axis=1)
+
+
+def edges_of(faces, nvertices):
+    """ Unique (a < b) edges, how many faces use each, and one face per edge """
+    a = faces.ravel()
+    b = np.roll(faces, -1, axis=1).ravel()
+    keys = np.minimum(a, b)*nvertices + np.maximum(a, b)
+    keys, first, counts = np.unique(keys, return_index=True, return_counts=True)
+    return np.stack([keys // nvertices, keys % nvertices], axis=1), counts, first // 3
+
+
+def quadrics(vertices, faces, boundary):
+    """ (V, 4, 4) quadrics of the face planes, plus weighted planes across boundary edges """
+    normals, p = planes(vertices, faces)
+    outer = (p[:, :, None]*p[:, None, :]).reshape(-1, 16)
+    q = accumulate(faces.ravel(), np.repeat(outer, 3, axis=0), len(vertices))
+
+    # Planes through each boundary edge, perpendicular to its face, keep open
+    # borders (the ends of branch tubes) from shrinking
+    edges, counts, face = edges_of(faces, len(vertices))
+    border = counts == 1
+    if boundary and np.any(border):
+        a, b = edges[border, 0], edges[border, 1]
+        m = np.cross(vertices[b] - vertices[a], normals[face[border]])
+        length = np.linalg.norm(m, axis=1)
+        m = np.where(length[:, None] > 0, m/np.where(length > 0, length, 1)[:, None], 0)
+        p = np.concatenate([m, -np.einsum("ni,ni->n", m, vertices[a])[:, None]], axis=1)
+        outer = boundary*(p[:, :, None]*p[:, None, :]).reshape(-1, 16)
+        q += accumulate(np.concatenate([a, b]), np.concatenate([outer, outer]), len(vertices))
+    return q.reshape(-1, 4, 4)
+
+
+def placement(q, va, vb):
+    """ Best position for collapsing edges with summed quadrics q, and its cost """
+    def cost(x):
+        return (np.einsum("ni,nij,nj->n", x, A, x, optimize=False) + 2*np.einsum("ni,ni->n", x, q[:, :3, 3])
+                + q[:, 3, 3])
+
+    # The quadric's minimizer where it is well defined and near the edge,
+    # otherwise the best of the two ends and the midpoint. A is symmetric,
+    # so Cramer's rule with cross products of its rows solves it
+    A = q[:, :3, :3]
+    mid = (va + vb)/2
+    c0, c1, c2 = np.cross(A[:, 1], A[:, 2]), np.cross(A[:, 2], A[:, 0]), np.cross(A[:, 0], A[:, 1])
+    det = np.einsum("ni,ni->n", A[:, 0], c0)
+    scale = np.maximum(A[:, 0, 0] + A[:, 1, 1] + A[:, 2, 2], 1e-300)
+    solvable = np.abs(det) > 1e-9*scale**3
+    rhs = -q[:, :3, 3]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        optimum = (c0*rhs[:, :1] + c1*rhs[:, 1:2] + c2*rhs[:, 2:])/det[:, None]
+    near = solvable & (np.einsum("ni,ni->n", optimum - mid, optimum - mid) <= np.einsum("ni,ni->n", vb - va, vb - va))
+    candidates = np.stack([va, vb, mid, np.where(near[:, None], optimum, mid)], axis=1)
+    costs = np.stack([cost(candidates[:, k]) for k in range(4)], axis=1)
+    best = np.argmin(costs, axis=1)
+    pick = np.arange(len(q))
+    return candidates[pick, best], np.maximum(costs[pick, best], 0)
+
+
+def simplify(vertices, faces, target=None, tolerance=None, boundary=100.0, maxrounds=1000):
+    """
+    Simplifies the triangle mesh (vertices (V, 3), faces (M, 3)) by edge
+    collapses until it has at most `target` faces, or no collapse has an
+    error (root of the quadric cost, roughly a distance) within `tolerance`,
+    whichever comes first. Returns (vertices, faces) with unused vertices
+    dropped.
+
+    The target is not always reached: collapses that would pinch the
+    surface (joining two points of an open border included) or fold a face
+    over are never made, so a mesh of many short open tubes, like branches,
+    stops above it. Compare the face count returned with the target (see
+    missed).
+    """
+    vertices = np.array(vertices, dtype=np.float64).reshape(-1, 3)
+    faces = np.asarray(faces, dtype=np.int64).reshape(-1, 3)
+    faces = faces[(faces[:, 0] != faces[:, 1]) & (faces[:, 1] != faces[:, 2]) & (faces[:, 2] != faces[:, 0])]
+    if target is None and tolerance is None:
+        raise ValueError("simplify needs a target face count or an error tolerance")
+    target = 0 if target is None else target
+    limit = np.inf if tolerance is None else tolerance*tolerance
+    nvertices = len(vertices)
+    q = quadrics(vertices, faces, boundary)
+    rejected = np.empty(0, dtype=np.int64)
+    retried = None
+
+    for _ in range(maxrounds):
+        if len(faces) <= target:
+            break
+        edges, counts, _ = edges_of(faces, nvertices)
+        a, b = edges[:, 0], edges[:, 1]
+        keys = a*nvertices + b
+
+        # Link condition: the ends may share only the vertices opposite the
+        # edge, or the collapse pinches the surface
+        both = np.concatenate([edges, edges[:, ::-1]])
+        order = np.lexsort((both[:, 1], both[:, 0]))
+        src, dst = both[order, 0], both[order, 1]
+        adjacency = src*nvertices + dst
+        offsets = np.searchsorted(src, np.arange(nvertices + 1))
+        degree = np.diff(offsets)
+        edge, entry = expand(offsets[a], degree[a])
+        w = dst[entry]
+        hit = np.searchsorted(adjacency, b[edge]*nvertices + w)
+        shared = adjacency[np.minimum(hit, len(adjacency) - 1)] == b[edge]*nvertices + w
+        common = np.bincount(edge[shared], minlength=len(edges))
+        onborder = np.zeros(nvertices, dtype=bool)
+        onborder[edges[counts == 1].ravel()] = True
+        valid = (counts <= 2) & (common == counts) & (degree[a] + degree[b] - 2 - common >= 3 - (counts == 1))
+        valid &= (counts == 1) | ~(onborder[a] & onborder[b])
+        valid &= ~np.isin(keys, rejected)
+
+        position, cost = placement(q[a] + q[b], vertices[a], vertices[b])
+        valid &= cost <= limit
+        candidates = np.flatnonzero(valid)
+        if len(candidates) == 0:
+            # Edges turned down for flipping may be fine once their
+            # neighbourhood has changed: give them one more chance, unless
+            # nothing collapsed since the last one
+            if len(rejected) == 0 or retried == len(faces):
+                break
+            rejected = np.empty(0, dtype=np.int64)
+            retried = len(faces)
+            continue
+
+        # Keep the edges that are the cheapest around both their ends, then
+        # drop those joined by an edge to a cheaper one, so the neighbourhoods
+        # of the collapses in a round do not overlap
+        candidates = candidates[np.argsort(cost[candidates], kind="stable")]
+        rank = np.full(len(edges), len(edges))
+        rank[candidates] = np.arange(len(candidates))
+        best = np.full(nvertices, len(edges))
+        np.minimum.at(best, a[candidates], rank[candidates])
+        np.minimum.at(best, b[candidates], rank[candidates])
+        chosen = candidates[(best[a[candidates]] == rank[candidates]) & (best[b[candidates]] == rank[candidates])]
+        owner = np.full(nvertices, -1)
+        owner[a[chosen]] = chosen
+        owner[b[chosen]] = chosen
+        ou, ov = owner[a], owner[b]
+        clash = (ou >= 0) & (ov >= 0) & (ou != ov)
+        losers = np.where(rank[ou[clash]] > rank[ov[clash]], ou[clash], ov[clash])
+        keep = np.ones(len(edges), dtype=bool)
+        keep[losers] = False
+        chosen = chosen[keep[chosen]]
+        owner[:] = -1
+        owner[a[chosen]] = chosen
+        owner[b[chosen]] = chosen
+
+        # Faces around a collapse must not flip over (faces that start out
+        # with no area, e.g. zero-radius branch tips, have no side to flip to)
+        touched = owner[faces]
+        around = np.max(touched, axis=1)
+        moving = np.flatnonzero(around >= 0)
+        corners = faces[moving]
+        collapse = around[moving]
+        survives = (corners != a[collapse][:, None]).all(axis=1) | (corners != b[collapse][:, None]).all(axis=1)
+        moved = vertices[corners]
+        moved[touched[moving] >= 0] = position[touched[moving][touched[moving] >= 0]]
+        before, _ = planes(vertices, corners)
+        after = np.cross(moved[:, 1] - moved[:, 0], moved[:, 2] - moved[:, 0])
+        flat = ~np.any(before, axis=1)
+        flipped = survives & ~flat & (np.einsum("ni,ni->n", before, after) <= 0)
+        bad = np.unique(collapse[flipped])
+        rejected = np.union1d(rejected, keys[bad])
+        chosen = chosen[~np.isin(chosen, bad)]
+
+        # Stop at the target face count
+        removed = np.cumsum(counts[chosen])
+        chosen = chosen[:max(np.searchsorted(removed, len(faces) - target) + 1, 1)]
+        if len(chosen) == 0:
+            # Every pick would flip a face; the next cheapest edges get a turn
+            continue
+
+        ka, kb = a[chosen], b[chosen]
+        vertices[ka] = position[chosen]
+        q[ka] += q[kb]
+        remap = np.arange(nvertices)
+        remap[kb] = ka
+        faces = remap[faces]
+        faces = faces[(faces[:, 0] != faces[:, 1]) & (faces[:, 1] != faces[:, 2]) & (faces[:, 2] != faces[:, 0])]
+
+    used, faces = np.unique(faces, return_inverse=True)
+    return vertices[used], faces.reshape(-1, 3).astype(np.int32)
+
+
+def decimate(builder, target=None, tolerance=None):
+    """ A new MeshBuilder holding the simplified, triangulated mesh of `builder` """
+    co, loops, starts, totals = builder.arrays()
+    vertices, faces = simplify(co.reshape(-1, 3), triangulate(loops, starts, totals), target, tolerance)
+    result = meshbuilder.MeshBuilder()
+    result.add_mesh(vertices, faces)
+    return result
+
+
+def missed(builder, target):
+    """ Warning for a decimated builder left above `target` faces, or None """
+    builder.flush()
+    nfaces = sum(len(sizes) for sizes in builder.sizechunks)
+    if target and nfaces > target:
+        return "Decimation stopped at %d faces, above the target of %d" % (nfaces, target)
+    return None
@@ -0,0 +1,137 @@
+# vim: fdm=manual
+import math
+import lturtlealphabet as la
+
+
+axiom = [la.TurtleA()]
+rules = [
+    # + yaw_left
+    # - yaw_right
+    # & pitch_down
+    # ^ pitch_up
+    # \ roll_left
+    # / roll_right
+    # | yaw_left(pi)
+
+    ((0.34, la.TurtleA), lambda _: [
+        la.TurtlePush(),            # [
+        la.TurtlePitchDown(),       # &
+        la.TurtleForward(),         # F
+        la.TurtleL(),               # L
+        la.TurtleA(),               # A
+        la.TurtlePop(),             # ]
+        la.TurtleRollRight(),       # /
+        la.TurtleRollRight(),       # /
+        la.TurtleRollRight(),       # /
+        la.TurtleRollRight(),       # /
+        la.TurtleRollRight(),       # /
+        la.TurtlePush(),            # [
+        la.TurtlePitchDown(),       # &
+        la.TurtleForward(),         # F
+        la.TurtleL(),               # L
+        la.TurtleA(),               # A
+        la.TurtlePop(),             # ]
+        la.TurtleRollRight(),       # /
+        la.TurtleRollRight(),       # /
+        la.TurtleRollRight(),       # /
+        la.TurtleRollRight(),       # /
+        la.TurtleRollRight(),       # /
+        la.TurtleRollRight(),       # /
+        la.TurtleRollRight(),       # /
+        la.TurtlePush(),            # [
+        la.TurtleForward(),         # F
+        la.TurtleB(),               # B
+        la.TurtleA(),               # A
+        la.TurtlePop(),             # ]
+    ]),
+    ((0.33, la.TurtleA), lambda _: [
+        la.TurtlePush(),            # [
+        la.TurtlePitchDown(),       # &
+        la.TurtleL(),               # L
+        la.TurtleA(),               # A
+        la.TurtlePop(),             # ]
+        la.TurtleRollRight(),       # /
+        la.TurtleRollRight(),       # /
+        la.TurtleRollRight(),       # /
+        la.TurtleRollRight(),       # /
+        la.TurtleRollRight(),       # /
+        la.TurtlePush(),            # [
+        la.TurtlePitchDown(),       # &
+        la.TurtleForward(),         # F
+        la.TurtleL(),               # L
+        la.TurtleA(),               # A
+        la.TurtlePop(),             # ]
+        la.TurtleRollRight(),       # /
+        la.TurtleRollRight(),       # /
+        la.TurtleRollRight(),       # /
+        la.TurtleRollRight(),       # /
+        la.TurtleRollRight(),       # /
+        la.TurtleRollRight(),       # /
+        la.TurtleRollRight(),       # /
+        la.TurtlePush(),            # [
+        la.TurtleForward(),         # F
+        la.TurtleB(),               # B
+        la.TurtleA(),               # A
+        la.TurtlePop(),             # ]
+    ]),
+    ((0.33, la.TurtleA), lambda _: [
+        la.TurtlePush(),            # [
+        la.TurtlePitchDown(),       # &
+        la.TurtleForward(),         # F
+        la.TurtleL(),               # L
+        la.TurtleA(),               # A
+        la.TurtlePop(),             # ]
+        la.TurtleRollRight(),       # /
+        la.TurtleRollRight(),       # /
+        la.TurtleRollRight(),       # /
+        la.TurtleRollRight(),       # /
+        la.TurtleRollRight(),       # /
+        la.TurtlePush(),            # [
+        la.TurtlePitchDown(),       # &
+        la.TurtleL(),               # L
+        la.TurtleA(),               # A
+        la.TurtlePop(),             # ]
+    ]),
+    ((1, la.TurtleForward), lambda _: [
+        la.TurtleS(),               # S
+        la.TurtleRollRight(),       # /
+        la.TurtleRollRight(),       # /
+        la.TurtleRollRight(),       # /
+        la.TurtleRollRight(),       # /
+        la.TurtleRollRight(),       # /
+        la.TurtleForward(),         # F
+    ]),
+    ((1, la.TurtleS), lambda _: [
+        la.TurtleForward(),         # F
+        la.TurtleL(),               # L
+    ]),
+    ((1, la.TurtleL), lambda _: [
+        la.TurtlePush(),            # [
+        la.TurtlePitchUp(),         # ^
+        la.TurtlePitchUp(),         # ^
+        la.TurtleStartPoly(),       # {
+        la.TurtleYawRight(),        # -
+        la.TurtleSkip(),            # f
+        la.TurtleYawLeft(),         # +
+        la.TurtleSkip(),            # f
+        la.TurtleYawLeft(),         # +
+        la.TurtleSkip(),            # f
+        la.TurtleYawRight(),        # -
+        la.TurtleYawLeft(math.pi),  # |
+        la.TurtleYawRight(),        # -
+        la.TurtleSkip(),            # f
+        la.TurtleYawLeft(),         # +
+        la.TurtleSkip(),            # f
+        la.TurtleYawLeft(),         # +
+        la.TurtleSkip(),            # f
+        la.TurtleEndPoly(),         # }
+        la.TurtlePop(),             # ]
+    ]),
+    ((1, la.TurtleB), lambda _: [
+        la.TurtlePush(),            # [
+        la.TurtleYawRight(),        # -
+        la.TurtleForward(),         # F
+        la.TurtleFlower(),          # Flower
+        la.TurtlePop(),             # ]
+    ]),
+]
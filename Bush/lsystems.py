@@ -1,9 +1,13 @@
 # vim: fdm=manual
+import bisect
 import random
 
 
 class TurtleSymbol(object):
     """ Represents a turtle symbol. """
+    # Name of the turtle method (or "push"/"pop") the symbol performs, if any
+    action = None
+
     def __init__(self):
         pass
 
@@ -14,44 +18,189 @@ class TurtleSymbol(object):
         return args, kwargs
 
 
-def lsystem_evolve(axiom, rules, depth):
-    if depth == 0:
-        return axiom
+def rule_items(rules):
+    """ Iterates over (predecessor, successor) pairs of a rules dict, list or set. """
+    if hasattr(rules, "items"):
+        return rules.items()
+    return rules
+
 
-    newaxiom = []
+class RuleTable(object):
+    """
+    Rules compiled into a dispatch table keyed by symbol type.
 
-    for symbol in axiom:
-        for primary, secondary in rules.items():
-            if isinstance(symbol, primary):
-                newaxiom.extend(secondary(symbol))
-                break
+    Deterministic rules map a predecessor type to its successor. Stochastic
+    rules are keyed by (probability, type) and map to a cumulative
+    probability list plus the successors, so choosing one costs a bisect.
+    A type is resolved against the rules (first match wins, subclasses
+    included, as with isinstance) the first time it is seen.
+    """
+    def __init__(self, rules, stochastic=False):
+        self.stochastic = stochastic
+        if stochastic:
+            self.rules = [(prob, primary, secondary) for (prob, primary), secondary in rule_items(rules)]
+        else:
+            self.rules = [(1, primary, secondary) for primary, secondary in rule_items(rules)]
+        self.table = {}
+
+    def resolve(self, cls):
+        matched = [(prob, secondary) for prob, primary, secondary in self.rules if issubclass(cls, primary)]
+        if not matched:
+            entry = None
+        elif not self.stochastic:
+            entry = matched[0][1]
+        else:
+            cumulative = []
+            rsum = 0
+            for prob, _ in matched:
+                rsum += prob
+                cumulative.append(rsum)
+            entry = cumulative, [secondary for _, secondary in matched]
+        self.table[cls] = entry
+        return entry
+
+    def match(self, symbol):
+        return self.choose(type(symbol))
+
+    def successor(self, cls):
+        """
+        The successor of cls when the rules leave no choice (deterministic
+        rules, or a single stochastic rule of probability 1), None when no
+        rule applies; raises ValueError when the successor is left to chance.
+        """
+        try:
+            entry = self.table[cls]
+        except KeyError:
+            entry = self.resolve(cls)
+        if entry is None or not self.stochastic:
+            return entry
+        cumulative, secondaries = entry
+        if len(secondaries) != 1 or cumulative[0] < 1:
+            raise ValueError("Rules for %s are stochastic" % cls.__name__)
+        return secondaries[0]
+
+    def has_rules(self, cls):
+        """ Whether any rule applies to cls, even if a stochastic draw may pick none """
+        try:
+            entry = self.table[cls]
+        except KeyError:
+            entry = self.resolve(cls)
+        return entry is not None
+
+    def choose(self, cls):
+        try:
+            entry = self.table[cls]
+        except KeyError:
+            entry = self.resolve(cls)
+        if entry is None or not self.stochastic:
+            return entry
+        cumulative, secondaries = entry
+        i = bisect.bisect_right(cumulative, random.random())
+        if i == len(secondaries):
+            return None
+        return secondaries[i]
+
+
+def compile_rules(rules, stochastic=False):
+    if isinstance(rules, RuleTable):
+        return rules
+    return RuleTable(rules, stochastic)
+
+
+def lsystem_expand(axiom, rules, depth, stochastic=False):
+    """
+    Lazily expands `axiom` `depth` times, yielding the symbols of the final
+    string depth-first. Only the successors along the current path are kept
+    alive, so memory is bounded by depth times the size of a successor.
+    """
+    table = compile_rules(rules, stochastic)
+    match = table.match
+    stack = [(iter(axiom), depth)]
+    while stack:
+        symbols, remaining = stack[-1]
+        for symbol in symbols:
+            if remaining > 0:
+                secondary = match(symbol)
+                if secondary is not None:
+                    stack.append((iter(secondary(symbol)), remaining-1))
+                    break
+                if table.has_rules(type(symbol)):
+                    # The draw picked no rule this generation: the symbol
+                    # stays as it is and gets another draw in the next one
+                    stack.append((iter((symbol,)), remaining-1))
+                    break
+            yield symbol
         else:
-            newaxiom.append(symbol)
+            stack.pop()
 
-    return lsystem_evolve(newaxiom, rules, depth-1)
 
+def lsystem_stochastic_expand(axiom, rules, depth):
+    return lsystem_expand(axiom, rules, depth, stochastic=True)
 
-def lsystem_stochastic_evolve(axiom, rules, depth):
-    if depth == 0:
-        return axiom
-
-    newaxiom = []
-
-    for symbol in axiom:
-        matched = [(prob, secondary) for (prob, primary), secondary in rules if isinstance(symbol, primary)]
-        rand = random.random()
-        rsum = 0
-        for prob, secondary in matched:
-            rsum += prob
-            if rand < rsum:
-                newaxiom.extend(secondary(symbol))
-                break
-        else:
-            newaxiom.append(symbol)
 
-    return lsystem_stochastic_evolve(newaxiom, rules, depth-1)
+def lsystem_evolve(axiom, rules, depth):
+    return list(lsystem_expand(axiom, rules, depth))
 
 
-def doturtle(instructions, *args, **kwargs):
-    for instruction in instructions:
-        args, kwargs = instruction.do(*args, **kwargs)
+def lsystem_stochastic_evolve(axiom, rules, depth):
+    return list(lsystem_stochastic_expand(axiom, rules, depth))
+
+
+def match_brackets(instructions):
+    """
+    Index of the matching pop of every push in `instructions`, and of the
+    matching push of every pop; -1 for other symbols and unmatched brackets.
+    Built in one pass with a stack of the open pushes.
+    """
+    match = [-1]*len(instructions)
+    pending = []
+    for index, instruction in enumerate(instructions):
+        action = instruction.action
+        if action == "push":
+            pending.append(index)
+        elif action == "pop" and pending:
+            start = pending.pop()
+            match[start] = index
+            match[index] = start
+    return match
+
+
+def doturtle(instructions, *args, cull=None, **kwargs):
+    """
+    Runs instructions on the turtle. If given, cull(args, instructions,
+    start, end) is asked at every push (at start, with its pop at end)
+    before running it, and the whole branch is skipped when it returns True.
+    A list is indexed by its matching brackets; any other iterable is run
+    as it streams in, so cull gets None for instructions and end, and a
+    culled branch is skipped by counting brackets down to its pop.
+    """
+    if cull is None:
+        for instruction in instructions:
+            args, kwargs = instruction.do(*args, **kwargs)
+        return
+
+    if not isinstance(instructions, list):
+        depth = 0
+        for index, instruction in enumerate(instructions):
+            action = instruction.action
+            if depth:
+                if action == "push":
+                    depth += 1
+                elif action == "pop":
+                    depth -= 1
+                continue
+            if action == "push" and cull(args, None, index, None):
+                depth = 1
+                continue
+            args, kwargs = instruction.do(*args, **kwargs)
+        return
+
+    match = match_brackets(instructions)
+    index = 0
+    while index < len(instructions):
+        end = match[index]
+        if end > index and cull(args, instructions, index, end):
+            index = end + 1
+            continue
+        args, kwargs = instructions[index].do(*args, **kwargs)
+        index += 1
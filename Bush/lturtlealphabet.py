@@ -10,6 +10,8 @@ magnolia = objload.ObjModel("magnolia.obj", 0.01)
 # Define Turtle Symbols
 
 class TurtleForward(lsystems.TurtleSymbol):
+    action = "forward"
+
     def __init__(self, amount=None):
         self.amount = amount
 
@@ -19,6 +21,8 @@ class TurtleForward(lsystems.TurtleSymbol):
 
 
 class TurtleSkip(lsystems.TurtleSymbol):
+    action = "skip"
+
     def __init__(self, amount=None):
         self.amount = amount
 
@@ -28,6 +32,8 @@ class TurtleSkip(lsystems.TurtleSymbol):
 
 
 class TurtleYawLeft(lsystems.TurtleSymbol):
+    action = "yaw_left"
+
     def __init__(self, amount=None):
         self.amount = amount
 
@@ -37,6 +43,8 @@ class TurtleYawLeft(lsystems.TurtleSymbol):
 
 
 class TurtleYawRight(lsystems.TurtleSymbol):
+    action = "yaw_right"
+
     def __init__(self, amount=None):
         self.amount = amount
 
@@ -46,6 +54,8 @@ class TurtleYawRight(lsystems.TurtleSymbol):
 
 
 class TurtlePitchUp(lsystems.TurtleSymbol):
+    action = "pitch_up"
+
     def __init__(self, amount=None):
         self.amount = amount
 
@@ -55,6 +65,8 @@ class TurtlePitchUp(lsystems.TurtleSymbol):
 
 
 class TurtlePitchDown(lsystems.TurtleSymbol):
+    action = "pitch_down"
+
     def __init__(self, amount=None):
         self.amount = amount
 
@@ -64,6 +76,8 @@ class TurtlePitchDown(lsystems.TurtleSymbol):
 
 
 class TurtleRollLeft(lsystems.TurtleSymbol):
+    action = "roll_left"
+
     def __init__(self, amount=None):
         self.amount = amount
 
@@ -73,6 +87,8 @@ class TurtleRollLeft(lsystems.TurtleSymbol):
 
 
 class TurtleRollRight(lsystems.TurtleSymbol):
+    action = "roll_right"
+
     def __init__(self, amount=None):
         self.amount = amount
 
@@ -82,18 +98,31 @@ class TurtleRollRight(lsystems.TurtleSymbol):
 
 
 class TurtlePush(lsystems.TurtleSymbol):
+    action = "push"
+
     def do(self, turtle, stack):
-        stack.append(copy.copy(turtle))
+        # A TurtleStack saves the state in place; a plain list gets a copy
+        if isinstance(stack, list):
+            stack.append(copy.copy(turtle))
+        else:
+            stack.push(turtle)
         return [turtle, stack], {}
 
 
 class TurtlePop(lsystems.TurtleSymbol):
+    action = "pop"
+
     def do(self, turtle, stack):
-        turtle = stack.pop()
+        if isinstance(stack, list):
+            turtle = stack.pop()
+        else:
+            turtle = stack.pop(turtle)
         return [turtle, stack], {}
 
 
 class TurtleSetRadius(lsystems.TurtleSymbol):
+    action = "set_radius"
+
     def __init__(self, amount):
         self.amount = amount
 
@@ -103,18 +132,24 @@ class TurtleSetRadius(lsystems.TurtleSymbol):
 
 
 class TurtleStartPoly(lsystems.TurtleSymbol):
+    action = "startpoly"
+
     def do(self, turtle, stack):
         turtle.startpoly()
         return [turtle, stack], {}
 
 
 class TurtleEndPoly(lsystems.TurtleSymbol):
+    action = "endpoly"
+
     def do(self, turtle, stack):
         turtle.endpoly()
         return [turtle, stack], {}
 
 
 class TurtleHoriz(lsystems.TurtleSymbol):
+    action = "horiz"
+
     def do(self, turtle, stack):
         turtle.horiz()
         return [turtle, stack], {}
@@ -7,8 +7,11 @@ import bpy
 import mathutils
 import lturtle
 import lsystems
+import peephole
 import lturtlealphabet as la
 import datamanager as dt
+import meshbuilder
+import decimate
 
 
 bl_info = {
@@ -175,22 +178,20 @@ class BushOperator(bpy.types.Operator):
     stepsize: bpy.props.FloatProperty(name="Step Size", default=0.5)
     stepangle: bpy.props.FloatProperty(name="Step Angle", min=0, max=360, default=22.5)
     radius: bpy.props.FloatProperty(name="Radius", default=0.1)
+    decimate_target: bpy.props.IntProperty(name="Decimate to Faces (0 = Off)", min=0, default=0)
+    decimate_tolerance: bpy.props.FloatProperty(name="Decimate Tolerance (0 = Off)", min=0, default=0, precision=4)
+    face_budget: bpy.props.IntProperty(name="Face Budget (0 = Off)", min=0, default=0)
+    min_length: bpy.props.FloatProperty(name="Minimum Branch Length", min=0, default=0)
 
     def invoke(self, context, event):
         wm = context.window_manager
         return wm.invoke_props_dialog(self)
 
-    def addface(self, *verts):
-        i = len(self.vertices)
-        for vert in verts:
-            self.vertices.append(vert)
-        self.faces.append([i+k for k in range(len(verts))])
-
     def execute(self, context):
-        instructions = lsystems.lsystem_stochastic_evolve(self.axiom, self.rules, self.depth)
+        instructions = lsystems.lsystem_stochastic_expand(self.axiom, self.rules, self.depth)
 
-        self.vertices = []
-        self.faces = []
+        builder = meshbuilder.MeshBuilder()
+        culling = lturtle.Culling(minlength=self.min_length, maxfaces=self.face_budget or None)
         turtle = lturtle.Turtle(mathutils.Vector((0, 0, 0)),
                                 mathutils.Vector((0, 0, 1)),
                                 mathutils.Vector((0, 1, 0)),
@@ -198,7 +199,7 @@ class BushOperator(bpy.types.Operator):
                                 self.stepsize,
                                 math.radians(self.stepangle),
                                 self.radius,
-                                self.addface)
+                                culling.counting(builder.addface))
         data = data_from_list([
             (mathutils.Vector((0, 0, 0)), [
                 (mathutils.Vector((0, 0, 5)), [
@@ -209,12 +210,24 @@ class BushOperator(bpy.types.Operator):
         ])
         turtles = lturtle.Turtles(0.1, 0.5, data, [turtle])
 
-        lsystems.doturtle(instructions, turtles, [])
-
-        # Generate the mesh from (vertices, faces)
+        # Stepsizes change as the turtles follow the data, so default skips
+        # are left alone
+        optimizer = peephole.Peephole(math.radians(self.stepangle))
+        cull = culling if self.min_length or self.face_budget else None
+        lsystems.doturtle(optimizer.optimize(instructions), turtles, lturtle.TurtleStack(), cull=cull)
+        self.report({"INFO"}, "Peephole: " + optimizer.summary())
+        if cull is not None:
+            self.report({"INFO"}, "Culling: " + culling.summary())
+
+        if self.decimate_target or self.decimate_tolerance:
+            builder = decimate.decimate(builder, self.decimate_target or None, self.decimate_tolerance or None)
+            message = decimate.missed(builder, self.decimate_target)
+            if message:
+                self.report({"WARNING"}, message)
+
+        # Generate the mesh from the builder's buffers
         mesh = bpy.data.meshes.new("Generated")
-        mesh.from_pydata(self.vertices, [], self.faces)
-        mesh.update()
+        builder.tomesh(mesh)
         obj = bpy.data.objects.new("Generated", mesh)
         context.collection.objects.link(obj)
         bpy.ops.object.select_all(action="DESELECT")
@@ -0,0 +1,194 @@
+# vim: fdm=manual
+import array
+import inspect
+import math
+import numpy as np
+import lsystems
+
+
+# Compact symbol strings: one uint8 opcode and one float64 parameter per
+# symbol (NaN standing for a parameter of None), instead of a Python object
+# with its own __dict__ per symbol.
+
+def param_name(cls):
+    """ Name of the single constructor parameter of a symbol class, or None. """
+    if cls.__init__ is lsystems.TurtleSymbol.__init__:
+        return None
+    params = [p for p in inspect.signature(cls.__init__).parameters.values()][1:]
+    if len(params) == 0:
+        return None
+    if len(params) > 1:
+        raise TypeError("Symbol %s takes more than one parameter" % cls.__name__)
+    return params[0].name
+
+
+class Alphabet(object):
+    """ Assigns opcodes to a set of symbol classes. """
+    def __init__(self, classes):
+        self.classes = list(classes)
+        if len(self.classes) > 256:
+            raise ValueError("An alphabet holds at most 256 symbols")
+        self.opcodes = {cls: op for op, cls in enumerate(self.classes)}
+        self.params = [param_name(cls) for cls in self.classes]
+        self.singletons = [cls() if param is None else None for cls, param in zip(self.classes, self.params)]
+
+    @classmethod
+    def frommodule(cls, module):
+        return cls(value for value in vars(module).values()
+                   if isinstance(value, type) and issubclass(value, lsystems.TurtleSymbol) and value is not lsystems.TurtleSymbol)
+
+    def encode(self, symbol):
+        op = self.opcodes[type(symbol)]
+        param = self.params[op]
+        if param is None:
+            return op, math.nan
+        value = getattr(symbol, param)
+        return op, math.nan if value is None else value
+
+    def decode(self, op, value):
+        if self.params[op] is None:
+            return self.singletons[op]
+        return self.classes[op](None if value != value else value)
+
+
+class SymbolString(object):
+    """ A string of turtle symbols stored as parallel typed arrays. """
+    def __init__(self, alphabet, opcodes=None, params=None):
+        self.alphabet = alphabet
+        self.opcodes = array.array('B') if opcodes is None else opcodes
+        self.params = array.array('d') if params is None else params
+
+    @classmethod
+    def fromlist(cls, alphabet, symbols):
+        string = cls(alphabet)
+        string.extend(symbols)
+        return string
+
+    def tolist(self):
+        return list(self)
+
+    def append(self, symbol):
+        op, value = self.alphabet.encode(symbol)
+        self.opcodes.append(op)
+        self.params.append(value)
+
+    def extend(self, symbols):
+        for symbol in symbols:
+            self.append(symbol)
+
+    def __len__(self):
+        return len(self.opcodes)
+
+    def __iter__(self):
+        # Parameterless symbols are shared instances, so iterating allocates
+        # only for the symbols that carry a parameter.
+        decode = self.alphabet.decode
+        for op, value in zip(self.opcodes, self.params):
+            yield decode(op, value)
+
+    def nbytes(self):
+        return self.opcodes.itemsize*len(self.opcodes) + self.params.itemsize*len(self.params)
+
+
+def rewrite(string, rules):
+    """ Applies one generation of a compiled RuleTable to a SymbolString. """
+    alphabet = string.alphabet
+    out = SymbolString(alphabet)
+    opcodes, params = out.opcodes, out.params
+    choose = rules.choose
+    for op, value in zip(string.opcodes, string.params):
+        secondary = choose(alphabet.classes[op])
+        if secondary is None:
+            opcodes.append(op)
+            params.append(value)
+        else:
+            out.extend(secondary(alphabet.decode(op, value)))
+    return out
+
+
+def lsystem_evolve(axiom, rules, depth, alphabet, stochastic=False):
+    """ Like lsystems.lsystem_evolve, but every generation is a SymbolString. """
+    rules = lsystems.compile_rules(rules, stochastic)
+    string = axiom if isinstance(axiom, SymbolString) else SymbolString.fromlist(alphabet, axiom)
+    for _ in range(depth):
+        string = rewrite(string, rules)
+    return string
+
+
+def lsystem_stochastic_evolve(axiom, rules, depth, alphabet):
+    return lsystem_evolve(axiom, rules, depth, alphabet, stochastic=True)
+
+
+def homogeneous(rules, cls, lengths):
+    """
+    Whether the rule for cls is homogeneous in the parameter of cls: doubling
+    it doubles the parameters of the `lengths` symbols of the successor and
+    leaves all other parameters alone, so the expansions of cls(l) for all l
+    are one expansion with its lengths scaled.
+    """
+    name = param_name(cls)
+    secondary = rules.successor(cls)
+    if cls not in lengths or name is None or secondary is None:
+        return False
+    one, two = secondary(cls(1.0)), secondary(cls(2.0))
+    if [type(symbol) for symbol in one] != [type(symbol) for symbol in two]:
+        return False
+    for a, b in zip(one, two):
+        param = param_name(type(a))
+        if param is None:
+            continue
+        va, vb = getattr(a, param), getattr(b, param)
+        if va is None or vb is None:
+            if (va is None) != (vb is None):
+                return False
+        elif type(a) in lengths:
+            if not math.isclose(vb, 2*va, rel_tol=1e-12):
+                return False
+        elif va != vb:
+            return False
+    return True
+
+
+def memo_expand(axiom, rules, depth, alphabet, lengths=()):
+    """
+    lsystem_evolve for deterministic rules, memoized: the expansion of each
+    (symbol type, remaining depth) is built once and reused. Symbols whose
+    rule is homogeneous in their parameter (see homogeneous) are expanded
+    for a parameter of 1 and the `lengths` parameters scaled on reuse;
+    other symbols are memoized by their exact parameter. The symbolic work
+    grows linearly with depth, only copying out the result does not.
+    """
+    rules = lsystems.compile_rules(rules)
+    lengths = tuple(lengths)
+    scaled = np.zeros(len(alphabet.classes), dtype=bool)
+    scaled[[alphabet.opcodes[cls] for cls in lengths if cls in alphabet.opcodes]] = True
+    scalable = {}
+    memo = {}
+
+    def expand(symbol, remaining):
+        cls = type(symbol)
+        secondary = rules.successor(cls) if remaining > 0 else None
+        if secondary is None:
+            op, value = alphabet.encode(symbol)
+            return np.array([op], dtype=np.uint8), np.array([value])
+        if cls not in scalable:
+            scalable[cls] = homogeneous(rules, cls, lengths)
+        value = alphabet.encode(symbol)[1]
+        if scalable[cls] and value == value and value != 0:
+            key, unit, scale = (cls, remaining), cls(1.0), value
+        else:
+            key, unit, scale = (cls, remaining, value), symbol, None
+        if key not in memo:
+            parts = [expand(child, remaining - 1) for child in secondary(unit)]
+            memo[key] = (np.concatenate([part[0] for part in parts]), np.concatenate([part[1] for part in parts]))
+        opcodes, params = memo[key]
+        if scale is not None:
+            params = np.where(scaled[opcodes], params*scale, params)
+        return opcodes, params
+
+    parts = [expand(symbol, depth) for symbol in axiom]
+    string = SymbolString(alphabet)
+    if parts:
+        string.opcodes.frombytes(np.concatenate([part[0] for part in parts]).tobytes())
+        string.params.frombytes(np.concatenate([part[1] for part in parts]).astype(np.float64).tobytes())
+    return string
@@ -1,6 +1,7 @@
 # vim: fdm=manual
 import copy
 import math
+import mathutils
 
 
 def rodriguescs(vec, axis, s, c):
@@ -13,13 +14,62 @@ def rodrigues(vec, axis, theta):
     return rodriguescs(vec, axis, math.sin(theta), math.cos(theta))
 
 
+# The turtle frame is the matrix with rows (direction, up, left). Turning it
+# about one of its own axes mixes the other two rows, so a rotation is a
+# constant matrix applied on the left, cached by axis, angle and handedness.
+YAW, PITCH, ROLL = range(3)
+
+# Row each rotation turns about, and the rows it turns
+AXES = {YAW: (1, (0, 2)), PITCH: (2, (0, 1)), ROLL: (0, (1, 2))}
+
+ROTATIONS = {}
+ROTATION_CACHE_SIZE = 64
+
+# Cached rotations between re-orthonormalizations of the frame
+REORTHONORMALIZE = 64
+
+
+def rotation(axis, theta, handedness):
+    """
+    Matrix turning the frame by theta about one of its axes. handedness is
+    (up x direction) . left: 1 for the default frame, -1 for a mirrored one.
+    """
+    c, s = math.cos(theta), handedness*math.sin(theta)
+    if axis == YAW:
+        return mathutils.Matrix(((c, 0, s), (0, 1, 0), (-s, 0, c)))
+    if axis == PITCH:
+        return mathutils.Matrix(((c, -s, 0), (s, c, 0), (0, 0, 1)))
+    return mathutils.Matrix(((1, 0, 0), (0, c, -s), (0, s, c)))
+
+
+def cached_rotation(axis, theta, handedness):
+    key = (axis, theta, handedness)
+    try:
+        return ROTATIONS[key]
+    except KeyError:
+        if len(ROTATIONS) >= ROTATION_CACHE_SIZE:
+            ROTATIONS.clear()
+        matrix = ROTATIONS[key] = rotation(axis, theta, handedness)
+        return matrix
+
+
+def handedness(frame, tolerance=1e-6):
+    """ (up x direction) . left of an orthonormal frame, or 0 if it is not orthonormal """
+    direction, up, left = frame
+    for a, b, dot in ((direction, direction, 1), (up, up, 1), (left, left, 1),
+                      (direction, up, 0), (direction, left, 0), (up, left, 0)):
+        if abs(a.dot(b) - dot) > tolerance:
+            return 0
+    return 1 if up.cross(direction).dot(left) > 0 else -1
+
+
 class Turtle(object):
     """ Represents a 3D graphics turtle """
     def __init__(self, position, direction, up, left, stepsize, stepangle, radius, addface):
         self.position = position
-        self.direction = direction
-        self.up = up
-        self.left = left
+        self.frame = mathutils.Matrix((direction, up, left))
+        self.handedness = None
+        self.nrotations = 0
         self.stepsize = stepsize
         self.stepangle = stepangle
         self.radius = radius
@@ -28,16 +78,75 @@ class Turtle(object):
         self.inpoly = False
         self.polyverts = []
 
+    # Frame rows as vectors. The frame matrix is shared with copies of the
+    # turtle (pushed on the stack), so it is replaced, never written to
+
+    @property
+    def direction(self):
+        return self.frame[0].copy()
+
+    @direction.setter
+    def direction(self, value):
+        self.setrow(0, value)
+
+    @property
+    def up(self):
+        return self.frame[1].copy()
+
+    @up.setter
+    def up(self, value):
+        self.setrow(1, value)
+
+    @property
+    def left(self):
+        return self.frame[2].copy()
+
+    @left.setter
+    def left(self, value):
+        self.setrow(2, value)
+
+    def setrow(self, row, value):
+        frame = self.frame.copy()
+        frame[row] = value
+        self.frame = frame
+        self.handedness = None
+
+    def rotate(self, axis, theta):
+        if self.handedness is None:
+            self.handedness = handedness(self.frame)
+        if not self.handedness:
+            # Not orthonormal (horiz leaves up and left parallel): turn the
+            # rows about the axis row one by one, as rodrigues always did
+            about, turned = AXES[axis]
+            rows = list(self.frame)
+            for row in turned:
+                rows[row] = rodrigues(rows[row], rows[about], theta)
+            self.frame = mathutils.Matrix(rows)
+            return
+
+        self.frame = cached_rotation(axis, theta, self.handedness) @ self.frame
+        self.nrotations += 1
+        if self.nrotations % REORTHONORMALIZE == 0:
+            self.orthonormalize()
+
+    def orthonormalize(self):
+        """ Gram-Schmidt on direction then up, to undo the drift of many rotations """
+        direction, up, _ = self.frame
+        direction = direction.normalized()
+        up = (up - up.dot(direction)*direction).normalized()
+        self.frame = mathutils.Matrix((direction, up, self.handedness*up.cross(direction)))
+
     def forward(self, amount=None):
+        direction, up, left = self.frame
         if amount is None:
-            direction = self.stepsize*self.direction
+            direction = self.stepsize*direction
         else:
-            direction = amount*self.direction
+            direction = amount*direction
 
-        north = self.position - self.radius*self.up
-        east = self.position - self.radius*self.left
-        south = self.position + self.radius*self.up
-        west = self.position + self.radius*self.left
+        north = self.position - self.radius*up
+        east = self.position - self.radius*left
+        south = self.position + self.radius*up
+        west = self.position + self.radius*left
 
         self.addface(north, north + direction, east + direction, east)
         self.addface(east, east + direction, south + direction, south)
@@ -51,9 +160,9 @@ class Turtle(object):
 
     def skip(self, amount=None):
         if amount is None:
-            direction = self.stepsize*self.direction
+            direction = self.stepsize*self.frame[0]
         else:
-            direction = amount*self.direction
+            direction = amount*self.frame[0]
 
         self.position = self.position + direction
 
@@ -66,8 +175,7 @@ class Turtle(object):
         else:
             theta = amount
 
-        self.direction = rodrigues(self.direction, self.up, theta)
-        self.left = rodrigues(self.left, self.up, theta)
+        self.rotate(YAW, theta)
 
     def yaw_left(self, amount=None):
         if amount is None:
@@ -75,8 +183,7 @@ class Turtle(object):
         else:
             theta = -amount
 
-        self.direction = rodrigues(self.direction, self.up, theta)
-        self.left = rodrigues(self.left, self.up, theta)
+        self.rotate(YAW, theta)
 
     def pitch_up(self, amount=None):
         if amount is None:
@@ -84,8 +191,7 @@ class Turtle(object):
         else:
             theta = amount
 
-        self.direction = rodrigues(self.direction, self.left, theta)
-        self.up = rodrigues(self.up, self.left, theta)
+        self.rotate(PITCH, theta)
 
     def pitch_down(self, amount=None):
         if amount is None:
@@ -93,8 +199,7 @@ class Turtle(object):
         else:
             theta = -amount
 
-        self.direction = rodrigues(self.direction, self.left, theta)
-        self.up = rodrigues(self.up, self.left, theta)
+        self.rotate(PITCH, theta)
 
     def roll_right(self, amount=None):
         if amount is None:
@@ -102,8 +207,7 @@ class Turtle(object):
         else:
             theta = amount
 
-        self.up = rodrigues(self.up, self.direction, theta)
-        self.left = rodrigues(self.left, self.direction, theta)
+        self.rotate(ROLL, theta)
 
     def roll_left(self, amount=None):
         if amount is None:
@@ -111,8 +215,7 @@ class Turtle(object):
         else:
             theta = -amount
 
-        self.up = rodrigues(self.up, self.direction, theta)
-        self.left = rodrigues(self.left, self.direction, theta)
+        self.rotate(ROLL, theta)
 
     def startpoly(self):
         self.inpoly = True
@@ -123,12 +226,40 @@ class Turtle(object):
         self.inpoly = False
 
     def horiz(self):
-        self.up = self.direction.cross(self.left)
-        self.left = (self.left.cross(self.direction)).normalized()
+        direction, _, left = self.frame
+        self.frame = mathutils.Matrix((direction, direction.cross(left), left.cross(direction).normalized()))
+        self.handedness = None
 
     def set_radius(self, amount):
         self.radius = amount
 
+    # Number of stack slots a saved state takes (see TurtleStack)
+    SLOTS = 8
+
+    def save(self, stack):
+        top = stack.reserve(self.SLOTS)
+        items = stack.items
+        items[top] = self.position
+        items[top + 1] = self.frame
+        items[top + 2] = self.handedness
+        items[top + 3] = self.nrotations
+        items[top + 4] = self.radius
+        items[top + 5] = self.stepsize
+        items[top + 6] = self.inpoly
+        items[top + 7] = self.polyverts
+
+    def restore(self, stack):
+        top = stack.release(self.SLOTS)
+        items = stack.items
+        self.position = items[top]
+        self.frame = items[top + 1]
+        self.handedness = items[top + 2]
+        self.nrotations = items[top + 3]
+        self.radius = items[top + 4]
+        self.stepsize = items[top + 5]
+        self.inpoly = items[top + 6]
+        self.polyverts = items[top + 7]
+
 
 class Turtles(object):
     """ Represents a 3D graphics turtle """
@@ -145,6 +276,26 @@ class Turtles(object):
     def clone(self):
         return Turtles(self.proximity_tolerance, self.leniency, copy.copy(self.data), [copy.copy(turtle) for turtle in self.turtles], self.initial_stepsizes)
 
+    # consider_data replaces the data, stepsize and turtle lists rather than
+    # changing them, so saving them is saving the lists; the turtles in the
+    # list save their own state below them
+
+    def save(self, stack):
+        for turtle in self.turtles:
+            turtle.save(stack)
+        top = stack.reserve(3)
+        stack.items[top] = self.data
+        stack.items[top + 1] = self.initial_stepsizes
+        stack.items[top + 2] = self.turtles
+
+    def restore(self, stack):
+        top = stack.release(3)
+        self.data = stack.items[top]
+        self.initial_stepsizes = stack.items[top + 1]
+        self.turtles = stack.items[top + 2]
+        for turtle in reversed(self.turtles):
+            turtle.restore(stack)
+
     def forward(self, amount=None):
         for turtle in self.turtles:
             turtle.forward(amount)
@@ -237,3 +388,119 @@ class Turtles(object):
         self.data = newdata
         self.initial_stepsizes = newinitial_stepsizes
         self.turtles = newturtles
+
+
+class TurtleStack(object):
+    """
+    Branch stack for TurtlePush/TurtlePop. Rather than copying the turtle,
+    a push writes its state into preallocated slots at the top of the stack
+    and a pop reads it back into the same turtle. The turtle replaces its
+    position and frame on every change and never writes to them, so the
+    slots can hold the objects themselves, and a push or pop allocates
+    nothing once the stack has grown to the deepest branch.
+    """
+    def __init__(self, capacity=256):
+        self.items = [None]*capacity
+        self.top = 0
+
+    def reserve(self, n):
+        """ Index of n new slots at the top of the stack """
+        top = self.top
+        if top + n > len(self.items):
+            self.items.extend([None]*max(len(self.items), n))
+        self.top = top + n
+        return top
+
+    def release(self, n):
+        """ Index of the n slots at the top of the stack, which are removed """
+        if self.top < n:
+            raise IndexError("pop from empty turtle stack")
+        self.top -= n
+        return self.top
+
+    def __len__(self):
+        return self.top
+
+    def push(self, turtle):
+        turtle.save(self)
+
+    def pop(self, turtle):
+        turtle.restore(self)
+        return turtle
+
+
+class Culling(object):
+    """
+    Branch culling for lsystems.doturtle(..., cull=culling). At every push
+    the branch up to its pop is skipped when the turtle (every turtle, for
+    Turtles)
+
+      - is outside the box lower..upper,
+      - has a radius below minradius,
+      - takes a first step in the branch shorter than minlength (looking at
+        most `lookahead` symbols ahead, before any nested branch), or
+      - has added maxfaces faces already; faces are counted when the turtle
+        draws through counting(addface).
+
+    The tests look at the start of the branch only, so a branch that starts
+    outside the box is dropped even if it grows back into it. A streamed
+    branch (instructions None) has nothing to look ahead at: minlength does
+    not apply and its symbols are not counted as skipped.
+    """
+    def __init__(self, lower=None, upper=None, minradius=0, minlength=0, maxfaces=None, lookahead=8):
+        self.lower = lower
+        self.upper = upper
+        self.minradius = minradius
+        self.minlength = minlength
+        self.maxfaces = maxfaces
+        self.lookahead = lookahead
+
+        self.nfaces = 0
+        self.culled = 0
+        self.skipped = 0
+
+    def counting(self, addface):
+        def counted(*verts):
+            self.nfaces += 1
+            addface(*verts)
+        return counted
+
+    def outside(self, position):
+        return any(p < lo or p > hi for p, lo, hi in zip(position, self.lower, self.upper))
+
+    def first_step(self, instructions, start, end):
+        """ Amount of the first forward of the branch start..end (None for the stepsize), or False """
+        if instructions is None:
+            return False
+        for index in range(start + 1, min(end, start + 1 + self.lookahead)):
+            action = instructions[index].action
+            if action == "forward":
+                return instructions[index].amount
+            if action == "push":
+                break
+        return False
+
+    def cullable(self, turtles, instructions, start, end):
+        if self.maxfaces is not None and self.nfaces >= self.maxfaces:
+            return True
+        if self.minradius and all(turtle.radius < self.minradius for turtle in turtles):
+            return True
+        if self.lower is not None and all(self.outside(turtle.position) for turtle in turtles):
+            return True
+        if self.minlength:
+            amount = self.first_step(instructions, start, end)
+            if amount is not False and all((turtle.stepsize if amount is None else amount) < self.minlength for turtle in turtles):
+                return True
+        return False
+
+    def __call__(self, args, instructions, start, end):
+        turtle = args[0]
+        if not self.cullable(getattr(turtle, "turtles", (turtle,)), instructions, start, end):
+            return False
+        self.culled += 1
+        if end is not None:
+            self.skipped += end - start + 1
+        return True
+
+    def summary(self):
+        return "%d branches culled, %d instructions skipped, %d faces" % (self.culled, self.skipped, self.nfaces)
@@ -9,6 +9,8 @@ magnolia = objload.ObjModel("magnolia.obj", 0.01)
 # Define Turtle Symbols
 
 class TurtleForward(lsystems.TurtleSymbol):
+    action = "forward"
+
     def __init__(self, amount=None):
         self.amount = amount
 
@@ -18,6 +20,8 @@ class TurtleForward(lsystems.TurtleSymbol):
 
 
 class TurtleSkip(lsystems.TurtleSymbol):
+    action = "skip"
+
     def __init__(self, amount=None):
         self.amount = amount
 
@@ -27,6 +31,8 @@ class TurtleSkip(lsystems.TurtleSymbol):
 
 
 class TurtleYawLeft(lsystems.TurtleSymbol):
+    action = "yaw_left"
+
     def __init__(self, amount=None):
         self.amount = amount
 
@@ -36,6 +42,8 @@ class TurtleYawLeft(lsystems.TurtleSymbol):
 
 
 class TurtleYawRight(lsystems.TurtleSymbol):
+    action = "yaw_right"
+
     def __init__(self, amount=None):
         self.amount = amount
 
@@ -45,6 +53,8 @@ class TurtleYawRight(lsystems.TurtleSymbol):
 
 
 class TurtlePitchUp(lsystems.TurtleSymbol):
+    action = "pitch_up"
+
     def __init__(self, amount=None):
         self.amount = amount
 
@@ -54,6 +64,8 @@ class TurtlePitchUp(lsystems.TurtleSymbol):
 
 
 class TurtlePitchDown(lsystems.TurtleSymbol):
+    action = "pitch_down"
+
     def __init__(self, amount=None):
         self.amount = amount
 
@@ -63,6 +75,8 @@ class TurtlePitchDown(lsystems.TurtleSymbol):
 
 
 class TurtleRollLeft(lsystems.TurtleSymbol):
+    action = "roll_left"
+
     def __init__(self, amount=None):
         self.amount = amount
 
@@ -72,6 +86,8 @@ class TurtleRollLeft(lsystems.TurtleSymbol):
 
 
 class TurtleRollRight(lsystems.TurtleSymbol):
+    action = "roll_right"
+
     def __init__(self, amount=None):
         self.amount = amount
 
@@ -81,18 +97,31 @@ class TurtleRollRight(lsystems.TurtleSymbol):
 
 
 class TurtlePush(lsystems.TurtleSymbol):
+    action = "push"
+
     def do(self, turtles, stack):
-        stack.append(turtles.clone())
+        # A TurtleStack saves the state in place; a plain list gets a copy
+        if isinstance(stack, list):
+            stack.append(turtles.clone())
+        else:
+            stack.push(turtles)
         return [turtles, stack], {}
 
 
 class TurtlePop(lsystems.TurtleSymbol):
+    action = "pop"
+
     def do(self, turtles, stack):
-        turtles = stack.pop()
+        if isinstance(stack, list):
+            turtles = stack.pop()
+        else:
+            turtles = stack.pop(turtles)
         return [turtles, stack], {}
 
 
 class TurtleSetRadius(lsystems.TurtleSymbol):
+    action = "set_radius"
+
     def __init__(self, amount):
         self.amount = amount
 
@@ -102,24 +131,32 @@ class TurtleSetRadius(lsystems.TurtleSymbol):
 
 
 class TurtleStartPoly(lsystems.TurtleSymbol):
+    action = "startpoly"
+
     def do(self, turtles, stack):
         turtles.startpoly()
         return [turtles, stack], {}
 
 
 class TurtleEndPoly(lsystems.TurtleSymbol):
+    action = "endpoly"
+
     def do(self, turtles, stack):
         turtles.endpoly()
         return [turtles, stack], {}
 
 
 class TurtleHoriz(lsystems.TurtleSymbol):
+    action = "horiz"
+
     def do(self, turtles, stack):
         turtles.horiz()
         return [turtles, stack], {}
 
 
 class ConsiderData(lsystems.TurtleSymbol):
+    action = "consider_data"
+
     def do(self, turtles, stack):
         turtles.consider_data()
         return [turtles, stack], {}
@@ -0,0 +1,120 @@
+# vim: fdm=manual
+import math
+import random
+import lturtlealphabet as la
+
+
+def axiom(trunk_length, nleaves):
+    return [la.TurtleT(trunk_length), la.TurtleC(nleaves)]
+
+
+def leaves_thetas(nleaves, tol=0.05):
+    leaves_thetas = []
+    for i in range(nleaves):
+        ok = False
+        while not ok:
+            newtheta = random.uniform(0, 2*math.pi)
+            for theta in leaves_thetas:
+                if abs(theta - newtheta) <= tol:
+                    break
+            else:
+                ok = True
+        leaves_thetas.append(newtheta)
+    return leaves_thetas
+
+
+def rules(depth, total_trunk_theta, leaves_thetas):
+    return [
+        # + yaw_left
+        # - yaw_right
+        # & pitch_down
+        # ^ pitch_up
+        # \ roll_left
+        # / roll_right
+        # | yaw_left(pi)
+
+        ((1, la.TurtleT), lambda s: [
+            la.TurtleT(0.5*s.amount),
+            la.TurtleYawRight(math.radians(total_trunk_theta) / 2**depth),
+            la.TurtleT(0.5*s.amount),
+        ]),
+        ((1, la.TurtleC), lambda s: [la.TurtlePitchDown(0.5*math.pi)] + sum([
+            [
+                la.TurtleYawRight(theta),
+                la.TurtlePush(),
+                la.TurtleInitialL(),
+                la.TurtlePop(),
+            ] for theta in leaves_thetas
+        ], [])),
+        # The rules were a dict, where this variant shared its key with the
+        # next one and was overwritten; left out to keep the same palms
+        # ((0.33, la.TurtleInitialL), lambda s: [
+        #     la.TurtlePitchDown(),
+        #     la.TurtleForward(),
+        #     la.TurtlePush(),
+        #     la.TurtleYawLeft(),
+        #     la.TurtleYawLeft(),
+        #     la.TurtleYawLeft(),
+        #     la.TurtleForward(),
+        #     la.TurtlePop(),
+        #     la.TurtlePush(),
+        #     la.TurtleYawRight(),
+        #     la.TurtleYawRight(),
+        #     la.TurtleYawRight(),
+        #     la.TurtleForward(),
+        #     la.TurtlePop(),
+        #     la.TurtleL(),
+        # ]),
+        ((0.33, la.TurtleInitialL), lambda s: [
+            la.TurtlePitchUp(),
+            la.TurtleForward(),
+            la.TurtlePush(),
+            la.TurtleYawLeft(),
+            la.TurtleYawLeft(),
+            la.TurtleYawLeft(),
+            la.TurtleForward(),
+            la.TurtlePop(),
+            la.TurtlePush(),
+            la.TurtleYawRight(),
+            la.TurtleYawRight(),
+            la.TurtleYawRight(),
+            la.TurtleForward(),
+            la.TurtlePop(),
+            la.TurtleL(),
+        ]),
+        ((0.34, la.TurtleInitialL), lambda s: [
+            la.TurtlePitchUp(),
+            la.TurtlePitchUp(),
+            la.TurtlePitchUp(),
+            # la.TurtlePush(),
+            # la.TurtleYawLeft(),
+            # la.TurtleYawLeft(),
+            # la.TurtleYawLeft(),
+            # la.TurtleForward(),
+            # la.TurtlePop(),
+            # la.TurtlePush(),
+            # la.TurtleYawRight(),
+            # la.TurtleYawRight(),
+            # la.TurtleYawRight(),
+            # la.TurtleForward(),
+            # la.TurtlePop(),
+            la.TurtleL(),
+        ]),
+        ((1, la.TurtleL), lambda s: [
+            la.TurtlePitchDown(),
+            la.TurtleForward(),
+            la.TurtlePush(),
+            la.TurtleYawLeft(),
+            la.TurtleYawLeft(),
+            la.TurtleYawLeft(),
+            la.TurtleForward(),
+            la.TurtlePop(),
+            la.TurtlePush(),
+            la.TurtleYawRight(),
+            la.TurtleYawRight(),
+            la.TurtleYawRight(),
+            la.TurtleForward(),
+            la.TurtlePop(),
+            la.TurtleL(),
+        ]),
+    ]
@@ -0,0 +1,152 @@
+# vim: fdm=manual
+import math
+import lsystems
+
+
+# Peephole optimizer for expanded turtle strings, run between the L-system
+# expansion and the turtle. Every rewrite leaves the geometry the same (up
+# to rounding):
+#
+#   - runs of rotations about the same axis become one rotation, or none
+#     when they add up to a whole turn;
+#   - runs of skips outside polygons become one skip;
+#   - instructions that only change the turtle state right before a pop are
+#     dropped, since the pop restores it, and so is a push/pop pair left
+#     with nothing in between;
+#   - symbols with no turtle action (the nonterminals) are dropped.
+#
+# Default amounts are folded in only when the optimizer knows the turtle's
+# stepangle/stepsize; otherwise those symbols are kept as they are.
+
+ROTATIONS = {
+    "yaw_left": ("yaw", -1),
+    "yaw_right": ("yaw", 1),
+    "pitch_up": ("pitch", 1),
+    "pitch_down": ("pitch", -1),
+    "roll_left": ("roll", -1),
+    "roll_right": ("roll", 1),
+}
+
+# Actions that only change turtle state saved by a push
+STATE = ("set_radius", "horiz")
+
+
+def kind(cls):
+    """ What the optimizer may do with symbols of type cls """
+    if cls.action is None:
+        return "nop" if cls.do is lsystems.TurtleSymbol.do else "effect"
+    if cls.action in ROTATIONS:
+        return "rotate"
+    if cls.action in ("skip", "push", "pop", "startpoly", "endpoly"):
+        return cls.action
+    if cls.action in STATE:
+        return "state"
+    return "effect"
+
+
+class Peephole(object):
+    """ Optimizes instruction lists and counts what it removed """
+    def __init__(self, stepangle=None, stepsize=None):
+        self.stepangle = stepangle
+        self.stepsize = stepsize
+        self.kinds = {}
+        self.seen = 0
+        self.removed = dict.fromkeys(("rotations", "skips", "dead", "brackets", "nops"), 0)
+
+    def optimize(self, instructions):
+        out = []        # optimized symbols
+        pure = []       # whether each one only changes state a pop restores
+        brackets = []   # (index of the push in out, inpoly at the push)
+        inpoly = False
+        run = None      # pending fold: [key, first symbol, total, count]
+
+        def flush():
+            key, first, total, count = run
+            if key == "skip":
+                amount = total
+                if count > 1:
+                    self.removed["skips"] += count - 1
+            else:
+                amount = math.remainder(total, 2*math.pi)
+                if abs(amount) < 1e-12:
+                    self.removed["rotations"] += count
+                    return
+                if count > 1:
+                    self.removed["rotations"] += count - 1
+                amount *= ROTATIONS[first.action][1]
+            out.append(first if count == 1 else type(first)(amount))
+            pure.append(True)
+
+        for symbol in instructions:
+            self.seen += 1
+            cls = type(symbol)
+            try:
+                what = self.kinds[cls]
+            except KeyError:
+                what = self.kinds[cls] = kind(cls)
+
+            if what == "nop":
+                self.removed["nops"] += 1
+                continue
+
+            key, amount = None, None
+            if what == "rotate" and (symbol.amount is not None or self.stepangle is not None):
+                key = ROTATIONS[cls.action][0]
+                amount = ROTATIONS[cls.action][1]*(self.stepangle if symbol.amount is None else symbol.amount)
+            elif what == "skip" and not inpoly and (symbol.amount is not None or self.stepsize is not None):
+                key = "skip"
+                amount = self.stepsize if symbol.amount is None else symbol.amount
+            if key is not None:
+                if run is not None and run[0] == key:
+                    run[2] += amount
+                    run[3] += 1
+                else:
+                    if run is not None:
+                        flush()
+                    run = [key, symbol, amount, 1]
+                continue
+
+            if what == "pop" and brackets:
+                # Everything since the last geometry is undone by the pop
+                if run is not None:
+                    self.removed["dead"] += run[3]
+                    run = None
+                start, inpoly = brackets.pop()
+                while len(out) > start + 1 and pure[-1]:
+                    out.pop()
+                    pure.pop()
+                    self.removed["dead"] += 1
+                if len(out) == start + 1:
+                    out.pop()
+                    pure.pop()
+                    self.removed["brackets"] += 2
+                    continue
+                out.append(symbol)
+                pure.append(False)
+                continue
+
+            if run is not None:
+                flush()
+                run = None
+            if what == "push":
+                brackets.append((len(out), inpoly))
+            elif what == "startpoly":
+                inpoly = True
+            elif what == "endpoly":
+                inpoly = False
+            out.append(symbol)
+            pure.append(what in ("state", "rotate") or (what == "skip" and not inpoly))
+
+        if run is not None:
+            flush()
+        return out
+
+    def summary(self):
+        removed = sum(self.removed.values())
+        return "%d of %d instructions removed (%.0f%%): %s" % (
+            removed, self.seen, 100*removed/max(self.seen, 1),
+            ", ".join("%d %s" % (count, name) for name, count in self.removed.items() if count))
+
+
+def optimize(instructions, stepangle=None, stepsize=None):
+    return Peephole(stepangle, stepsize).optimize(instructions)
@@ -1,10 +1,16 @@
 # vim: fdm=manual
-import os, sys
+import os, sys, tempfile
+import random
 sys.path.append(os.getcwd())
 import bpy
-import random
-from lookuptable import lookup_table
-from interval import Interval, exp
+import meshbuilder
+import decimate
+import marchingcubes
+import parallel
+import surfacenets
+import samplecache
+import pebbles
+from implicitrock import ImplicitRock
 
 
 bl_info = {
@@ -13,52 +19,6 @@ bl_info = {
 }
 
 
-# Define the rock implicit function generator
-
-class ImplicitRock(object):
-    def __init__(self, cx, cy, cz, minradiusx, maxradiusx, minradiusy, maxradiusy, minradiusz, maxradiusz, nballs):
-        self.cx = cx
-        self.cy = cy
-        self.cz = cz
-
-        self.metaballs = []
-        for i in range(nballs):
-            radiusx = random.uniform(minradiusx, maxradiusx)
-            radiusy = random.uniform(minradiusy, maxradiusy)
-            radiusz = random.uniform(minradiusz, maxradiusz)
-            x = random.uniform(self.cx - maxradiusx + radiusx, self.cx + maxradiusx - radiusx)
-            y = random.uniform(self.cy - maxradiusy + radiusy, self.cy + maxradiusy - radiusy)
-            z = random.uniform(self.cz - maxradiusz + radiusz, self.cz + maxradiusz - radiusz)
-            self.metaballs.append({
-                "x": x,
-                "y": y,
-                "z": z,
-                "radius": max(radiusx, radiusy, radiusz),
-                "invradiusx": 1/radiusx,
-                "invradiusy": 1/radiusy,
-                "invradiusz": 1/radiusz,
-            })
-
-    def metaball_dist2(self, metaball, x, y, z):
-        return (x*metaball["invradiusx"]-metaball["x"])*(x*metaball["invradiusx"]-metaball["x"]) + \
-               (y*metaball["invradiusy"]-metaball["y"])*(y*metaball["invradiusy"]-metaball["y"]) + \
-               (z*metaball["invradiusz"]-metaball["z"])*(z*metaball["invradiusz"]-metaball["z"])
-
-    def fieldfunc(self, r, d):
-        # Blinn's field function (gaussian)
-        return exp(-r * d)
-
-    def __call__(self, x, y, z):
-        return sum([self.fieldfunc(metaball["radius"], self.metaball_dist2(metaball, x, y, z)) for metaball in self.metaballs]) - 1
-
-
-# Linear interpolation function
-
-def linear_interpolate(px, py, pz, fp, qx, qy, qz, fq):
-    alpha = -fp / (fq - fp)
-    return (1 - alpha)*px + alpha*qx, (1 - alpha)*py + alpha*qy, (1 - alpha)*pz + alpha*qz
-
-
 # Define the operator
 
 class RockOperator(bpy.types.Operator):
@@ -73,111 +33,121 @@ class RockOperator(bpy.types.Operator):
     minradiusz: bpy.props.FloatProperty(name="Minimum Radius (Z)", default=0.5)
     maxradiusz: bpy.props.FloatProperty(name="Maximum Radius (Z)", default=2)
     nballs: bpy.props.IntProperty(name="Number of Metaballs", min=1, default=6)
+    # Not remembered between invokes, so each new rock gets a fresh seed
+    seed: bpy.props.IntProperty(name="Seed (0 = Random)", min=0, default=0, options={"SKIP_SAVE"})
+    tolerance: bpy.props.FloatProperty(name="Field Tolerance (0 = Exact)", min=0, default=0, precision=6)
+    arithmetic: bpy.props.EnumProperty(name="Octree Bounds", items=[
+        ("interval", "Interval", "Interval arithmetic"),
+        ("affine", "Affine", "Affine arithmetic, culls more cells"),
+    ], default="interval")
+    polygonizer: bpy.props.EnumProperty(name="Polygonizer", items=[
+        ("marchingcubes", "Marching Cubes", "Triangles from the marching cubes lookup table"),
+        ("surfacenets", "Surface Nets", "One vertex per cell and quad faces, far fewer faces"),
+    ], default="marchingcubes")
+    parallel: bpy.props.BoolProperty(name="Parallel (Marching Cubes)", default=False)
+    lods: bpy.props.IntProperty(name="LOD Levels", min=1, max=8, default=1)
+    cachesize: bpy.props.IntProperty(name="Sample Cache (MB, 0 = Off)", min=0, default=256)
+    decimate_target: bpy.props.IntProperty(name="Decimate to Faces (0 = Off)", min=0, default=0)
+    decimate_tolerance: bpy.props.FloatProperty(name="Decimate Tolerance (0 = Off)", min=0, default=0, precision=4)
 
     def invoke(self, context, event):
         wm = context.window_manager
         return wm.invoke_props_dialog(self)
 
-    def marching_cubes(self, f, vertices, faces, startx, starty, startz, endx, endy, endz, depth=0):
-        def vert2coord(i):
-            if i == 0: return startx, starty, startz
-            if i == 1: return   endx, starty, startz
-            if i == 2: return   endx,   endy, startz
-            if i == 3: return startx,   endy, startz
-            if i == 4: return startx, starty,   endz
-            if i == 5: return   endx, starty,   endz
-            if i == 6: return   endx,   endy,   endz
-            if i == 7: return startx,   endy,   endz
-
-        def edge2verts(i):
-            if i ==  0: return 0, 1
-            if i ==  1: return 1, 2
-            if i ==  2: return 2, 3
-            if i ==  3: return 3, 0
-            if i ==  4: return 4, 5
-            if i ==  5: return 5, 6
-            if i ==  6: return 6, 7
-            if i ==  7: return 7, 4
-            if i ==  8: return 0, 4
-            if i ==  9: return 1, 5
-            if i == 10: return 2, 6
-            if i == 11: return 3, 7
-
-        def edge2coords(i):
-            v0, v1 = edge2verts(i)
-            return vert2coord(v0), vert2coord(v1)
-
-        fX = f(Interval(startx, endx), Interval(starty, endy), Interval(startz, endz))
-        f0 = f(startx, starty, startz) >= 0
-        f1 = f(  endx, starty, startz) >= 0
-        f2 = f(  endx,   endy, startz) >= 0
-        f3 = f(startx,   endy, startz) >= 0
-        f4 = f(startx, starty,   endz) >= 0
-        f5 = f(  endx, starty,   endz) >= 0
-        f6 = f(  endx,   endy,   endz) >= 0
-        f7 = f(startx,   endy,   endz) >= 0
-
-        if 0 not in fX:
-            return vertices, faces
-        if depth >= self.maxdepth:
-            # Draw
-            index = 0
-            if f0: index +=   1  # 2**0
-            if f1: index +=   2  # 2**1
-            if f2: index +=   4  # 2**2
-            if f3: index +=   8  # 2**3
-            if f4: index +=  16  # 2**4
-            if f5: index +=  32  # 2**5
-            if f6: index +=  64  # 2**6
-            if f7: index += 128  # 2**7
-            from_table = lookup_table[index]
-
-            for (edge0, edge1, edge2) in from_table:
-                if edge0 == -1 or edge1 == -1 or edge2 == -1: break
-                v00, v01 = (x00, y00, z00), (x01, y01, z01) = edge2coords(edge0)
-                v10, v11 = (x10, y10, z10), (x11, y11, z11) = edge2coords(edge1)
-                v20, v21 = (x20, y20, z20), (x21, y21, z21) = edge2coords(edge2)
-                # NOTE: No linear interpolation
-                nverts = len(vertices)
-                vertices.append(linear_interpolate(*v00, f(*v00), *v01, f(*v01)))
-                vertices.append(linear_interpolate(*v10, f(*v10), *v11, f(*v11)))
-                vertices.append(linear_interpolate(*v20, f(*v20), *v21, f(*v21)))
-                # vertices.append([(x00 + x01)*0.5, (y00 + y01)*0.5, (z00 + z01)*0.5])
-                # vertices.append([(x10 + x11)*0.5, (y10 + y11)*0.5, (z10 + z11)*0.5])
-                # vertices.append([(x20 + x21)*0.5, (y20 + y21)*0.5, (z20 + z21)*0.5])
-                faces.append([nverts, nverts+1, nverts+2])
-
-            return vertices, faces
-
-        splitx = (startx + endx)*0.5
-        splity = (starty + endy)*0.5
-        splitz = (startz + endz)*0.5
-
-        # Subdivide
-        vertices, faces = self.marching_cubes(f, vertices, faces, startx, splity, startz, splitx,   endy, splitz, depth+1)
-        vertices, faces = self.marching_cubes(f, vertices, faces, splitx, splity, startz,   endx,   endy, splitz, depth+1)
-        vertices, faces = self.marching_cubes(f, vertices, faces, startx, starty, startz, splitx, splity, splitz, depth+1)
-        vertices, faces = self.marching_cubes(f, vertices, faces, splitx, starty, startz,   endx, splity, splitz, depth+1)
-        vertices, faces = self.marching_cubes(f, vertices, faces, startx, splity, splitz, splitx,   endy,   endz, depth+1)
-        vertices, faces = self.marching_cubes(f, vertices, faces, splitx, splity, splitz,   endx,   endy,   endz, depth+1)
-        vertices, faces = self.marching_cubes(f, vertices, faces, startx, starty, splitz, splitx, splity,   endz, depth+1)
-        vertices, faces = self.marching_cubes(f, vertices, faces, splitx, starty, splitz,   endx, splity,   endz, depth+1)
-
-        return vertices, faces
-
     def execute(self, context):
-        rock_implicit = ImplicitRock(0, 0, 0, self.minradiusx, self.maxradiusx, self.minradiusy, self.maxradiusy, self.minradiusz, self.maxradiusz, self.nballs)
-        vertices, faces = self.marching_cubes(rock_implicit, [], [], -2, -2, -2, 2, 2, 2)
-
-        # Generate the mesh from (vertices, faces)
-        mesh = bpy.data.meshes.new("Generated")
-        mesh.from_pydata(vertices, [], faces)
-        mesh.update()
-        obj = bpy.data.objects.new("Generated", mesh)
-        context.collection.objects.link(obj)
+        # A new invoke makes a new rock unless a seed is given; the seed
+        # drawn is kept, so redoing with other settings tweaks the same rock
+        if not self.seed:
+            self.seed = random.randrange(1, 1 << 31)
+        seed = self.seed
+        self.report({"INFO"}, "Seed: %d" % seed)
+        rock_implicit = ImplicitRock(0, 0, 0, self.minradiusx, self.maxradiusx, self.minradiusy, self.maxradiusy, self.minradiusz, self.maxradiusz, self.nballs, tolerance=self.tolerance or None, seed=seed)
+        # Samples of the same seeded rock are kept between runs, so changing
+        # only the depth or the polygonizer does not resample it
+        cache = samplecache.SampleCache(os.path.join(tempfile.gettempdir(), "rock_samples"), self.cachesize << 20) if self.cachesize else None
+        if self.polygonizer == "surfacenets":
+            polygonizer = surfacenets.SurfaceNets(rock_implicit, (-2, -2, -2), (2, 2, 2), self.maxdepth, self.arithmetic, cache=cache)
+        elif self.parallel:
+            polygonizer = parallel.ParallelMarchingCubes(rock_implicit, (-2, -2, -2), (2, 2, 2), self.maxdepth, self.arithmetic, cache=cache)
+        else:
+            polygonizer = marchingcubes.MarchingCubes(rock_implicit, (-2, -2, -2), (2, 2, 2), self.maxdepth, self.arithmetic, cache=cache)
+        if self.lods > 1:
+            # LOD0 at maxdepth, each further LOD one level coarser, all from one pass
+            builders = polygonizer.polygonize_lods([meshbuilder.MeshBuilder() for n in range(min(self.lods, self.maxdepth + 1))])
+            names = ["Generated_LOD%d" % n for n in range(len(builders))]
+        else:
+            builders = [polygonizer.polygonize(meshbuilder.MeshBuilder())]
+            names = ["Generated"]
+        self.report({"INFO"}, "Octree: " + polygonizer.octree.summary())
+        if cache is not None:
+            self.report({"INFO"}, "Sample cache: " + cache.summary())
+        if self.decimate_target or self.decimate_tolerance:
+            builders = [decimate.decimate(builder, self.decimate_target or None, self.decimate_tolerance or None) for builder in builders]
+            for builder in builders:
+                message = decimate.missed(builder, self.decimate_target)
+                if message:
+                    self.report({"WARNING"}, message)
+
+        # Generate the meshes from the builders' buffers
         bpy.ops.object.select_all(action="DESELECT")
-        obj.select_set(state=True)
-        context.view_layer.objects.active = obj
+        for name, builder in reversed(list(zip(names, builders))):
+            mesh = bpy.data.meshes.new(name)
+            builder.tomesh(mesh)
+            obj = bpy.data.objects.new(name, mesh)
+            context.collection.objects.link(obj)
+            obj.select_set(state=True)
+            context.view_layer.objects.active = obj
+
+        return {"FINISHED"}
+
+
+class PebbleFieldOperator(bpy.types.Operator):
+    bl_idname = "mesh.pebble_field_generator"
+    bl_label = "Pebble Field Generator"
+
+    nvariants: bpy.props.IntProperty(name="Distinct Rocks", min=1, default=8)
+    ninstances: bpy.props.IntProperty(name="Instances", min=1, default=1000)
+    seed: bpy.props.IntProperty(name="Seed", min=0, default=0)
+    sizex: bpy.props.FloatProperty(name="Field Size (X)", min=0, default=10)
+    sizey: bpy.props.FloatProperty(name="Field Size (Y)", min=0, default=10)
+    spacing: bpy.props.FloatProperty(name="Minimum Spacing", min=0, default=0.2)
+    minscale: bpy.props.FloatProperty(name="Minimum Scale", min=0, default=0.02)
+    maxscale: bpy.props.FloatProperty(name="Maximum Scale", min=0, default=0.06)
+    maxdepth: bpy.props.IntProperty(name="Maximum Depth (Marching Cubes)", default=4)
+    minradius: bpy.props.FloatProperty(name="Minimum Radius", default=0.5)
+    maxradius: bpy.props.FloatProperty(name="Maximum Radius", default=2)
+    nballs: bpy.props.IntProperty(name="Number of Metaballs", min=1, default=6)
+    polygonizer: bpy.props.EnumProperty(name="Polygonizer", items=[
+        ("marchingcubes", "Marching Cubes", "Triangles from the marching cubes lookup table"),
+        ("surfacenets", "Surface Nets", "One vertex per cell and quad faces, far fewer faces"),
+    ], default="marchingcubes")
+    decimate_target: bpy.props.IntProperty(name="Decimate to Faces (0 = Off)", min=0, default=0)
+
+    def invoke(self, context, event):
+        wm = context.window_manager
+        return wm.invoke_props_dialog(self)
+
+    def execute(self, context):
+        radii = (self.minradius, self.maxradius)*3
+        seeds = pebbles.variant_seeds(self.seed, self.nvariants)
+        buffers = pebbles.variants(seeds, radii, self.nballs, self.maxdepth, polygonizer=self.polygonizer, target=self.decimate_target or None)
+        meshes = [meshbuilder.commit(bpy.data.meshes.new("Pebble_%d" % n), *arrays) for n, arrays in enumerate(buffers)]
+
+        # Every instance is a linked duplicate: its own object and transform
+        # over one of the shared variant meshes
+        collection = bpy.data.collections.new("Pebbles")
+        context.collection.children.link(collection)
+        variant, locations, rotations, scales = pebbles.scatter(
+            self.ninstances, self.nvariants,
+            (-self.sizex/2, -self.sizey/2, 0), (self.sizex/2, self.sizey/2, 0),
+            self.minscale, self.maxscale, self.spacing, self.seed)
+        for n, location, rotation, scale in zip(variant.tolist(), locations.tolist(), rotations.tolist(), scales.tolist()):
+            obj = bpy.data.objects.new("Pebble", meshes[n])
+            obj.location = location
+            obj.rotation_euler = rotation
+            obj.scale = scale
+            collection.objects.link(obj)
+        self.report({"INFO"}, "%d pebbles from %d meshes" % (len(variant), len(meshes)))
 
         return {"FINISHED"}
 
@@ -186,15 +156,18 @@ class RockOperator(bpy.types.Operator):
 
 def menu_func(self, context):
     self.layout.operator(RockOperator.bl_idname)
+    self.layout.operator(PebbleFieldOperator.bl_idname)
 
 
 def register():
     bpy.utils.register_class(RockOperator)
+    bpy.utils.register_class(PebbleFieldOperator)
     bpy.types.VIEW3D_MT_add.append(menu_func)
 
 
 def unregister():
     bpy.utils.unregister_class(RockOperator)
+    bpy.utils.unregister_class(PebbleFieldOperator)
     bpy.types.VIEW3D_MT_add.remove(menu_func)
 
 
@@ -0,0 +1,154 @@
+# vim: fdm=manual
+import numpy as np
+from interval import Interval, IntervalArray
+
+
+def pad(coeffs, n):
+    return tuple(coeffs) + (0,)*(n - len(coeffs))
+
+
+class Affine(object):
+    """
+    Affine arithmetic in the reduced (AF1) form
+
+        center + sum(coeffs[i]*e[i]) + error*e'    with e[i], e' in [-1, 1]
+
+    where the noise symbols e[i] are shared between values that derive from
+    the same inputs (e.g. e[0], e[1], e[2] for x, y and z), and every
+    nonlinear approximation error goes into the single independent term
+    `error`. Unlike Interval, x - x is 0 and (x - a)**2 stays close to its
+    true range, so bounds over a cell are much tighter.
+
+    center, coeffs and error may be floats or NumPy arrays of the same
+    shape, so a whole octree level is bounded in one call as with
+    IntervalArray. Like IntervalArray, membership is tested with contains()
+    for arrays; `in` works for scalars.
+    """
+    # Make NumPy defer to our reflected operators
+    __array_ufunc__ = None
+
+    def __init__(self, center, coeffs=(), error=0):
+        self.center = center
+        self.coeffs = tuple(coeffs)
+        self.error = error
+
+    @classmethod
+    def variable(cls, inf, sup, symbol, nsymbols=3):
+        """ The affine form of an input ranging over [inf, sup], on noise symbol `symbol` """
+        coeffs = [0]*nsymbols
+        coeffs[symbol] = (sup - inf)/2
+        return cls((inf + sup)/2, coeffs, 0)
+
+    def cast(self, it):
+        if isinstance(it, Affine):
+            return it
+        elif isinstance(it, (Interval, IntervalArray)):
+            # A fresh, independent range
+            return Affine((it.inf + it.sup)/2, (), (it.sup - it.inf)/2)
+        elif isinstance(it, (int, float, np.ndarray, np.number)):
+            return Affine(it, (), 0)
+        else:
+            raise TypeError("Cannot cast type to Affine: %s" % type(it))
+
+    @property
+    def radius(self):
+        return sum([abs(coeff) for coeff in self.coeffs]) + self.error
+
+    @property
+    def inf(self):
+        return self.center - self.radius
+
+    @property
+    def sup(self):
+        return self.center + self.radius
+
+    def tointerval(self):
+        if isinstance(self.center, np.ndarray):
+            return IntervalArray(self.inf, self.sup)
+        return Interval(self.inf, self.sup)
+
+    def __getitem__(self, index):
+        pick = lambda value: value[index] if isinstance(value, np.ndarray) else value
+        return Affine(pick(self.center), [pick(coeff) for coeff in self.coeffs], pick(self.error))
+
+    def __add__(self, other):
+        other = self.cast(other)
+        n = max(len(self.coeffs), len(other.coeffs))
+        return Affine(self.center + other.center,
+                      [a + b for a, b in zip(pad(self.coeffs, n), pad(other.coeffs, n))],
+                      self.error + other.error)
+
+    def __radd__(self, other):
+        other = self.cast(other)
+        return other + self
+
+    def __neg__(self):
+        return Affine(-self.center, [-coeff for coeff in self.coeffs], self.error)
+
+    def __sub__(self, other):
+        other = self.cast(other)
+        return self + (-other)
+
+    def __rsub__(self, other):
+        other = self.cast(other)
+        return other - self
+
+    def __mul__(self, other):
+        if not isinstance(other, (Affine, Interval, IntervalArray)):
+            # Exact scaling by a constant
+            return Affine(self.center*other, [coeff*other for coeff in self.coeffs], self.error*abs(other))
+        other = self.cast(other)
+        n = max(len(self.coeffs), len(other.coeffs))
+        a, b = pad(self.coeffs, n), pad(other.coeffs, n)
+        return Affine(self.center*other.center,
+                      [self.center*bi + other.center*ai for ai, bi in zip(a, b)],
+                      abs(self.center)*other.error + abs(other.center)*self.error + self.radius*other.radius)
+
+    def __rmul__(self, other):
+        return self * other
+
+    def __truediv__(self, other):
+        if not isinstance(other, (Affine, Interval, IntervalArray)):
+            return self * (1/other)
+        return self * (1/self.cast(other).tointerval())
+
+    def __pow__(self, n):
+        if n == 0:
+            return Affine(1)
+        elif n == 1:
+            return self
+        elif n != 2:
+            return self * self**(n - 1)
+        # The quadratic part (sum coeffs*e)**2 lies in [0, r**2]
+        r = self.radius - self.error
+        return Affine(self.center*self.center + r*r/2,
+                      [2*self.center*coeff for coeff in self.coeffs],
+                      2*abs(self.center)*self.error + self.error*(2*r + self.error) + r*r/2)
+
+    def exp(self):
+        # Min-range approximation: exp(x) ~ alpha*x + zeta +- delta on [a, b],
+        # with alpha = exp(a) so that exp(x) - alpha*x is monotonic and the
+        # enclosure never drops below exp(a) > 0
+        a, b = self.inf, self.sup
+        with np.errstate(over="ignore", invalid="ignore"):
+            alpha = np.exp(a)
+            lower = alpha - alpha*a
+            upper = np.exp(b) - alpha*b
+            zeta = (lower + upper)/2
+            delta = (upper - lower)/2
+            finite = np.isfinite(zeta) & np.isfinite(delta)
+        if np.all(finite):
+            return Affine(alpha*self.center + zeta, [alpha*coeff for coeff in self.coeffs], alpha*self.error + delta)
+        # Overflow: give up on those entries, their range is unbounded
+        if not isinstance(a, np.ndarray):
+            return Affine(0, (), np.inf)
+        with np.errstate(over="ignore", invalid="ignore"):
+            return Affine(np.where(finite, alpha*self.center + zeta, 0),
+                          [np.where(finite, alpha*coeff, 0) for coeff in self.coeffs],
+                          np.where(finite, alpha*self.error + delta, np.inf))
+
+    def contains(self, it):
+        return (self.inf <= it) & (it <= self.sup)
+
+    def __contains__(self, it):
+        return bool(self.contains(it))
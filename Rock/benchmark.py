@@ -0,0 +1,310 @@
+# vim: fdm=manual
+import importlib.util
+import random
+import shutil
+import tempfile
+import time
+import numpy as np
+from interval import Interval, IntervalArray
+from implicitrock import ImplicitRock
+from lookuptable import lookup_table
+import marchingcubes
+import surfacenets
+import meshbuilder
+import decimate
+import samplecache
+import pebbles
+import fieldexpr
+
+
+def timeit(f, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        f()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def bench_field(nballs, resolution=32, npoints=20000):
+    random.seed(0)
+    rock = ImplicitRock(0, 0, 0, 0.5, 2, 0.5, 2, 0.5, 2, nballs)
+    axis = np.linspace(-2, 2, resolution + 1)
+    indices = np.random.RandomState(0).randint(0, resolution + 1, (npoints, 3))
+    points = axis[indices]
+
+    scalar = timeit(lambda: [rock(x, y, z) for x, y, z in points.tolist()], repeat=1)
+    batch = timeit(lambda: rock.evaluate(points))
+    lattice = timeit(lambda: rock.evaluate_lattice(axis, axis, axis, indices))
+    print("field     %3d balls  %6d points  scalar %.3fs  evaluate %.4fs (%.0fx)  evaluate_lattice %.4fs (%.0fx)"
+          % (nballs, npoints, scalar, batch, scalar/batch, lattice, scalar/lattice))
+
+
+def bench_cull(nballs, depth=4):
+    # Bounds every cell of one octree level, one by one and as one IntervalArray
+    random.seed(0)
+    rock = ImplicitRock(0, 0, 0, 0.5, 2, 0.5, 2, 0.5, 2, nballs)
+    n = 2**depth
+    lattice = np.indices((n, n, n)).reshape(3, -1).T
+    inf = -2 + lattice*(4/n)
+    sup = inf + 4/n
+
+    cells = [[Interval(l, u) for l, u in zip(lo, hi)] for lo, hi in zip(inf.tolist(), sup.tolist())]
+    scalar = timeit(lambda: [0 in rock(*cell) for cell in cells], repeat=1)
+    batch = timeit(lambda: rock(*[IntervalArray(inf[:, axis], sup[:, axis]) for axis in range(3)]).contains(0))
+
+    expected = [0 in rock(*cell) for cell in cells]
+    kept = rock(*[IntervalArray(inf[:, axis], sup[:, axis]) for axis in range(3)]).contains(0)
+    assert kept.tolist() == expected
+    print("cull      %3d balls  %6d cells   Interval %.3fs  IntervalArray %.4fs (%.0fx)  %d kept"
+          % (nballs, len(cells), scalar, batch, scalar/batch, int(kept.sum())))
+
+
+def boulder_field(nballs, tolerance=None, density=1/8):
+    # Balls of radius 0.5-1 spread with constant density over a cube
+    state = np.random.RandomState(0)
+    side = (nballs/density)**(1/3)
+    radii = state.uniform(0.5, 1, (nballs, 3))
+    centers = state.uniform(-side/2, side/2, (nballs, 3))
+    return ImplicitRock.fromarrays(centers/radii, 1/radii, radii.max(axis=1), tolerance), side
+
+
+def bench_cutoff(nballs, tolerance=1e-3, npoints=20000, ncells=4096):
+    exact, side = boulder_field(nballs)
+    indexed, _ = boulder_field(nballs, tolerance)
+    state = np.random.RandomState(1)
+    points = state.uniform(-side/2, side/2, (npoints, 3))
+    lower = state.uniform(-side/2, side/2, (ncells, 3))
+    upper = lower + 1
+    boxes = [IntervalArray(lower[:, axis], upper[:, axis]) for axis in range(3)]
+
+    full = timeit(lambda: exact.evaluate(points))
+    cut = timeit(lambda: indexed.evaluate(points))
+    error = np.abs(exact.evaluate(points) - indexed.evaluate(points)).max()
+    assert error <= tolerance
+    fullbound = timeit(lambda: exact(*boxes), repeat=1)
+    cutbound = timeit(lambda: indexed(*boxes), repeat=1)
+    print("cutoff   %5d balls  evaluate %.2fus/point -> %.2fus/point  bound %.1fus/cell -> %.1fus/cell  max error %.1e"
+          % (nballs, 1e6*full/npoints, 1e6*cut/npoints, 1e6*fullbound/ncells, 1e6*cutbound/ncells, error))
+
+
+def bench_bounds(maxdepth, nballs):
+    # Cells visited per depth with interval and with affine bounds
+    random.seed(0)
+    rock = ImplicitRock(0, 0, 0, 0.5, 2, 0.5, 2, 0.5, 2, nballs)
+    visited = {}
+    times = {}
+    for arithmetic in ("interval", "affine"):
+        polygonizer = marchingcubes.MarchingCubes(rock, (-2, -2, -2), (2, 2, 2), maxdepth, arithmetic)
+        times[arithmetic] = timeit(lambda: polygonizer.octree.leaves(), repeat=1)
+        visited[arithmetic] = [stat["visited"] for stat in polygonizer.octree.stats]
+    print("bounds    %3d balls  interval %.2fs  affine %.2fs" % (nballs, times["interval"], times["affine"]))
+    for depth, (a, b) in enumerate(zip(visited["interval"], visited["affine"])):
+        print("          depth %d  %7d -> %7d visited  (%4.1f%% fewer)" % (depth, a, b, 100*(a - b)/a))
+
+
+def surface_distance(rock, vertices, h=1e-5):
+    # First-order distance to the surface, |f|/|grad f|
+    offsets = np.eye(3)*h
+    gradient = np.stack([(rock.evaluate(vertices + offset) - rock.evaluate(vertices - offset))/(2*h) for offset in offsets], axis=1)
+    return np.abs(rock.evaluate(vertices))/np.linalg.norm(gradient, axis=1)
+
+
+def bench_surfacenets(maxdepth, nballs=6):
+    random.seed(0)
+    rock = ImplicitRock(0, 0, 0, 0.5, 2, 0.5, 2, 0.5, 2, nballs)
+    for cls in (marchingcubes.MarchingCubes, surfacenets.SurfaceNets):
+        polygonizer = cls(rock, (-2, -2, -2), (2, 2, 2), maxdepth)
+        elapsed = timeit(lambda: polygonizer.polygonize(meshbuilder.MeshBuilder()))
+        co, loops, starts, totals = polygonizer.polygonize(meshbuilder.MeshBuilder()).arrays()
+        distance = surface_distance(rock, co.reshape(-1, 3).astype(np.float64))
+        print("%-13s depth %d  %7d vertices  %7d faces (%7d triangles)  %.3fs  distance mean %.1e max %.1e"
+              % (cls.__name__, maxdepth, len(co)//3, len(totals), int((totals - 2).sum()), elapsed, distance.mean(), distance.max()))
+
+
+def bench_lods(maxdepth, nlods=4, nballs=16):
+    random.seed(0)
+    rock = ImplicitRock(0, 0, 0, 0.5, 2, 0.5, 2, 0.5, 2, nballs)
+    for cls in (marchingcubes.MarchingCubes, surfacenets.SurfaceNets):
+        finest = timeit(lambda: cls(rock, (-2, -2, -2), (2, 2, 2), maxdepth).polygonize(meshbuilder.MeshBuilder()))
+        separate = timeit(lambda: [cls(rock, (-2, -2, -2), (2, 2, 2), maxdepth - n).polygonize(meshbuilder.MeshBuilder()) for n in range(nlods)])
+        pyramid = timeit(lambda: cls(rock, (-2, -2, -2), (2, 2, 2), maxdepth).polygonize_lods([meshbuilder.MeshBuilder() for n in range(nlods)]))
+        print("lods      %-13s depth %d  %d LODs  finest only %.3fs  separate runs %.3fs  one pass %.3fs"
+              % (cls.__name__, maxdepth, nlods, finest, separate, pyramid))
+
+
+def scan_triangulate(mc, leaves, values):
+    # Reference: per-cell walk over lookup_table with a dict of edge vertices
+    vertices, faces, cache = [], [], {}
+    for (i, j, k), row in zip(leaves.tolist(), values.tolist()):
+        index = sum(1 << bit for bit in range(8) if row[bit] >= 0)
+        for edges in lookup_table[index]:
+            if -1 in edges:
+                break
+            face = []
+            for edge in edges:
+                a, b = marchingcubes.EDGES[edge].tolist()
+                p = tuple(int(c) for c in (i, j, k) + marchingcubes.CORNERS[a])
+                q = tuple(int(c) for c in (i, j, k) + marchingcubes.CORNERS[b])
+                fp, fq = row[a], row[b]
+                if q < p:
+                    p, q, fp, fq = q, p, fq, fp
+                if (p, q) not in cache:
+                    alpha = -fp / (fq - fp)
+                    cache[p, q] = len(vertices)
+                    vertices.append([(1 - alpha)*u + alpha*v for u, v in zip(mc.coord(*p), mc.coord(*q))])
+                face.append(cache[p, q])
+            faces.append(face)
+    return vertices, faces
+
+
+def bench_triangulate(maxdepth, nballs=6):
+    random.seed(0)
+    mc = marchingcubes.MarchingCubes(ImplicitRock(0, 0, 0, 0.5, 2, 0.5, 2, 0.5, 2, nballs), (-2, -2, -2), (2, 2, 2), maxdepth)
+    leaves = mc.octree.leaves()
+    values = mc.prefetch(leaves)
+
+    scan = timeit(lambda: scan_triangulate(mc, leaves, values), repeat=1)
+    batch = timeit(lambda: mc.triangulate(leaves, values))
+    vertices, faces = mc.triangulate(leaves, values)
+    expected = scan_triangulate(mc, leaves, values)
+    assert faces.tolist() == expected[1] and np.allclose(vertices, expected[0])
+    print("emit      depth %d  %6d leaves  %6d faces  lookup_table %.3fs  compiled %.4fs (%.0fx)"
+          % (maxdepth, len(leaves), len(faces), scan, batch, scan/batch))
+
+
+def bench_decimate(maxdepth, nballs=6):
+    # Decimated finest mesh against a coarser polygonization of about the same size
+    random.seed(0)
+    rock = ImplicitRock(0, 0, 0, 0.5, 2, 0.5, 2, 0.5, 2, nballs)
+    co, loops, starts, totals = marchingcubes.MarchingCubes(rock, (-2, -2, -2), (2, 2, 2), maxdepth).polygonize(meshbuilder.MeshBuilder()).arrays()
+    vertices, faces = co.reshape(-1, 3).astype(np.float64), decimate.triangulate(loops, starts, totals)
+    for coarser in (1, 2):
+        co, loops, starts, totals = marchingcubes.MarchingCubes(rock, (-2, -2, -2), (2, 2, 2), maxdepth - coarser).polygonize(meshbuilder.MeshBuilder()).arrays()
+        elapsed = timeit(lambda: decimate.simplify(vertices, faces, target=len(totals)), repeat=1)
+        simplified, simplifiedfaces = decimate.simplify(vertices, faces, target=len(totals))
+        distance = surface_distance(rock, simplified)
+        coarse = surface_distance(rock, co.reshape(-1, 3).astype(np.float64))
+        print("decimate  depth %d  %7d -> %6d faces  %.3fs  distance mean %.1e max %.1e  (depth %d: mean %.1e max %.1e)"
+              % (maxdepth, len(faces), len(simplifiedfaces), elapsed, distance.mean(), distance.max(), maxdepth - coarser, coarse.mean(), coarse.max()))
+
+
+def bench_decimate_tubes(ntubes, nsegments, nsides=4):
+    # Open square tubes, like the Tree add-on's branches. Borders may not be
+    # joined, so a tube keeps at least one ring of faces and short tubes
+    # stop above the target
+    random.seed(0)
+    builder = meshbuilder.MeshBuilder()
+    angles = np.linspace(0, 2*np.pi, nsides, endpoint=False)
+    for _ in range(ntubes):
+        origin = np.array([random.uniform(-10, 10) for _ in range(3)])
+        lengths = np.cumsum([0] + [random.uniform(0.5, 1.5) for _ in range(nsegments)])
+        radius = random.uniform(0.05, 0.2)
+        builder.add_grid(origin + np.stack(np.broadcast_arrays(radius*np.cos(angles)[None, :], radius*np.sin(angles)[None, :], lengths[:, None]), axis=-1), wrap_v=True)
+    co, loops, starts, totals = builder.arrays()
+    vertices, faces = co.reshape(-1, 3).astype(np.float64), decimate.triangulate(loops, starts, totals)
+    for target in (len(faces)//2, len(faces)//4):
+        elapsed = timeit(lambda: decimate.simplify(vertices, faces, target=target), repeat=1)
+        _, simplified = decimate.simplify(vertices, faces, target=target)
+        print("decimate  %d tubes of %d segments  %7d -> %6d faces  target %6d  %.3fs%s"
+              % (ntubes, nsegments, len(faces), len(simplified), target, elapsed, "  (missed)" if len(simplified) > target else ""))
+
+
+def bench_upload(nfaces):
+    # Needs Blender: blender -b --python benchmark.py
+    import bpy
+
+    side = int(round(nfaces**0.5))
+    u, v = np.meshgrid(np.linspace(0, 1, side + 1), np.linspace(0, 1, side + 1), indexing="ij")
+    builder = meshbuilder.MeshBuilder()
+    builder.add_grid(np.stack([u, v, np.sin(u*v)], axis=-1))
+    vertices, faces = builder.pydata()
+    vertices = [tuple(vertex) for vertex in vertices]
+
+    start = time.perf_counter()
+    mesh = bpy.data.meshes.new("from_pydata")
+    mesh.from_pydata(vertices, [], faces)
+    mesh.update()
+    pydata = time.perf_counter() - start
+    bpy.data.meshes.remove(mesh)
+
+    start = time.perf_counter()
+    mesh = bpy.data.meshes.new("foreach_set")
+    builder.tomesh(mesh)
+    foreach = time.perf_counter() - start
+    bpy.data.meshes.remove(mesh)
+
+    print("upload %8d faces  from_pydata %.3fs  foreach_set %.3fs  (%.1fx)" % (side*side, pydata, foreach, pydata/foreach))
+
+
+def bench_samplecache(maxdepth, nballs=256):
+    # Corner sampling of an exact many-ball rock: cold, warm, one level coarser, one level deeper
+    rock = ImplicitRock(0, 0, 0, 0.5, 2, 0.5, 2, 0.5, 2, nballs, seed=0)
+    directory = tempfile.mkdtemp()
+    try:
+        for depth in (maxdepth, maxdepth, maxdepth - 1, maxdepth + 1):
+            uncached = marchingcubes.MarchingCubes(rock, (-2, -2, -2), (2, 2, 2), depth)
+            leaves = uncached.octree.leaves()
+            plain = timeit(lambda: uncached.prefetch(leaves), repeat=1)
+            cache = samplecache.SampleCache(directory)
+            cached = marchingcubes.MarchingCubes(rock, (-2, -2, -2), (2, 2, 2), depth, cache=cache)
+            elapsed = timeit(lambda: cached.prefetch(leaves), repeat=1)
+            print("cache     depth %d  uncached %.3fs  cached %.3fs  %s" % (depth, plain, elapsed, cache.summary()))
+    finally:
+        shutil.rmtree(directory)
+
+
+def bench_pebbles(nvariants, ninstances, maxdepth=5, nballs=6):
+    # A unique mesh per rock against a few variants, polygonized in parallel, plus transforms
+    radii = (0.5, 2)*3
+    seeds = pebbles.variant_seeds(0, ninstances)
+    unique = timeit(lambda: [marchingcubes.MarchingCubes(ImplicitRock(0, 0, 0, *radii, nballs, seed=seed), (-2, -2, -2), (2, 2, 2), maxdepth).polygonize(meshbuilder.MeshBuilder())
+                             for seed in seeds], repeat=1)
+    instanced = timeit(lambda: (pebbles.variants(seeds[:nvariants], radii, nballs, maxdepth),
+                                pebbles.scatter(ninstances, nvariants, (-10, -10, 0), (10, 10, 0), 0.02, 0.06)), repeat=1)
+    print("pebbles   depth %d  %5d rocks  unique meshes %.3fs  %d variants + instances %.3fs  (%.1fx)"
+          % (maxdepth, ninstances, unique, nvariants, instanced, unique/instanced))
+
+
+def bench_fieldexpr(nballs, npoints=20000, ncells=4096):
+    # The same field hand-written (ImplicitRock) and compiled from an expression tape
+    random.seed(0)
+    rock = ImplicitRock(0, 0, 0, 0.5, 2, 0.5, 2, 0.5, 2, nballs)
+    field = fieldexpr.Field(fieldexpr.fromrock(rock))
+    points = np.random.default_rng(0).uniform(-2, 2, (npoints, 3))
+    lower = np.random.default_rng(1).uniform(-2, 2, (ncells, 3))
+    boxes = [IntervalArray(lower[:, axis], lower[:, axis] + 0.125) for axis in range(3)]
+    scalar = [points[n].tolist() for n in range(npoints // 10)]
+    for name, f in (("rock", rock), ("tape", field)):
+        times = (timeit(lambda: [f(*point) for point in scalar]), timeit(lambda: f.evaluate(points)),
+                 timeit(lambda: f.gradient(points)), timeit(lambda: f(*boxes)))
+        print("field     %s %3d balls  %5d scalar %.3fs  %d batch %.3fs  gradient %.3fs  %d boxes %.3fs"
+              % (name, nballs, len(scalar), times[0], npoints, times[1], times[2], ncells, times[3]))
+
+
+if __name__ == "__main__":
+    for nballs in (6, 16, 64):
+        bench_field(nballs)
+    for nballs in (6, 16, 64):
+        bench_cull(nballs)
+    for maxdepth in (5, 6, 7):
+        bench_triangulate(maxdepth)
+    for nballs in (16, 64, 256, 1024):
+        bench_cutoff(nballs)
+    for nballs in (6, 64):
+        bench_bounds(7, nballs)
+    for maxdepth in (4, 5, 6, 7):
+        bench_surfacenets(maxdepth)
+    bench_lods(7)
+    bench_decimate(6)
+    for nsegments in (1, 2, 8):
+        bench_decimate_tubes(1000, nsegments)
+    bench_samplecache(6)
+    bench_pebbles(8, 1000)
+    for nballs in (6, 64):
+        bench_fieldexpr(nballs)
+    if importlib.util.find_spec("bpy") is not None:
+        for nfaces in (10**4, 10**5, 10**6):
+            bench_upload(nfaces)
@@ -0,0 +1,381 @@
+# vim: fdm=manual
+import hashlib
+import math
+import numpy as np
+from interval import Interval, IntervalArray, exp as interval_exp
+from affine import Affine
+
+
+# Implicit fields as expression graphs. A field is written once with Expr
+# operators and helpers (metaballs, blends, offsets, transforms), then
+# compiled into a flat instruction tape: every distinct subexpression gets
+# one slot, in evaluation order. The tape is turned into the source of a
+# straight-line Python function, which is run in three namespaces, giving a
+# scalar evaluator (math on floats), a batch evaluator (NumPy on arrays of
+# points) and a bound evaluator (Interval, IntervalArray or Affine, as the
+# octree passes them), with no per-operation dispatch on the graph. A
+# second, forward-mode tape gives batch gradients.
+
+class Expr(object):
+    """
+    A node of a field expression: a variable ("x", "y", "z"), a constant
+    ("const", with its value), or an operation on argument nodes. Build them
+    with X, Y, Z, the arithmetic operators, integer powers and the helpers
+    below, and evaluate them through Field.
+    """
+    # Make NumPy defer to our reflected operators
+    __array_ufunc__ = None
+
+    def __init__(self, op, args=(), value=None):
+        self.op = op
+        self.args = tuple(args)
+        self.value = value
+
+    def cast(self, other):
+        if isinstance(other, Expr):
+            return other
+        return Expr("const", (), float(other))
+
+    def __add__(self, other):
+        if not isinstance(other, Expr) and other == 0:
+            return self
+        return Expr("add", (self, self.cast(other)))
+
+    def __radd__(self, other):
+        if other == 0:
+            return self
+        return Expr("add", (self.cast(other), self))
+
+    def __sub__(self, other):
+        return Expr("sub", (self, self.cast(other)))
+
+    def __rsub__(self, other):
+        return Expr("sub", (self.cast(other), self))
+
+    def __mul__(self, other):
+        if not isinstance(other, Expr) and other == 1:
+            return self
+        return Expr("mul", (self, self.cast(other)))
+
+    def __rmul__(self, other):
+        if other == 1:
+            return self
+        return Expr("mul", (self.cast(other), self))
+
+    def __truediv__(self, other):
+        if not isinstance(other, Expr):
+            return self * (1/other)
+        return Expr("div", (self, other))
+
+    def __rtruediv__(self, other):
+        return Expr("div", (self.cast(other), self))
+
+    def __neg__(self):
+        return Expr("neg", (self,))
+
+    def __pow__(self, n):
+        if int(n) != n or n < 0:
+            raise ValueError("Only non-negative integer powers are supported: %r" % n)
+        return Expr("pow", (self,), int(n))
+
+    def substitute(self, x=None, y=None, z=None):
+        """ This expression with the variables replaced by other expressions """
+        replace = {"x": x, "y": y, "z": z}
+        done = {}
+        for node in postorder(self):
+            if node.op in replace and replace[node.op] is not None:
+                done[id(node)] = replace[node.op]
+            elif node.args:
+                done[id(node)] = Expr(node.op, [done[id(arg)] for arg in node.args], node.value)
+            else:
+                done[id(node)] = node
+        return done[id(self)]
+
+
+X = Expr("x")
+Y = Expr("y")
+Z = Expr("z")
+
+
+def constant(value):
+    return X.cast(value)
+
+
+def exp(e):
+    return Expr("exp", (constant(e),))
+
+
+def minimum(a, b):
+    return Expr("min", (constant(a), constant(b)))
+
+
+def maximum(a, b):
+    return Expr("max", (constant(a), constant(b)))
+
+
+def absolute(e):
+    return maximum(e, -e)
+
+
+# Shapes and operations, for fields that are positive inside
+
+def metaball(center, radii, weight=1.0):
+    """ Blinn's gaussian metaball over the ellipsoid with the given center and radii, as in ImplicitRock """
+    r = max(radii)
+    distance2 = sum([(axis*(1/radius) - c/radius)**2 for axis, c, radius in zip((X, Y, Z), center, radii)])
+    return weight*exp(-r*distance2)
+
+
+def fromrock(rock):
+    """ The exact field of an ImplicitRock, as an expression """
+    centers = rock.centers/rock.invradii
+    return sum([metaball(center, 1/invradii) for center, invradii in zip(centers.tolist(), rock.invradii)]) - 1
+
+
+def union(a, b):
+    return maximum(a, b)
+
+
+def intersection(a, b):
+    return minimum(a, b)
+
+
+def difference(a, b):
+    return minimum(a, -b)
+
+
+def smooth_union(a, b, k):
+    """ Union with the crease rounded off where the two fields are within k of each other """
+    gap = maximum(k - absolute(a - b), 0)
+    return maximum(a, b) + gap*gap*(1/(4*k))
+
+
+def offset(e, amount):
+    """ Grows (amount > 0) or shrinks the positive region by shifting the field """
+    return e + amount
+
+
+def translate(e, dx, dy, dz):
+    return e.substitute(X - dx, Y - dy, Z - dz)
+
+
+def scale(e, sx, sy=None, sz=None):
+    sy = sx if sy is None else sy
+    sz = sx if sz is None else sz
+    return e.substitute(X*(1/sx), Y*(1/sy), Z*(1/sz))
+
+
+def postorder(root):
+    """ The nodes of the graph under root, each once, arguments before their users """
+    order = []
+    seen = set()
+    stack = [(root, False)]
+    while stack:
+        node, expanded = stack.pop()
+        if expanded:
+            order.append(node)
+        elif id(node) not in seen:
+            seen.add(id(node))
+            stack.append((node, True))
+            stack.extend((arg, False) for arg in reversed(node.args))
+    return order
+
+
+# Bounds of min and max, keeping the type of the bound
+
+def bound_minimum(a, b):
+    return bound_select(a, b, np.minimum)
+
+
+def bound_maximum(a, b):
+    return bound_select(a, b, np.maximum)
+
+
+def bound_select(a, b, select):
+    affine = isinstance(a, Affine) or isinstance(b, Affine)
+    a, b = [it.tointerval() if isinstance(it, Affine) else it for it in (a, b)]
+    inf = select(a.inf if hasattr(a, "inf") else a, b.inf if hasattr(b, "inf") else b)
+    sup = select(a.sup if hasattr(a, "sup") else a, b.sup if hasattr(b, "sup") else b)
+    it = IntervalArray(inf, sup) if isinstance(inf, np.ndarray) else Interval(inf, sup)
+    # Min and max are not affine; their result is a fresh noise term
+    return Affine(0).cast(it) if affine else it
+
+
+SCALAR = {"exp": math.exp, "minimum": min, "maximum": max}
+BATCH = {"exp": np.exp, "minimum": np.minimum, "maximum": np.maximum}
+BOUND = {"exp": interval_exp, "minimum": bound_minimum, "maximum": bound_maximum}
+
+TEMPLATES = {
+    "add": "%s + %s", "sub": "%s - %s", "mul": "%s * %s", "div": "%s / %s", "neg": "-%s",
+    "exp": "exp(%s)", "min": "minimum(%s, %s)", "max": "maximum(%s, %s)",
+}
+
+
+class Tape(object):
+    """
+    The instructions of an expression: (op, argument slots, value) per slot,
+    with structurally equal subexpressions sharing a slot. The last slot is
+    the result.
+    """
+    def __init__(self, expr=None, instructions=None):
+        if instructions is None:
+            instructions = []
+            slots = {}
+            keys = {}
+            for node in postorder(expr):
+                key = (node.op, tuple(slots[id(arg)] for arg in node.args), node.value)
+                if key not in keys:
+                    keys[key] = len(instructions)
+                    instructions.append(key)
+                slots[id(node)] = keys[key]
+        self.instructions = [tuple(instruction) for instruction in instructions]
+
+    def __len__(self):
+        return len(self.instructions)
+
+    def source(self):
+        """ Python source of f(x, y, z) running the tape """
+        lines = ["def f(x, y, z):"]
+        for slot, (op, args, value) in enumerate(self.instructions):
+            if op in ("x", "y", "z"):
+                expression = op
+            elif op == "const":
+                expression = repr(value)
+            elif op == "pow":
+                expression = "r%d**%d" % (args[0], value)
+            else:
+                expression = TEMPLATES[op] % tuple("r%d" % arg for arg in args)
+            lines.append("    r%d = %s" % (slot, expression))
+        lines.append("    return r%d" % (len(self.instructions) - 1))
+        return "\n".join(lines) + "\n"
+
+    def gradient_source(self):
+        """
+        Python source of g(x, y, z) returning (value, dx, dy, dz), by forward
+        differentiation of the tape. Derivatives known to be zero are
+        dropped while generating the code.
+        """
+        lines = ["def g(x, y, z):"]
+        derivatives = []
+        for slot, (op, args, value) in enumerate(self.instructions):
+            r = "r%d" % slot
+            a = ["r%d" % arg for arg in args]
+            da = [derivatives[arg] for arg in args]
+            if op in ("x", "y", "z"):
+                lines.append("    %s = %s" % (r, op))
+                d = [("1.0" if op == axis else None) for axis in "xyz"]
+            elif op == "const":
+                lines.append("    %s = %r" % (r, value))
+                d = [None]*3
+            else:
+                if op == "pow":
+                    lines.append("    %s = %s**%d" % (r, a[0], value))
+                else:
+                    lines.append("    %s = %s" % (r, TEMPLATES[op] % tuple(a)))
+                d = []
+                for axis in range(3):
+                    dx = [derivative[axis] for derivative in da]
+                    d.append(chain(op, r, a, dx, value))
+            names = []
+            for axis, expression in zip("xyz", d):
+                if expression is None or expression == "1.0":
+                    names.append(expression)
+                else:
+                    lines.append("    d%s%s = %s" % (axis, r, expression))
+                    names.append("d%s%s" % (axis, r))
+            derivatives.append(names)
+        last = len(self.instructions) - 1
+        lines.append("    return r%d, %s" % (last, ", ".join("0.0" if name is None else name for name in derivatives[last])))
+        return "\n".join(lines) + "\n"
+
+
+def chain(op, r, a, da, value):
+    """ Source of the derivative of slot r = op(a...) along one axis, or None when it is zero """
+    if all(d is None for d in da):
+        return None
+    if op == "add":
+        return " + ".join(d for d in da if d is not None)
+    elif op == "sub":
+        if da[1] is None:
+            return da[0]
+        return "-%s" % da[1] if da[0] is None else "%s - %s" % (da[0], da[1])
+    elif op == "neg":
+        return "-%s" % da[0]
+    elif op == "mul":
+        return " + ".join("%s*%s" % (other, d) for other, d in ((a[1], da[0]), (a[0], da[1])) if d is not None)
+    elif op == "div":
+        terms = []
+        if da[0] is not None:
+            terms.append("%s/%s" % (da[0], a[1]))
+        if da[1] is not None:
+            terms.append("-%s*%s/%s" % (r, da[1], a[1]))
+        return " + ".join(terms)
+    elif op == "pow":
+        if value == 0:
+            return None
+        return "%d*%s**%d*%s" % (value, a[0], value - 1, da[0]) if value > 1 else da[0]
+    elif op == "exp":
+        return "%s*%s" % (r, da[0])
+    elif op in ("min", "max"):
+        test = "<=" if op == "min" else ">="
+        return "where(%s %s %s, %s, %s)" % (a[0], test, a[1], da[0] or "0.0", da[1] or "0.0")
+    raise ValueError("No derivative for op %r" % op)
+
+
+def build(source, namespace, name):
+    scope = dict(namespace)
+    exec(compile(source, "<field tape>", "exec"), scope)
+    return scope[name]
+
+
+class Field(object):
+    """
+    A compiled field expression, usable wherever an ImplicitRock is: called
+    on floats, Intervals, IntervalArrays or Affines it runs the scalar or
+    bound evaluator; evaluate() and gradient() run the batch evaluators over
+    (N, 3) arrays of points, and fingerprint() identifies it to a
+    SampleCache. Fields pickle as their tape, for the worker processes.
+    """
+    def __init__(self, expr=None, tape=None):
+        self.tape = Tape(expr) if tape is None else tape
+        source = self.tape.source()
+        self.scalar = build(source, SCALAR, "f")
+        self.batch = build(source, BATCH, "f")
+        self.bound = build(source, BOUND, "f")
+        self.batch_gradient = build(self.tape.gradient_source(), dict(BATCH, where=np.where), "g")
+
+    def __getstate__(self):
+        return {"instructions": self.tape.instructions}
+
+    def __setstate__(self, state):
+        self.__init__(tape=Tape(instructions=state["instructions"]))
+
+    def __call__(self, x, y, z):
+        if isinstance(x, (Interval, IntervalArray, Affine)):
+            return self.bound(x, y, z)
+        elif isinstance(x, np.ndarray):
+            return self.batch(x, y, z)
+        return self.scalar(x, y, z)
+
+    def evaluate(self, points, chunk=16384):
+        """ Field values at an (N, 3) array of points """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        values = np.empty(len(points))
+        for first in range(0, len(points), chunk):
+            block = points[first:first + chunk]
+            values[first:first + chunk] = self.batch(block[:, 0], block[:, 1], block[:, 2])
+        return values
+
+    def gradient(self, points, chunk=16384):
+        """ Field gradients at an (N, 3) array of points """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        gradients = np.empty((len(points), 3))
+        for first in range(0, len(points), chunk):
+            block = points[first:first + chunk]
+            _, *partials = self.batch_gradient(block[:, 0], block[:, 1], block[:, 2])
+            for axis in range(3):
+                gradients[first:first + chunk, axis] = partials[axis]
+        return gradients
+
+    def fingerprint(self):
+        return hashlib.sha1(self.tape.source().encode()).hexdigest()
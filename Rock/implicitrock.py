@@ -0,0 +1,195 @@
+# vim: fdm=manual
+import hashlib
+import math
+import random
+import numpy as np
+from interval import Interval, IntervalArray, exp
+from affine import Affine
+from metaballgrid import MetaballGrid
+
+
+# Define the rock implicit function generator
+
+class ImplicitRock(object):
+    """
+    Sum of Blinn metaballs minus one. The metaball parameters live in NumPy
+    arrays, one row per ball, so the field can be evaluated point by point
+    (also on Intervals, for octree culling) or on whole batches of points.
+
+    With a `tolerance`, every ball is cut off where its contribution drops
+    below tolerance/nballs, and a MetaballGrid over the cut-off boxes lets
+    point and interval queries skip the balls that cannot reach them. The
+    field then differs from the exact one by less than `tolerance`, and
+    interval bounds widen by `tolerance` so they enclose both.
+
+    With a `seed`, the metaballs are drawn from their own random.Random(seed)
+    instead of the global generator, so the same seed and parameters always
+    give the same rock.
+    """
+    def __init__(self, cx, cy, cz, minradiusx, maxradiusx, minradiusy, maxradiusy, minradiusz, maxradiusz, nballs, tolerance=None, seed=None):
+        self.cx = cx
+        self.cy = cy
+        self.cz = cz
+        self.seed = seed
+        rng = random if seed is None else random.Random(seed)
+
+        centers = []
+        invradii = []
+        radii = []
+        for i in range(nballs):
+            radiusx = rng.uniform(minradiusx, maxradiusx)
+            radiusy = rng.uniform(minradiusy, maxradiusy)
+            radiusz = rng.uniform(minradiusz, maxradiusz)
+            x = rng.uniform(self.cx - maxradiusx + radiusx, self.cx + maxradiusx - radiusx)
+            y = rng.uniform(self.cy - maxradiusy + radiusy, self.cy + maxradiusy - radiusy)
+            z = rng.uniform(self.cz - maxradiusz + radiusz, self.cz + maxradiusz - radiusz)
+            centers.append((x, y, z))
+            invradii.append((1/radiusx, 1/radiusy, 1/radiusz))
+            radii.append(max(radiusx, radiusy, radiusz))
+
+        self.setballs(centers, invradii, radii, tolerance)
+
+    @classmethod
+    def fromarrays(cls, centers, invradii, radii, tolerance=None):
+        """ A field over given metaballs (centers in the scaled space of each ball) """
+        rock = cls.__new__(cls)
+        rock.cx, rock.cy, rock.cz = 0, 0, 0
+        rock.seed = None
+        rock.setballs(centers, invradii, radii, tolerance)
+        return rock
+
+    def setballs(self, centers, invradii, radii, tolerance=None):
+        self.centers = np.array(centers, dtype=np.float64).reshape(-1, 3)
+        self.invradii = np.array(invradii, dtype=np.float64).reshape(-1, 3)
+        self.radii = np.array(radii, dtype=np.float64)
+
+        # Plain float rows for the point-by-point path
+        self.metaballs = [tuple(row) for row in np.column_stack([self.centers, self.radii, self.invradii]).tolist()]
+
+        self.tolerance = tolerance
+        self.index = None
+        if tolerance is not None:
+            # exp(-r*d) < tolerance/nballs outside d = log(nballs/tolerance)/r,
+            # an ellipsoid around the ball's center; index its bounding box
+            cutoff = np.sqrt(max(math.log(max(len(self.radii), 1)/tolerance), 0)/self.radii)
+            center = self.centers/self.invradii
+            halfsize = cutoff[:, None]/self.invradii
+            self.index = MetaballGrid(center - halfsize, center + halfsize)
+
+    def fingerprint(self):
+        """ A digest of everything the field values depend on, however the rock was made """
+        digest = hashlib.sha1()
+        for array in (self.centers, self.invradii, self.radii):
+            digest.update(np.ascontiguousarray(array, dtype=np.float64).tobytes())
+        digest.update(repr(self.tolerance).encode())
+        return digest.hexdigest()
+
+    def metaball_dist2(self, metaball, x, y, z):
+        mx, my, mz, _, invradiusx, invradiusy, invradiusz = metaball
+        # Squares rather than products, so bound types can use that both
+        # factors are the same quantity
+        return (x*invradiusx-mx)**2 + (y*invradiusy-my)**2 + (z*invradiusz-mz)**2
+
+    def fieldfunc(self, r, d):
+        # Blinn's field function (gaussian)
+        return exp(-r * d)
+
+    def __call__(self, x, y, z):
+        if self.index is None:
+            return sum([self.fieldfunc(metaball[3], self.metaball_dist2(metaball, x, y, z)) for metaball in self.metaballs]) - 1
+        if isinstance(x, IntervalArray) or (isinstance(x, Affine) and isinstance(x.center, np.ndarray)):
+            return self.bound(x, y, z)
+        if isinstance(x, (Interval, Affine)):
+            _, balls = self.index.box_pairs((x.inf, y.inf, z.inf), (x.sup, y.sup, z.sup))
+            return sum([self.fieldfunc(self.metaballs[ball][3], self.metaball_dist2(self.metaballs[ball], x, y, z)) for ball in balls.tolist()]) \
+                + Interval(0, self.tolerance) - 1
+        _, balls = self.index.point_pairs((x, y, z))
+        return sum([self.fieldfunc(self.metaballs[ball][3], self.metaball_dist2(self.metaballs[ball], x, y, z)) for ball in balls.tolist()]) - 1
+
+    def bound(self, x, y, z):
+        """ Indexed interval bounds over the boxes of three IntervalArrays (or array Affines) """
+        box, ball = self.index.box_pairs(np.column_stack([x.inf, y.inf, z.inf]), np.column_stack([x.sup, y.sup, z.sup]))
+        metaball = (self.centers[ball, 0], self.centers[ball, 1], self.centers[ball, 2], self.radii[ball],
+                    self.invradii[ball, 0], self.invradii[ball, 1], self.invradii[ball, 2])
+        terms = self.fieldfunc(self.radii[ball], self.metaball_dist2(metaball, x[box], y[box], z[box]))
+        total = lambda values: np.bincount(box, weights=np.broadcast_to(values, box.shape), minlength=len(x.center if isinstance(x, Affine) else x.inf))
+        if isinstance(terms, Affine):
+            # Sum the affine forms, keeping the correlation between the balls
+            return Affine(total(terms.center) + self.tolerance/2 - 1, [total(coeff) for coeff in terms.coeffs], total(terms.error) + self.tolerance/2)
+        return IntervalArray(total(terms.inf) - 1, total(terms.sup) + self.tolerance - 1)
+
+    def evaluate(self, points, chunk=16384):
+        """ Field values at an (N, 3) array of points """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        if self.index is not None:
+            return self.evaluate_pairs(points, chunk, lambda block, point, ball: np.exp(-self.radii[ball]*np.sum(
+                (points[block][point]*self.invradii[ball] - self.centers[ball])**2, axis=1)))
+        values = np.empty(len(points))
+        for first in range(0, len(points), chunk):
+            block = points[first:first + chunk]
+            d = np.zeros((len(block), len(self.radii)))
+            for axis in range(3):
+                delta = block[:, axis:axis+1]*self.invradii[:, axis] - self.centers[:, axis]
+                d += delta*delta
+            d *= -self.radii
+            np.exp(d, out=d)
+            np.sum(d, axis=1, out=values[first:first + chunk])
+        return values - 1
+
+    def gradient(self, points, chunk=16384):
+        """ Field gradients at an (N, 3) array of points """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        gradients = np.empty((len(points), 3))
+        for first in range(0, len(points), chunk):
+            block = points[first:first + chunk]
+            if self.index is not None:
+                point, ball = self.index.point_pairs(block)
+                delta = block[point]*self.invradii[ball] - self.centers[ball]
+                weight = -2*self.radii[ball]*np.exp(-self.radii[ball]*np.sum(delta*delta, axis=1))
+                terms = weight[:, None]*delta*self.invradii[ball]
+                gradients[first:first + chunk] = np.stack([np.bincount(point, weights=terms[:, axis], minlength=len(block)) for axis in range(3)], axis=1)
+            else:
+                delta = block[:, None, :]*self.invradii - self.centers
+                weight = -2*self.radii*np.exp(-self.radii*np.einsum("nbi,nbi->nb", delta, delta))
+                gradients[first:first + chunk] = np.einsum("nb,nbi->ni", weight, delta*self.invradii)
+        return gradients
+
+    def evaluate_pairs(self, points, chunk, terms):
+        """ Sums terms(block, point, ball) over the indexed (point, ball) pairs of every slice of points """
+        values = np.empty(len(points))
+        for first in range(0, len(points), chunk):
+            block = slice(first, first + chunk)
+            point, ball = self.index.point_pairs(points[block])
+            values[block] = np.bincount(point, weights=terms(block, point, ball), minlength=len(points[block]))
+        return values - 1
+
+    def factors(self, xs, ys, zs):
+        """ Per-axis gaussian factors, (n, nballs) for each axis """
+        return tuple(np.exp(-self.radii*(np.asarray(ts, dtype=np.float64)[:, None]*self.invradii[:, axis] - self.centers[:, axis])**2)
+                     for axis, ts in enumerate((xs, ys, zs)))
+
+    def evaluate_grid(self, xs, ys, zs):
+        """
+        Field values on the lattice xs × ys × zs, as an (nx, ny, nz) array.
+        The gaussian factors per axis, so this costs one exp per axis sample
+        and ball, plus a single contraction over the balls. Always exact.
+        """
+        ex, ey, ez = self.factors(xs, ys, zs)
+        return np.einsum("ib,jb,kb->ijk", ex, ey, ez, optimize=True) - 1
+
+    def evaluate_lattice(self, xs, ys, zs, indices, chunk=16384):
+        """
+        Field values at the lattice points (xs[i], ys[j], zs[k]) for an (N, 3)
+        integer array of (i, j, k), without evaluating the rest of the lattice.
+        """
+        ex, ey, ez = self.factors(xs, ys, zs)
+        indices = np.asarray(indices, dtype=np.int64).reshape(-1, 3)
+        if self.index is not None:
+            axes = [np.asarray(ts, dtype=np.float64) for ts in (xs, ys, zs)]
+            points = np.column_stack([axes[axis][indices[:, axis]] for axis in range(3)])
+            return self.evaluate_pairs(points, chunk, lambda block, point, ball: ex[indices[block][point, 0], ball]*ey[indices[block][point, 1], ball]*ez[indices[block][point, 2], ball])
+        values = np.empty(len(indices))
+        for first in range(0, len(indices), chunk):
+            block = indices[first:first + chunk]
+            np.einsum("nb,nb,nb->n", ex[block[:, 0]], ey[block[:, 1]], ez[block[:, 2]], out=values[first:first + chunk])
+        return values - 1
@@ -1,6 +1,7 @@
 # vim: fdm=manual
 
 import math
+import numpy as np
 
 
 class Interval(object):
@@ -57,12 +58,15 @@ class Interval(object):
         return other / self
 
     def __pow__(self, n):
+        # Non-negative integer powers; even powers are never negative
         if n == 0:
             return Interval(1, 1)
-        elif n == 1:
-            return self
+        elif n % 2 == 1 or self.inf >= 0:
+            return Interval(self.inf**n, self.sup**n)
+        elif self.sup <= 0:
+            return Interval(self.sup**n, self.inf**n)
         else:
-            return (self*self)**(n-1)
+            return Interval(0, max(self.inf**n, self.sup**n))
 
     def exp(self):
         return Interval(math.exp(self.inf), math.exp(self.sup))
@@ -91,8 +95,115 @@ class Interval(object):
         return self.inf <= it <= self.sup
 
 
+class IntervalArray(object):
+    """
+    An array of intervals, stored as two NumPy arrays of lower and upper
+    bounds. Supports the operators of Interval elementwise, so a field can
+    be bounded over many cells in one call. Since `in` must return a single
+    bool, membership is tested with contains(), which returns a mask.
+    """
+    # Make NumPy defer to our reflected operators
+    __array_ufunc__ = None
+
+    def __init__(self, inf, sup):
+        self.inf = np.asarray(inf, dtype=np.float64)
+        self.sup = np.asarray(sup, dtype=np.float64)
+
+    def cast(self, it):
+        if isinstance(it, IntervalArray):
+            return it
+        elif isinstance(it, Interval):
+            return IntervalArray(it.inf, it.sup)
+        elif isinstance(it, (int, float, np.ndarray, np.number)):
+            return IntervalArray(it, it)
+        else:
+            raise TypeError("Cannot cast type to IntervalArray: %s" % type(it))
+
+    def __len__(self):
+        return len(self.inf)
+
+    def __getitem__(self, index):
+        if np.ndim(self.inf[index]) == 0:
+            return Interval(float(self.inf[index]), float(self.sup[index]))
+        return IntervalArray(self.inf[index], self.sup[index])
+
+    def __add__(self, other):
+        other = self.cast(other)
+        return IntervalArray(self.inf + other.inf, self.sup + other.sup)
+
+    def __radd__(self, other):
+        other = self.cast(other)
+        return other + self
+
+    def __neg__(self):
+        return IntervalArray(-self.sup, -self.inf)
+
+    def __sub__(self, other):
+        other = self.cast(other)
+        return IntervalArray(self.inf - other.sup, self.sup - other.inf)
+
+    def __rsub__(self, other):
+        other = self.cast(other)
+        return other - self
+
+    def __mul__(self, other):
+        other = self.cast(other)
+        products = (self.inf*other.inf, self.inf*other.sup, self.sup*other.inf, self.sup*other.sup)
+        return IntervalArray(np.minimum.reduce(products), np.maximum.reduce(products))
+
+    def __rmul__(self, other):
+        other = self.cast(other)
+        return other * self
+
+    def __truediv__(self, other):
+        other = self.cast(other)
+        with np.errstate(divide="ignore"):
+            a, b = 1/other.inf, 1/other.sup
+        return self * IntervalArray(np.minimum(a, b), np.maximum(a, b))
+
+    def __rtruediv__(self, other):
+        other = self.cast(other)
+        return other / self
+
+    def __pow__(self, n):
+        if n == 0:
+            return IntervalArray(np.ones_like(self.inf), np.ones_like(self.sup))
+        a, b = self.inf**n, self.sup**n
+        if n % 2 == 1:
+            return IntervalArray(a, b)
+        return IntervalArray(np.where(self.inf >= 0, a, np.where(self.sup <= 0, b, 0)),
+                             np.maximum(a, b))
+
+    def exp(self):
+        return IntervalArray(np.exp(self.inf), np.exp(self.sup))
+
+    def __eq__(self, other):
+        other = self.cast(other)
+        return (self.inf == other.inf) & (self.sup == other.sup)
+
+    def __lt__(self, other):
+        other = self.cast(other)
+        return self.sup < other.inf
+
+    def __le__(self, other):
+        other = self.cast(other)
+        return self.inf <= other.sup
+
+    def __gt__(self, other):
+        other = self.cast(other)
+        return self.inf > other.sup
+
+    def __ge__(self, other):
+        other = self.cast(other)
+        return self.sup >= other.inf
+
+    def contains(self, it):
+        return (self.inf <= it) & (it <= self.sup)
+
+
 def exp(it):
-    if isinstance(it, Interval):
+    # Interval, IntervalArray, affine.Affine
+    if hasattr(it, "exp"):
         return it.exp()
     else:
         return math.exp(it)
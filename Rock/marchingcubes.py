@@ -0,0 +1,167 @@
+# vim: fdm=manual
+import numpy as np
+from lookuptable import lookup_table
+from octree import Octree
+
+
+# Cube corners as lattice offsets, numbered as in lookuptable.py
+CORNERS = np.array([(0, 0, 0), (1, 0, 0), (1, 1, 0), (0, 1, 0),
+                    (0, 0, 1), (1, 0, 1), (1, 1, 1), (0, 1, 1)], dtype=np.int64)
+
+# Cube edges as pairs of corners
+EDGES = np.array([(0, 1), (1, 2), (2, 3), (3, 0),
+                  (4, 5), (5, 6), (6, 7), (7, 4),
+                  (0, 4), (1, 5), (2, 6), (3, 7)], dtype=np.int64)
+
+
+# The lookup table compiled into arrays: up to five edge triples per case,
+# padded with -1, and the number of triangles of each case.
+TRIANGLES = np.array(lookup_table, dtype=np.int64)
+TRIANGLE_COUNTS = np.count_nonzero(TRIANGLES[:, :, 0] >= 0, axis=1)
+
+# Every edge runs along one axis from its lower corner to its upper corner
+EDGE_AXIS = np.argmax(CORNERS[EDGES[:, 0]] != CORNERS[EDGES[:, 1]], axis=1)
+EDGE_LOW = np.where(CORNERS[EDGES[:, 0], EDGE_AXIS] == 0, EDGES[:, 0], EDGES[:, 1])
+EDGE_HIGH = np.where(CORNERS[EDGES[:, 0], EDGE_AXIS] == 0, EDGES[:, 1], EDGES[:, 0])
+
+
+class MarchingCubes(object):
+    """
+    Adaptive marching cubes over the integer lattice of the finest octree
+    level. Every cell corner is identified by its lattice coordinates and
+    every edge by its lower corner and axis, so corner samples and edge
+    vertices are computed once and shared by all cells that touch them,
+    which also makes the output mesh watertight.
+
+    The octree is culled level by level first (see octree.py); the corners
+    of all surviving leaf cells are then sampled in one batch, through
+    f.evaluate_lattice or f.evaluate when the field provides them (see
+    implicitrock.py), and one by one otherwise. Triangles for all leaves
+    are emitted with one gather through the compiled lookup table.
+
+    With a SampleCache (see samplecache.py), corner samples are read from
+    and added to the cache instead of always being computed.
+    """
+    def __init__(self, f, start, end, maxdepth, arithmetic="interval", cache=None):
+        self.f = f
+        self.cache = cache
+        self.start = start
+        self.end = end
+        self.maxdepth = maxdepth
+        self.resolution = 2**maxdepth
+        self.step = tuple((e - s) / self.resolution for s, e in zip(start, end))
+        self.octree = Octree(f, start, end, maxdepth, arithmetic=arithmetic)
+
+    def coord(self, i, j, k):
+        return (self.start[0] + i*self.step[0],
+                self.start[1] + j*self.step[1],
+                self.start[2] + k*self.step[2])
+
+    def polygonize(self, builder):
+        leaves = self.octree.leaves()
+        builder.add_mesh(*self.mesh(leaves, self.prefetch(leaves)))
+        return builder
+
+    def polygonize_lods(self, builders):
+        """
+        Fills builders[n] with the mesh this polygonizer would make at
+        maxdepth - n, from the one octree traversal and one batch of samples:
+        the cells that survive culling at each depth are the leaves of the
+        coarser meshes, and their corners are lattice points of the finest
+        level, shared between levels wherever they coincide.
+        """
+        self.octree.leaves()
+        empty = np.empty((0, 3), dtype=np.int64)
+        levels = [(n, 2**n, self.octree.levels.get(self.maxdepth - n, empty)) for n in range(len(builders))]
+        corners = [(cells[:, None, :] + CORNERS*size).reshape(-1, 3) for n, size, cells in levels]
+        codes, inverse = self.unique(np.concatenate(corners))
+        values = self.sample(self.decode(codes))[inverse]
+
+        first = 0
+        for (n, size, cells), builder in zip(levels, builders):
+            coarse = self.coarser(self.maxdepth - n)
+            builder.add_mesh(*coarse.mesh(cells // size, values[first:first + 8*len(cells)].reshape(-1, 8)))
+            first += 8*len(cells)
+        return builders
+
+    def coarser(self, maxdepth):
+        """ The same polygonizer over the lattice of a coarser level """
+        return MarchingCubes(self.f, self.start, self.end, maxdepth, self.octree.arithmetic, self.cache)
+
+    def unique(self, lattice):
+        """ Sorted codes of the distinct lattice points, and the index of every point into them """
+        side = self.resolution + 1
+        codes, inverse = np.unique((lattice[:, 0]*side + lattice[:, 1])*side + lattice[:, 2], return_inverse=True)
+        return codes, inverse.reshape(-1)
+
+    def decode(self, codes):
+        side = self.resolution + 1
+        return np.stack([codes // (side*side), codes // side % side, codes % side], axis=1)
+
+    def sample(self, lattice):
+        """ Field values at an (N, 3) array of lattice points """
+        if self.cache is not None:
+            return self.cache.sample(self, lattice, self.evaluate)
+        return self.evaluate(lattice)
+
+    def evaluate(self, lattice):
+        if hasattr(self.f, "evaluate_lattice"):
+            axes = [s + np.arange(self.resolution + 1)*h for s, h in zip(self.start, self.step)]
+            return self.f.evaluate_lattice(*axes, lattice)
+        elif hasattr(self.f, "evaluate"):
+            return self.f.evaluate(np.array(self.start) + lattice*np.array(self.step))
+        return np.array([self.f(*self.coord(*key)) for key in lattice.tolist()])
+
+    def prefetch(self, leaves):
+        """ Samples every corner of the given leaf cells, returning an (M, 8) array """
+        if len(leaves) == 0:
+            return np.empty((0, 8))
+        codes, inverse = self.unique((leaves[:, None, :] + CORNERS).reshape(-1, 3))
+        return self.sample(self.decode(codes))[inverse].reshape(-1, 8)
+
+    def mesh(self, leaves, values):
+        return self.triangulate(leaves, values)
+
+    def triangulate(self, leaves, values):
+        """
+        (vertices, faces) for leaf cells with (M, 8) corner values. Edge
+        vertices are numbered in order of first use, cell by cell.
+        """
+        return self.keyed_triangulate(leaves, values)[1:]
+
+    def keyed_triangulate(self, leaves, values):
+        """ Like triangulate, but also returns the lattice edge key of every vertex """
+        cases = (values >= 0).astype(np.int64) @ (1 << np.arange(8))
+        counts = TRIANGLE_COUNTS[cases]
+        total = int(counts.sum())
+        if total == 0:
+            return np.empty(0, dtype=np.int64), np.empty((0, 3)), np.empty((0, 3), dtype=np.int32)
+
+        # One row per triangle: its cell and its three edges
+        cell = np.repeat(np.arange(len(leaves)), counts)
+        slot = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+        edges = TRIANGLES[cases[cell], slot].ravel()
+        cell = np.repeat(cell, 3)
+
+        # Key every edge by its lower lattice corner and its axis
+        side = self.resolution + 1
+        low = leaves[cell] + CORNERS[EDGE_LOW[edges]]
+        keys = ((low[:, 0]*side + low[:, 1])*side + low[:, 2])*3 + EDGE_AXIS[edges]
+        unique, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+        order = np.argsort(first)
+        rank = np.empty(len(order), dtype=np.int64)
+        rank[order] = np.arange(len(order))
+
+        # Interpolate each distinct edge once
+        first = first[order]
+        cell, edges, low = cell[first], edges[first], low[first]
+        fp = values[cell, EDGE_LOW[edges]]
+        fq = values[cell, EDGE_HIGH[edges]]
+        high = low + CORNERS[EDGE_HIGH[edges]] - CORNERS[EDGE_LOW[edges]]
+        p = np.array(self.start) + low*np.array(self.step)
+        q = np.array(self.start) + high*np.array(self.step)
+        alpha = (-fp / (fq - fp))[:, None]
+        vertices = (1 - alpha)*p + alpha*q
+
+        faces = rank[inverse.reshape(-1)].reshape(-1, 3).astype(np.int32)
+        return unique[order], vertices, faces
@@ -0,0 +1,77 @@
+# vim: fdm=manual
+import numpy as np
+
+
+def expand(starts, counts):
+    """ Concatenated ranges starts[n]:starts[n] + counts[n], with the range number of every entry """
+    owner = np.repeat(np.arange(len(counts)), counts)
+    offsets = np.arange(len(owner)) - np.repeat(np.cumsum(counts) - counts, counts)
+    return owner, np.repeat(starts, counts) + offsets
+
+
+class MetaballGrid(object):
+    """
+    Uniform grid over the axis-aligned boxes of a set of balls. Every grid
+    cell lists (in CSR form) the balls whose box overlaps it, so point and
+    box queries only look at the balls near them.
+    """
+    def __init__(self, lower, upper, subdivisions=3, maxcells=64):
+        self.lower = np.asarray(lower, dtype=np.float64).reshape(-1, 3)
+        self.upper = np.asarray(upper, dtype=np.float64).reshape(-1, 3)
+        nballs = len(self.lower)
+
+        # Cells a fraction of the size of a typical box, at most maxcells per axis
+        self.origin = self.lower.min(axis=0) if nballs else np.zeros(3)
+        extent = (self.upper.max(axis=0) if nballs else np.ones(3)) - self.origin
+        typical = np.median(self.upper - self.lower, axis=0) if nballs else np.ones(3)
+        self.cellsize = np.maximum(np.maximum(typical/subdivisions, extent/maxcells), 1e-9)
+        self.shape = np.maximum(np.ceil(extent/self.cellsize).astype(np.int64), 1)
+
+        # Bucket every ball into the cells its box overlaps
+        first, last = self.cellrange(self.lower, self.upper)
+        owner, cells = self.cells_in(first, last)
+        order = np.argsort(cells, kind="stable")
+        self.balls = owner[order]
+        self.offsets = np.searchsorted(cells[order], np.arange(int(np.prod(self.shape)) + 1))
+
+    def cellrange(self, lower, upper):
+        first = np.floor((lower - self.origin)/self.cellsize).astype(np.int64)
+        last = np.floor((upper - self.origin)/self.cellsize).astype(np.int64)
+        return np.clip(first, 0, self.shape - 1), np.clip(last, 0, self.shape - 1)
+
+    def cells_in(self, first, last):
+        """ (query, flat cell) pairs for every cell of the index ranges first..last """
+        span = last - first + 1
+        query, offset = expand(np.zeros(len(span), dtype=np.int64), np.prod(span, axis=1))
+        sy, sz = span[query, 1], span[query, 2]
+        local = np.stack([offset // (sy*sz), offset // sz % sy, offset % sz], axis=1)
+        cell = first[query] + local
+        return query, (cell[:, 0]*self.shape[1] + cell[:, 1])*self.shape[2] + cell[:, 2]
+
+    def inside(self, lower, upper):
+        return np.all((upper >= self.origin) & (lower <= self.origin + self.shape*self.cellsize), axis=1)
+
+    def point_pairs(self, points):
+        """ (point, ball) pairs for the balls listed in the cell of each point """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        valid = np.flatnonzero(self.inside(points, points))
+        first, _ = self.cellrange(points[valid], points[valid])
+        cell = (first[:, 0]*self.shape[1] + first[:, 1])*self.shape[2] + first[:, 2]
+        owner, entries = expand(self.offsets[cell], self.offsets[cell + 1] - self.offsets[cell])
+        return valid[owner], self.balls[entries]
+
+    def box_pairs(self, lower, upper):
+        """ (box, ball) pairs for every ball whose box overlaps the query box """
+        lower = np.asarray(lower, dtype=np.float64).reshape(-1, 3)
+        upper = np.asarray(upper, dtype=np.float64).reshape(-1, 3)
+        valid = np.flatnonzero(self.inside(lower, upper))
+        first, last = self.cellrange(lower[valid], upper[valid])
+        query, cell = self.cells_in(first, last)
+        owner, entries = expand(self.offsets[cell], self.offsets[cell + 1] - self.offsets[cell])
+        query, ball = valid[query[owner]], self.balls[entries]
+
+        # A ball spanning several of the query's cells is listed once
+        unique = np.unique(query*max(len(self.lower), 1) + ball)
+        query, ball = unique // max(len(self.lower), 1), unique % max(len(self.lower), 1)
+        overlap = np.all((lower[query] <= self.upper[ball]) & (upper[query] >= self.lower[ball]), axis=1)
+        return query[overlap], ball[overlap]
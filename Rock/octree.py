@@ -0,0 +1,101 @@
+# vim: fdm=manual
+import numpy as np
+from interval import IntervalArray
+from affine import Affine
+
+
+# Octants in the order the octree visits them
+OCTANTS = np.array([(0, 1, 0), (1, 1, 0), (0, 0, 0), (1, 0, 0),
+                    (0, 1, 1), (1, 1, 1), (0, 0, 1), (1, 0, 1)], dtype=np.int64)
+
+# Bound types: the input range of each axis over a batch of cells
+ARITHMETICS = {
+    "interval": lambda lower, upper, axis: IntervalArray(lower, upper),
+    "affine": lambda lower, upper, axis: Affine.variable(lower, upper, axis),
+}
+
+
+class Octree(object):
+    """
+    Level-synchronous adaptive octree over an implicit function f.
+
+    Cells are (i, j, k) corners on the integer lattice of the finest level.
+    Each level keeps a frontier array of active cells; the whole frontier is
+    bounded with one call f(IntervalArray, IntervalArray, IntervalArray),
+    the cells whose bounds exclude 0 are dropped, and the survivors are
+    split into their eight children at once. The children of a cell stay
+    contiguous and in OCTANTS order, so the leaves come out in the same
+    order as a depth-first traversal would visit them.
+
+    `arithmetic` picks the bound type from ARITHMETICS. Affine bounds keep
+    track of how f depends on x, y and z, but are not always tighter than
+    interval bounds (e.g. for a single monotonic term), so in affine mode a
+    cell is kept only if both bounds contain 0; affine bounds are only
+    computed for the cells that survive the interval bounds.
+    """
+    def __init__(self, f, start, end, maxdepth, chunk=1 << 18, arithmetic="interval"):
+        self.f = f
+        self.start = np.array(start, dtype=np.float64)
+        self.end = np.array(end, dtype=np.float64)
+        self.maxdepth = maxdepth
+        self.resolution = 2**maxdepth
+        self.step = (self.end - self.start) / self.resolution
+        self.chunk = chunk
+        self.arithmetic = arithmetic
+        self.stats = []
+        self.levels = {}
+
+    def bounds(self, cells, size, arithmetic="interval"):
+        """ Bounds of f over the cubes of side `size` at `cells` """
+        lower = self.start + cells*self.step
+        upper = lower + size*self.step
+        variable = ARITHMETICS[arithmetic]
+        return self.f(*[variable(lower[:, axis], upper[:, axis], axis) for axis in range(3)])
+
+    def cull(self, cells, size):
+        """ Mask of the cells whose bounds contain 0 """
+        keep = np.empty(len(cells), dtype=bool)
+        for first in range(0, len(cells), self.chunk):
+            block = cells[first:first + self.chunk]
+            mask = self.bounds(block, size).contains(0)
+            if self.arithmetic != "interval" and mask.any():
+                mask[mask] = self.bounds(block[mask], size, self.arithmetic).contains(0)
+            keep[first:first + self.chunk] = mask
+        return keep
+
+    def leaves(self, cells=None, size=None, minsize=1):
+        """
+        (M, 3) array of the cells of side `minsize` that may contain the
+        surface, found by refining `cells` of side `size` (by default the
+        root cell).
+        """
+        self.stats = []
+        self.levels = {}
+        if cells is None:
+            cells, size = np.zeros((1, 3), dtype=np.int64), self.resolution
+        cells = np.asarray(cells, dtype=np.int64).reshape(-1, 3)
+        while True:
+            keep = self.cull(cells, size)
+            depth = self.maxdepth - size.bit_length() + 1
+            self.stats.append({"depth": depth, "size": size, "visited": len(cells), "culled": len(cells) - int(keep.sum())})
+            cells = cells[keep]
+            self.levels[depth] = cells
+            if size <= minsize or len(cells) == 0:
+                return cells
+            # Subdivide
+            size //= 2
+            cells = (cells[:, None, :] + OCTANTS*size).reshape(-1, 3)
+
+    def merge_stats(self, stats):
+        """ Adds the per-level counts of other traversals to self.stats """
+        merged = {stat["depth"]: dict(stat) for stat in self.stats}
+        for stat in stats:
+            if stat["depth"] in merged:
+                merged[stat["depth"]]["visited"] += stat["visited"]
+                merged[stat["depth"]]["culled"] += stat["culled"]
+            else:
+                merged[stat["depth"]] = dict(stat)
+        self.stats = [merged[depth] for depth in sorted(merged)]
+
+    def summary(self):
+        return "; ".join("depth %d: %d visited, %d culled" % (stat["depth"], stat["visited"], stat["culled"]) for stat in self.stats)
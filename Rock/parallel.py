@@ -0,0 +1,123 @@
+# vim: fdm=manual
+import concurrent.futures
+import os
+from multiprocessing import resource_tracker, shared_memory
+import numpy as np
+from marchingcubes import MarchingCubes
+
+
+# Parallel polygonization. The octree is refined in this process down to
+# `split` levels; every surviving cell there is the root of an independent
+# subtree, which a worker process refines, samples and triangulates on its
+# own. Workers hand their vertex, face and edge key arrays back through one
+# shared memory block each, and the parts are welded on the global lattice
+# edge keys, so vertices on subtree boundaries are not duplicated.
+
+def share(arrays):
+    """ Copies arrays into a new shared memory block, returning (name, layout) """
+    nbytes = sum(array.nbytes for array in arrays)
+    block = shared_memory.SharedMemory(create=True, size=max(nbytes, 1))
+    layout = []
+    offset = 0
+    for array in arrays:
+        np.ndarray(array.shape, array.dtype, buffer=block.buf, offset=offset)[...] = array
+        layout.append((array.shape, array.dtype.str, offset))
+        offset += array.nbytes
+    # The receiving process owns the block from here on and unlinks it
+    resource_tracker.unregister(block._name, "shared_memory")
+    block.close()
+    return block.name, layout
+
+
+def unshare(name, layout):
+    """ Copies the arrays out of a shared memory block and frees it """
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        return [np.ndarray(shape, dtype, buffer=block.buf, offset=offset).copy() for shape, dtype, offset in layout]
+    finally:
+        block.close()
+        block.unlink()
+
+
+def polygonize_subtree(f, start, end, maxdepth, arithmetic, cells, size, cache=None):
+    """
+    Polygonizes the subtrees at `cells`. A cache is only read from here
+    (see SampleCache.reader); the samples computed are handed back with
+    the mesh for the parent process to store.
+    """
+    polygonizer = MarchingCubes(f, start, end, maxdepth, arithmetic, cache)
+    leaves = polygonizer.octree.leaves(cells, size)
+    keys, vertices, faces = polygonizer.keyed_triangulate(leaves, polygonizer.prefetch(leaves))
+    lattice, values = np.empty((0, 3), dtype=np.int64), np.empty(0)
+    hits = 0
+    if cache is not None:
+        hits = cache.hits
+        if cache.pending:
+            lattice = np.concatenate([part[0] for part in cache.pending]).astype(np.int64)
+            values = np.concatenate([part[1] for part in cache.pending])
+    name, layout = share([keys, vertices, faces, lattice, values])
+    return name, layout, polygonizer.octree.stats, hits
+
+
+def weld(parts):
+    """
+    Merges (keys, vertices, faces) parts into one indexed mesh, keeping a
+    single vertex per edge key, numbered in order of first appearance.
+    """
+    keys = np.concatenate([part[0] for part in parts])
+    vertices = np.concatenate([part[1] for part in parts])
+    offsets = np.cumsum([0] + [len(part[0]) for part in parts[:-1]])
+    faces = np.concatenate([part[2] + offset for part, offset in zip(parts, offsets)])
+    if len(keys) == 0:
+        return vertices.reshape(-1, 3), faces.reshape(-1, 3)
+
+    _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    order = np.argsort(first)
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order))
+    return vertices[first[order]], rank[inverse.reshape(-1)][faces].astype(np.int32)
+
+
+class ParallelMarchingCubes(MarchingCubes):
+    """ MarchingCubes with the subtrees below `split` levels polygonized in a process pool """
+    def __init__(self, f, start, end, maxdepth, arithmetic="interval", split=2, max_workers=None, cache=None):
+        super().__init__(f, start, end, maxdepth, arithmetic, cache)
+        self.split = min(split, maxdepth)
+        self.max_workers = max_workers
+
+    def polygonize(self, builder):
+        size = self.resolution >> self.split
+        roots = self.octree.leaves(minsize=size)
+
+        parts = []
+        stats = []
+        with concurrent.futures.ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+            # Subtree roots are split, in depth-first order, into a few batches per worker
+            nbatches = min(len(roots), 4*(self.max_workers or os.cpu_count() or 1))
+            # Workers only read the cache; this process writes what they computed
+            reader = self.cache.reader() if self.cache is not None else None
+            futures = [executor.submit(polygonize_subtree, self.f, self.start, self.end, self.maxdepth, self.octree.arithmetic, batch, size, reader)
+                       for batch in np.array_split(roots, max(nbatches, 1)) if len(batch)]
+            # Every block a worker returns is unlinked, even when another
+            # worker failed, or it stays behind in shared memory
+            concurrent.futures.wait(futures)
+            error = None
+            for future in futures:
+                if future.exception() is not None:
+                    error = error or future.exception()
+                    continue
+                name, layout, substats, hits = future.result()
+                keys, vertices, faces, lattice, values = unshare(name, layout)
+                parts.append((keys, vertices, faces))
+                stats.extend(substats[1:])
+                if self.cache is not None:
+                    self.cache.hits += hits
+                    self.cache.misses += len(lattice)
+                    self.cache.store(self, lattice, values)
+            if error is not None:
+                raise error
+
+        self.octree.merge_stats(stats)
+        if parts:
+            builder.add_mesh(*weld(parts))
+        return builder
@@ -0,0 +1,74 @@
+# vim: fdm=manual
+import concurrent.futures
+import math
+import random
+import numpy as np
+import meshbuilder
+import marchingcubes
+import surfacenets
+import decimate
+from implicitrock import ImplicitRock
+from parallel import share, unshare
+
+
+# Batch generation of rock fields. Only a few distinct rocks (variants) are
+# polygonized, each from its own seed in a worker process, and the field is
+# populated with instances of them: per-instance transforms over shared
+# meshes, so N rocks cost K polygonizations plus N cheap objects.
+
+def polygonize_variant(seed, radii, nballs, maxdepth, arithmetic="interval", polygonizer="marchingcubes", tolerance=None, target=None):
+    """ Polygonizes the rock of one seed, handing its builder buffers back through shared memory """
+    rock = ImplicitRock(0, 0, 0, *radii, nballs, tolerance=tolerance, seed=seed)
+    cls = surfacenets.SurfaceNets if polygonizer == "surfacenets" else marchingcubes.MarchingCubes
+    builder = cls(rock, (-2, -2, -2), (2, 2, 2), maxdepth, arithmetic).polygonize(meshbuilder.MeshBuilder())
+    if target:
+        builder = decimate.decimate(builder, target)
+    return share(builder.arrays())
+
+
+def variant_seeds(seed, nvariants):
+    rng = random.Random(seed)
+    return [rng.randrange(1 << 31) for _ in range(nvariants)]
+
+
+def variants(seeds, radii, nballs, maxdepth, arithmetic="interval", polygonizer="marchingcubes", tolerance=None, target=None, max_workers=None):
+    """ (co, loops, loop_start, loop_total) buffers of the rock of every seed, polygonized in parallel """
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(polygonize_variant, seed, tuple(radii), nballs, maxdepth, arithmetic, polygonizer, tolerance, target)
+                   for seed in seeds]
+        # Unlink what every worker shared before raising a failure
+        concurrent.futures.wait(futures)
+        meshes = [unshare(*future.result()) for future in futures if future.exception() is None]
+        for future in futures:
+            if future.exception() is not None:
+                raise future.exception()
+        return meshes
+
+
+def scatter(ninstances, nvariants, lower, upper, minscale, maxscale, spacing=0, seed=0):
+    """
+    Transforms for ninstances rocks in the box lower..upper: (variant,
+    location, rotation_euler, scale) arrays. Locations are thrown as darts
+    and dropped when closer than `spacing` to an earlier one, so with a
+    spacing there may be fewer than ninstances.
+    """
+    rng = np.random.default_rng(seed)
+    lower, upper = np.asarray(lower, dtype=np.float64), np.asarray(upper, dtype=np.float64)
+    locations = lower + rng.random((ninstances, 3))*(upper - lower)
+    if spacing > 0 and ninstances:
+        # Hash the darts into cells of size spacing; a dart is kept when no
+        # kept dart in the 27 cells around it is too close
+        cells = np.floor((locations - lower)/spacing).astype(np.int64)
+        kept = {}
+        keep = np.zeros(ninstances, dtype=bool)
+        for n, (cell, location) in enumerate(zip(map(tuple, cells.tolist()), locations)):
+            near = [kept.get((cell[0] + i, cell[1] + j, cell[2] + k), ()) for i in (-1, 0, 1) for j in (-1, 0, 1) for k in (-1, 0, 1)]
+            if all(np.sum((locations[m] - location)**2) >= spacing*spacing for neighbours in near for m in neighbours):
+                kept.setdefault(cell, []).append(n)
+                keep[n] = True
+        locations = locations[keep]
+    count = len(locations)
+    variant = rng.integers(0, nvariants, count)
+    rotation = rng.random((count, 3))*2*math.pi
+    scale = np.repeat(minscale + rng.random((count, 1))*(maxscale - minscale), 3, axis=1)
+    return variant, locations, rotation, scale
@@ -0,0 +1,175 @@
+# vim: fdm=manual
+import hashlib
+import os
+import numpy as np
+
+
+class SampleCache(object):
+    """
+    Persistent cache of field samples on the corners of the marching cubes
+    lattice, so polygonizing the same rock again (at the same or a lower
+    depth, or with another polygonizer) reads its samples back, and a
+    deeper run only computes the lattice points that are new.
+
+    A lattice point is stored under its canonical (depth, i, j, k): the
+    coarsest octree level the point is a corner of, where its coordinates
+    are not all even. The same point of the domain thus has the same key at
+    every maxdepth. Samples live in sparse blocks of blocksize**3 values, one
+    memory-mapped .npy file per block, with NaN marking points not yet
+    sampled. Blocks are grouped by the identity of the field and domain
+    (field.fingerprint(), start and end); fields without a fingerprint are
+    not cached.
+
+    Every block read or written is touched, and once the cache grows past
+    maxbytes the least recently used blocks are deleted. Files are created
+    with an atomic rename, so several processes may share a cache; at worst
+    a race loses some samples, never returns wrong ones.
+    """
+    def __init__(self, directory, maxbytes=256 << 20, blocksize=32, readonly=False):
+        self.directory = directory
+        self.maxbytes = maxbytes
+        self.blocksize = blocksize
+        self.readonly = readonly
+        self.hits = 0
+        self.misses = 0
+        # Running size of the cache on disk, None until first measured
+        self.nbytes = None
+        # Samples computed by a read-only cache, as (lattice, values) pairs
+        self.pending = []
+
+    def reader(self):
+        """
+        A read-only view of the cache for worker processes: it reads
+        blocks but never creates, writes or trims them, and keeps what it
+        computes in `pending` for the owning process to store().
+        """
+        return SampleCache(self.directory, self.maxbytes, self.blocksize, readonly=True)
+
+    def identity(self, f, start, end):
+        if not hasattr(f, "fingerprint"):
+            return None
+        return hashlib.sha1(repr((f.fingerprint(), tuple(start), tuple(end))).encode()).hexdigest()
+
+    def canonical(self, lattice, maxdepth):
+        """ (depth, coords) of lattice points of level maxdepth, at the coarsest level they belong to """
+        lattice = np.asarray(lattice, dtype=np.int64).reshape(-1, 3)
+        # The lowest set bit of i | j | k says how many levels up the point is still a corner
+        bits = lattice[:, 0] | lattice[:, 1] | lattice[:, 2]
+        low = (bits & -bits) | (1 << maxdepth)
+        shift = np.minimum(np.log2(low & -low).astype(np.int64), maxdepth)
+        return maxdepth - shift, lattice >> shift[:, None]
+
+    def path(self, identity, depth, block):
+        return os.path.join(self.directory, identity, "%d_%d_%d_%d.npy" % ((depth,) + tuple(block)))
+
+    def load(self, path, create=False):
+        try:
+            array = np.load(path, mmap_mode="r+")
+        except (FileNotFoundError, ValueError):
+            if not create:
+                return None
+            # Build the block under a private name, then rename it into place
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temporary = "%s.%d.tmp" % (path, os.getpid())
+            with open(temporary, "wb") as file:
+                np.save(file, np.full((self.blocksize,)*3, np.nan))
+            os.replace(temporary, path)
+            if self.nbytes is not None:
+                self.nbytes += os.path.getsize(path)
+            array = np.load(path, mmap_mode="r+")
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return array
+
+    def blocks(self, polygonizer, lattice):
+        """ (path, members, offsets) of every block the lattice points fall in, or None if uncacheable """
+        identity = self.identity(polygonizer.f, polygonizer.start, polygonizer.end)
+        if identity is None or len(lattice) == 0:
+            return None
+        depth, coords = self.canonical(lattice, polygonizer.maxdepth)
+        blocks, offsets = coords // self.blocksize, coords % self.blocksize
+        side = polygonizer.resolution // self.blocksize + 1
+        codes = ((depth*side + blocks[:, 0])*side + blocks[:, 1])*side + blocks[:, 2]
+        order = np.argsort(codes, kind="stable")
+        first = np.flatnonzero(np.diff(codes[order], prepend=-1))
+        bounds = np.append(first, len(codes))
+        result = []
+        for group, n in enumerate(order[first]):
+            members = order[bounds[group]:bounds[group + 1]]
+            result.append((self.path(identity, int(depth[n]), blocks[n].tolist()), members, offsets[members]))
+        return result
+
+    def sample(self, polygonizer, lattice, compute):
+        """ Field values at lattice points of the polygonizer, computing only the ones not cached """
+        blocks = self.blocks(polygonizer, lattice)
+        if blocks is None:
+            return compute(lattice)
+
+        values = np.full(len(lattice), np.nan)
+        for path, members, o in blocks:
+            block = self.load(path)
+            if block is not None:
+                values[members] = block[o[:, 0], o[:, 1], o[:, 2]]
+
+        missing = np.isnan(values)
+        self.hits += int(len(values) - missing.sum())
+        self.misses += int(missing.sum())
+        if np.any(missing):
+            values[missing] = compute(lattice[missing])
+            if self.readonly:
+                self.pending.append((np.asarray(lattice)[missing], values[missing]))
+            else:
+                self.write(blocks, values, missing)
+        return values
+
+    def store(self, polygonizer, lattice, values):
+        """ Adds samples computed elsewhere (see reader) to the cache """
+        blocks = self.blocks(polygonizer, lattice)
+        if blocks is not None:
+            self.write(blocks, np.asarray(values, dtype=np.float64), np.ones(len(lattice), dtype=bool))
+
+    def write(self, blocks, values, which):
+        for path, members, o in blocks:
+            keep = which[members]
+            if not np.any(keep):
+                continue
+            block = self.load(path, create=True)
+            o = o[keep]
+            block[o[:, 0], o[:, 1], o[:, 2]] = values[members[keep]]
+            block.flush()
+        self.trim()
+
+    def trim(self):
+        """
+        Deletes the least recently used blocks until the cache fits in
+        maxbytes. The directory is only walked when the running total says
+        the cache is too big (or on first use); blocks other processes add
+        are caught up with then.
+        """
+        if self.nbytes is not None and self.nbytes <= self.maxbytes:
+            return
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith(".npy"):
+                    try:
+                        stat = os.stat(os.path.join(root, name))
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, os.path.join(root, name)))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.maxbytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        self.nbytes = total
+
+    def summary(self):
+        total = self.hits + self.misses
+        return "%d samples, %d cached (%.0f%%)" % (total, self.hits, 100*self.hits/max(total, 1))
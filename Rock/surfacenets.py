@@ -0,0 +1,88 @@
+# vim: fdm=manual
+import numpy as np
+from marchingcubes import MarchingCubes, CORNERS, EDGES, EDGE_AXIS, EDGE_LOW, EDGE_HIGH
+
+
+# The four cells around a lattice edge along each axis, as offsets of their
+# lower corners from the edge's lower end, in winding order
+AROUND = np.zeros((3, 4, 3), dtype=np.int64)
+for axis in range(3):
+    b, c = (axis + 1) % 3, (axis + 2) % 3
+    for n, (db, dc) in enumerate([(0, 0), (-1, 0), (-1, -1), (0, -1)]):
+        AROUND[axis, n, b] = db
+        AROUND[axis, n, c] = dc
+
+
+class SurfaceNets(MarchingCubes):
+    """
+    Surface nets over the same adaptive octree as MarchingCubes: one vertex
+    per leaf cell the surface crosses, at the mean of the crossings on the
+    cell's edges, and one quad for every crossed lattice edge, joining the
+    vertices of the four cells around it. The quads are about half as many
+    faces as the marching cubes triangles, and without the slivers.
+
+    When the field has a gradient(points) method, every vertex also takes
+    one Newton step towards the surface, kept inside its cell.
+    """
+    def __init__(self, f, start, end, maxdepth, arithmetic="interval", project=True, cache=None):
+        super().__init__(f, start, end, maxdepth, arithmetic, cache)
+        self.project = project and hasattr(f, "gradient")
+
+    def coarser(self, maxdepth):
+        return SurfaceNets(self.f, self.start, self.end, maxdepth, self.octree.arithmetic, self.project, self.cache)
+
+    def mesh(self, leaves, values):
+        return self.net(leaves, values)
+
+    def net(self, leaves, values):
+        """ (vertices, quads) for leaf cells with (M, 8) corner values """
+        inside = values >= 0
+        cases = inside.astype(np.int64) @ (1 << np.arange(8))
+        active = np.flatnonzero((cases > 0) & (cases < 255))
+        if len(active) == 0:
+            return np.empty((0, 3)), np.empty((0, 4), dtype=np.int32)
+        cells, values, inside = leaves[active], values[active], inside[active]
+
+        # Mean of the edge crossings of every active cell, in lattice units
+        total = np.zeros((len(cells), 3))
+        count = np.zeros(len(cells))
+        for edge in range(12):
+            low, high = EDGE_LOW[edge], EDGE_HIGH[edge]
+            crossed = inside[:, low] != inside[:, high]
+            fp, fq = values[crossed, low], values[crossed, high]
+            alpha = (-fp / (fq - fp))[:, None]
+            total[crossed] += CORNERS[low] + alpha*(CORNERS[high] - CORNERS[low])
+            count[crossed] += 1
+        vertices = np.array(self.start) + (cells + total/count[:, None])*np.array(self.step)
+        if self.project:
+            vertices = self.newton(vertices, cells)
+
+        # Every crossed edge, keyed by its lower lattice corner and axis
+        side = self.resolution + 1
+        crossings = inside[:, EDGES[:, 0]] != inside[:, EDGES[:, 1]]
+        cell, edge = np.nonzero(crossings)
+        low = cells[cell] + CORNERS[EDGE_LOW[edge]]
+        axis = EDGE_AXIS[edge]
+        _, first = np.unique(((low[:, 0]*side + low[:, 1])*side + low[:, 2])*3 + axis, return_index=True)
+        low, axis = low[first], axis[first]
+        flip = inside[cell[first], EDGE_LOW[edge[first]]]
+
+        # Look up the four cells around each edge; edges on the border of
+        # the domain have fewer than four and get no quad
+        around = low[:, None, :] + AROUND[axis]
+        codes = (around[..., 0]*side + around[..., 1])*side + around[..., 2]
+        cellcodes = (cells[:, 0]*side + cells[:, 1])*side + cells[:, 2]
+        order = np.argsort(cellcodes)
+        position = np.clip(np.searchsorted(cellcodes[order], codes), 0, len(order) - 1)
+        found = (cellcodes[order][position] == codes) & np.all((around >= 0) & (around < self.resolution), axis=2)
+        complete = np.all(found, axis=1)
+        quads = order[position[complete]]
+        quads[flip[complete]] = quads[flip[complete]][:, ::-1]
+        return vertices, quads.astype(np.int32)
+
+    def newton(self, vertices, cells):
+        gradients = self.f.gradient(vertices)
+        norm2 = np.einsum("ni,ni->n", gradients, gradients)
+        step = np.where(norm2 > 0, self.f.evaluate(vertices)/np.where(norm2 > 0, norm2, 1), 0)
+        lower = np.array(self.start) + cells*np.array(self.step)
+        return np.clip(vertices - step[:, None]*gradients, lower, lower + np.array(self.step))
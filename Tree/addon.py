@@ -3,10 +3,13 @@ import os, sys
 sys.path.append(os.getcwd())
 import math
 import bpy
-import mathutils
-import lturtle
 import lsystems
+import lstring
+import batchturtle
+import meshbuilder
+import decimate
 import lturtlealphabet as la
+import grammar
 
 
 bl_info = {
@@ -15,93 +18,47 @@ bl_info = {
 }
 
 
-r_1 = 0.9
-r_2 = 0.8
-a_0 = math.radians(45)
-a_2 = math.radians(45)
-d = math.radians(137.5)
-
-
 # Define the operator
 
 class BushOperator(bpy.types.Operator):
     bl_idname = "mesh.bush_generator"
     bl_label = "Bush Generator"
 
-    axiom = [la.TurtleA(1)]
-    rules = {
-        # + yaw_left
-        # - yaw_right
-        # & pitch_down
-        # ^ pitch_up
-        # \ roll_left
-        # / roll_right
-        # | yaw_left(pi)
-
-        (1, la.TurtleA): lambda s: [
-            la.TurtleForward(s.l),          # F(l)
-            la.TurtlePush(),                # [
-            la.TurtlePitchDown(a_0),        # &(a_0)
-            la.TurtleB(s.l*r_2),            # B(l*r_2)
-            la.TurtlePop(),                 # ]
-            la.TurtleRollRight(d),          # /(d)
-            la.TurtleA(s.l*r_1),            # A(l*r_1)
-        ],
-        (1, la.TurtleB): lambda s: [
-            la.TurtleForward(s.l),          # F(l)
-            la.TurtlePush(),                # [
-            la.TurtleYawRight(a_2),         # -(a_2)
-            la.TurtleHoriz(),               # $
-            la.TurtleC(s.l*r_2),            # C(l*r_2)
-            la.TurtlePop(),                 # ]
-            la.TurtleC(s.l*r_1),            # C(l*r_1)
-        ],
-        (1, la.TurtleC): lambda s: [
-            la.TurtleForward(s.l),          # F(l)
-            la.TurtlePush(),                # [
-            la.TurtleYawLeft(a_2),          # +(a_2)
-            la.TurtleHoriz(),               # $
-            la.TurtleB(s.l*r_2),            # B(l*r_2)
-            la.TurtlePop(),                 # ]
-            la.TurtleB(s.l*r_1),            # B(l*r_1)
-        ]
-    }
+    axiom = grammar.axiom
+    rules = lsystems.compile_rules(grammar.rules, stochastic=True)
+
+    alphabet = lstring.Alphabet.frommodule(la)
 
     depth: bpy.props.IntProperty(name="Depth", min=1, max=10, default=10)
     stepsize: bpy.props.FloatProperty(name="Step Size", default=1)
     stepangle: bpy.props.FloatProperty(name="Step Angle", min=0, max=360, default=22.5)
     radius: bpy.props.FloatProperty(name="Radius", default=0.5)
+    decimate_target: bpy.props.IntProperty(name="Decimate to Faces (0 = Off)", min=0, default=0)
+    decimate_tolerance: bpy.props.FloatProperty(name="Decimate Tolerance (0 = Off)", min=0, default=0, precision=4)
 
     def invoke(self, context, event):
         wm = context.window_manager
         return wm.invoke_props_dialog(self)
 
-    def addface(self, *verts):
-        i = len(self.vertices)
-        for vert in verts:
-            self.vertices.append(vert)
-        self.faces.append([i+k for k in range(len(verts))])
-
     def execute(self, context):
-        instructions = lsystems.lsystem_stochastic_evolve(self.axiom, self.rules, self.depth)
-
-        self.vertices = []
-        self.faces = []
-        turtle = lturtle.Turtle(mathutils.Vector((0, 0, 0)),
-                                mathutils.Vector((0, 0, 1)),
-                                mathutils.Vector((0, 1, 0)),
-                                mathutils.Vector((1, 0, 0)),
-                                self.stepsize,
-                                math.radians(self.stepangle),
-                                0.1,
-                                self.addface)
-
-        lsystems.doturtle(instructions, turtle, [])
-
-        # Generate the mesh from (vertices, faces)
+        # The tree's rules are deterministic, so repeated subtrees are
+        # expanded and interpreted once and instanced
+        turtle = batchturtle.BatchTurtle((0, 0, 0), (0, 0, 1), (0, 1, 0), (1, 0, 0),
+                                         self.stepsize,
+                                         math.radians(self.stepangle),
+                                         0.1)
+        turtle.run_memo(self.axiom, self.rules, self.depth, grammar.lengths)
+        builder = turtle.tobuilder(meshbuilder.MeshBuilder())
+
+        if self.decimate_target or self.decimate_tolerance:
+            builder = decimate.decimate(builder, self.decimate_target or None, self.decimate_tolerance or None)
+            message = decimate.missed(builder, self.decimate_target)
+            if message:
+                self.report({"WARNING"}, message)
+
+        # Generate the mesh from the builder's buffers
         mesh = bpy.data.meshes.new("Generated")
-        mesh.from_pydata(self.vertices, [], self.faces)
-        mesh.update()
+        builder.tomesh(mesh)
         obj = bpy.data.objects.new("Generated", mesh)
         context.collection.objects.link(obj)
         bpy.ops.object.select_all(action="DESELECT")
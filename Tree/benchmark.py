@@ -0,0 +1,154 @@
+# vim: fdm=manual
+import math
+import random
+import sys
+import time
+import mathutils
+import lsystems
+import lstring
+import grammar
+import lturtlealphabet as la
+import batchturtle
+import meshbuilder
+import decimate
+import lturtle
+
+
+def timeit(f, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        f()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def scan_stochastic_expand(axiom, rules, depth):
+    # Reference: linear isinstance scan over every rule for every symbol
+    stack = [(iter(axiom), depth)]
+    while stack:
+        symbols, remaining = stack[-1]
+        for symbol in symbols:
+            if remaining > 0:
+                rand = random.random()
+                rsum = 0
+                for (prob, primary), secondary in lsystems.rule_items(rules):
+                    if isinstance(symbol, primary):
+                        rsum += prob
+                        if rand < rsum:
+                            break
+                else:
+                    secondary = None
+                if secondary is not None:
+                    stack.append((iter(secondary(symbol)), remaining-1))
+                    break
+                if rsum > 0:
+                    # Missed every rule: try again next generation
+                    stack.append((iter((symbol,)), remaining-1))
+                    break
+            yield symbol
+        else:
+            stack.pop()
+
+
+def bench_rules(depth):
+    nsymbols = sum(1 for _ in lsystems.lsystem_stochastic_expand(grammar.axiom, grammar.rules, depth))
+    scan = timeit(lambda: sum(1 for _ in scan_stochastic_expand(grammar.axiom, grammar.rules, depth)))
+    table = lsystems.compile_rules(grammar.rules, stochastic=True)
+    compiled = timeit(lambda: sum(1 for _ in lsystems.lsystem_stochastic_expand(grammar.axiom, table, depth)))
+    print("rules     depth %2d  %8d symbols  scan %.3fs  compiled %.3fs  (%.2fx)" % (depth, nsymbols, scan, compiled, scan/compiled))
+
+
+def bench_string(depth):
+    symbols = lsystems.lsystem_stochastic_evolve(grammar.axiom, grammar.rules, depth)
+    objbytes = sum(sys.getsizeof(symbol) + sys.getsizeof(getattr(symbol, "__dict__", None)) for symbol in symbols)
+    string = lstring.SymbolString.fromlist(lstring.Alphabet.frommodule(la), symbols)
+    print("string    depth %2d  %8d symbols  objects %.1f B/symbol  arrays %.1f B/symbol" % (depth, len(symbols), objbytes/len(symbols), string.nbytes()/len(string)))
+
+
+def bench_decimate(depth):
+    random.seed(0)
+    string = lstring.SymbolString.fromlist(lstring.Alphabet.frommodule(la), lsystems.lsystem_stochastic_expand(grammar.axiom, grammar.rules, depth))
+    turtle = batchturtle.BatchTurtle((0, 0, 0), (0, 0, 1), (0, 1, 0), (1, 0, 0), 1, math.radians(22.5), 0.1)
+    turtle.run(string)
+    co, loops, starts, totals = turtle.tobuilder(meshbuilder.MeshBuilder()).arrays()
+    vertices, faces = co.reshape(-1, 3).astype("float64"), decimate.triangulate(loops, starts, totals)
+    for target, tolerance in ((None, 1e-3), (None, 1e-2), (len(faces)//4, None)):
+        elapsed = timeit(lambda: decimate.simplify(vertices, faces, target, tolerance), repeat=1)
+        _, simplified = decimate.simplify(vertices, faces, target, tolerance)
+        print("decimate  depth %2d  %7d -> %7d faces  target %-7s tolerance %-6s %.3fs"
+              % (depth, len(faces), len(simplified), target, tolerance, elapsed))
+
+
+def bench_memo(depths):
+    alphabet = lstring.Alphabet.frommodule(la)
+    table = lsystems.compile_rules(grammar.rules, stochastic=True)
+
+    def turtle():
+        return batchturtle.BatchTurtle((0, 0, 0), (0, 0, 1), (0, 1, 0), (1, 0, 0), 1, math.radians(22.5), 0.1)
+
+    for depth in depths:
+        plain = timeit(lambda: turtle().run(lstring.SymbolString.fromlist(alphabet, lsystems.lsystem_stochastic_expand(grammar.axiom, table, depth))), repeat=1)
+        expand = timeit(lambda: lstring.memo_expand(grammar.axiom, table, depth, alphabet, grammar.lengths))
+        memo = timeit(lambda: turtle().run_memo(grammar.axiom, table, depth, grammar.lengths))
+        nsegments = len(turtle().run_memo(grammar.axiom, table, depth, grammar.lengths).segments)
+        print("memo      depth %2d  %8d segments  expand+run %.3fs  memo expand %.3fs  memo run %.3fs  (%.1fx)"
+              % (depth, nsegments, plain, expand, memo, plain/memo))
+
+
+def bench_rotations(n):
+    def turtle():
+        return lturtle.Turtle(mathutils.Vector((0, 0, 0)), mathutils.Vector((0, 0, 1)), mathutils.Vector((0, 1, 0)), mathutils.Vector((1, 0, 0)),
+                              1, math.radians(22.5), 0.1, lambda *face: None)
+
+    def rodrigues_pair():
+        # Reference: a rotation as two rodrigues calls on separate vectors
+        direction, up, left = mathutils.Vector((0, 0, 1)), mathutils.Vector((0, 1, 0)), mathutils.Vector((1, 0, 0))
+        for _ in range(n):
+            direction, left = lturtle.rodrigues(direction, up, grammar.d), lturtle.rodrigues(left, up, grammar.d)
+
+    degenerate = turtle()
+    degenerate.horiz()
+    cases = [("rodrigues", rodrigues_pair),
+             ("step angle", lambda t=turtle(): [t.yaw_right() for _ in range(n)]),
+             ("angle d", lambda t=turtle(): [t.roll_right(grammar.d) for _ in range(n)]),
+             ("after horiz", lambda: [degenerate.yaw_right() for _ in range(n)])]
+    print("rotations " + "  ".join("%s %.0fns" % (name, 1e9*timeit(f)/n) for name, f in cases))
+
+    random.seed(0)
+    symbols = lsystems.lsystem_stochastic_evolve(grammar.axiom, grammar.rules, 10)
+    print("doturtle  depth 10  %8d symbols  %.3fs" % (len(symbols), timeit(lambda: lsystems.doturtle(symbols, turtle(), lturtle.TurtleStack()))))
+
+
+def bench_culling(depth):
+    random.seed(0)
+    symbols = lsystems.lsystem_stochastic_evolve(grammar.axiom, grammar.rules, depth)
+
+    def run(culling):
+        addface = lambda *face: None
+        if culling is not None:
+            addface = culling.counting(addface)
+        turtle = lturtle.Turtle(mathutils.Vector((0, 0, 0)), mathutils.Vector((0, 0, 1)), mathutils.Vector((0, 1, 0)), mathutils.Vector((1, 0, 0)),
+                                1, math.radians(22.5), 0.1, addface)
+        lsystems.doturtle(symbols, turtle, lturtle.TurtleStack(), cull=culling)
+
+    index = timeit(lambda: lsystems.match_brackets(symbols))
+    print("culling   depth %2d  %8d symbols  none %.3fs  bracket index %.3fs" % (depth, len(symbols), timeit(lambda: run(None)), index))
+    for name, make in (("min length 0.2", lambda: lturtle.Culling(minlength=0.2)),
+                       ("4000 faces", lambda: lturtle.Culling(maxfaces=4000)),
+                       ("box", lambda: lturtle.Culling(lower=(-1, -1, 0), upper=(1, 1, 3)))):
+        elapsed = timeit(lambda: run(make()))
+        culling = make()
+        run(culling)
+        print("culling   depth %2d  %-14s  %.3fs  %s" % (depth, name, elapsed, culling.summary()))
+
+
+if __name__ == "__main__":
+    bench_rules(10)
+    bench_string(10)
+    bench_decimate(10)
+    bench_memo((8, 12, 16))
+    bench_rotations(100000)
+    bench_culling(12)
@@ -0,0 +1,53 @@
+# vim: fdm=manual
+import math
+import lturtlealphabet as la
+
+
+r_1 = 0.9
+r_2 = 0.8
+a_0 = math.radians(45)
+a_2 = math.radians(45)
+d = math.radians(137.5)
+
+
+axiom = [la.TurtleA(1)]
+# Symbols whose parameter is a length: the rules are homogeneous in them
+# (see lstring.homogeneous), so expansions are reused at every scale
+lengths = (la.TurtleForward, la.TurtleA, la.TurtleB, la.TurtleC)
+rules = {
+    # + yaw_left
+    # - yaw_right
+    # & pitch_down
+    # ^ pitch_up
+    # \ roll_left
+    # / roll_right
+    # | yaw_left(pi)
+
+    (1, la.TurtleA): lambda s: [
+        la.TurtleForward(s.l),          # F(l)
+        la.TurtlePush(),                # [
+        la.TurtlePitchDown(a_0),        # &(a_0)
+        la.TurtleB(s.l*r_2),            # B(l*r_2)
+        la.TurtlePop(),                 # ]
+        la.TurtleRollRight(d),          # /(d)
+        la.TurtleA(s.l*r_1),            # A(l*r_1)
+    ],
+    (1, la.TurtleB): lambda s: [
+        la.TurtleForward(s.l),          # F(l)
+        la.TurtlePush(),                # [
+        la.TurtleYawRight(a_2),         # -(a_2)
+        la.TurtleHoriz(),               # $
+        la.TurtleC(s.l*r_2),            # C(l*r_2)
+        la.TurtlePop(),                 # ]
+        la.TurtleC(s.l*r_1),            # C(l*r_1)
+    ],
+    (1, la.TurtleC): lambda s: [
+        la.TurtleForward(s.l),          # F(l)
+        la.TurtlePush(),                # [
+        la.TurtleYawLeft(a_2),          # +(a_2)
+        la.TurtleHoriz(),               # $
+        la.TurtleB(s.l*r_2),            # B(l*r_2)
+        la.TurtlePop(),                 # ]
+        la.TurtleB(s.l*r_1),            # B(l*r_1)
+    ]
+}
@@ -5,6 +5,8 @@ import math
 import random
 import bpy
 import mathutils
+import numpy as np
+import meshbuilder
 
 
 bl_info = {
@@ -53,9 +55,6 @@ class VaseOperation(bpy.types.Operator):
         return wm.invoke_props_dialog(self)
 
     def execute(self, context):
-        vertices = []
-        faces = []
-
         # f = lambda t: bezier_n(2, t, mathutils.Vector((0, 0, 0)), mathutils.Vector((3, 0, 0)), mathutils.Vector((3, 0, 3)))
         # f = lambda t: bezier_n(3, t, mathutils.Vector((0, 0, 0)), mathutils.Vector((3, 0, 0)), mathutils.Vector((1, 0, 3)), mathutils.Vector((3, 0, 5)))
 
@@ -67,31 +66,22 @@ class VaseOperation(bpy.types.Operator):
             ps.append(p + mathutils.Vector((radius_diffs[i], 0, height_incrs[i])))
         f = lambda t: bezier_n(self.degree, t, *ps)
 
-        vi = 0
+        # Sample the profile once and revolve it; rotation i of sample j is
+        # grid point (j, i), and the grid wraps around the axis
         rotation_step = 2*math.pi / self.nrotations
         t_step = 1 / self.nts
-        for i in range(self.nrotations):
-            # for t in range(self.nts):
-            for j in range(self.nts):
-                v0 = f(j*t_step)
-                v1 = f(j*t_step)
-                v2 = f((j+1)*t_step)
-                v3 = f((j+1)*t_step)
-                v0.rotate(mathutils.Euler((0, 0, i*rotation_step), 'XYZ'))
-                v1.rotate(mathutils.Euler((0, 0, (i+1)*rotation_step), 'XYZ'))
-                v2.rotate(mathutils.Euler((0, 0, (i+1)*rotation_step), 'XYZ'))
-                v3.rotate(mathutils.Euler((0, 0, i*rotation_step), 'XYZ'))
-                vertices.append(v0)
-                vertices.append(v1)
-                vertices.append(v2)
-                vertices.append(v3)
-                faces.append([vi, vi+1, vi+2, vi+3])
-                vi += 4
-
-        # Generate the mesh from (vertices, faces)
+        profile = np.array([tuple(f(j*t_step)) for j in range(self.nts + 1)])
+        angles = np.arange(self.nrotations)*rotation_step
+        cos, sin = np.cos(angles)[None, :], np.sin(angles)[None, :]
+        x, y, z = profile[:, 0:1], profile[:, 1:2], profile[:, 2:3]
+        points = np.stack([x*cos - y*sin, x*sin + y*cos, np.broadcast_to(z, (len(profile), self.nrotations))], axis=-1)
+
+        builder = meshbuilder.MeshBuilder()
+        builder.add_grid(points, wrap_v=True)
+
+        # Generate the mesh from the builder's buffers
         mesh = bpy.data.meshes.new("Generated")
-        mesh.from_pydata(vertices, [], faces)
-        mesh.update()
+        builder.tomesh(mesh)
         obj = bpy.data.objects.new("Generated", mesh)
         context.collection.objects.link(obj)
         bpy.ops.object.select_all(action="DESELECT")
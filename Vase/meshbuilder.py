@@ -0,0 +1,164 @@
+# vim: fdm=manual
+import numpy as np
+
+
+class MeshBuilder(object):
+    """
+    Accumulates an indexed mesh. Faces refer to shared vertices instead of
+    each face carrying its own copies, and the result comes out as flat
+    arrays ready for Mesh.*.foreach_set.
+    """
+    def __init__(self):
+        self.vertexchunks = []
+        self.pendingvertices = []
+        self.nvertices = 0
+
+        self.loopchunks = []
+        self.sizechunks = []
+        self.pendingloops = []
+        self.pendingsizes = []
+
+        self.cache = {}
+
+    def flush(self):
+        if self.pendingvertices:
+            self.vertexchunks.append(np.array(self.pendingvertices, dtype=np.float64).reshape(-1, 3))
+            self.pendingvertices = []
+        if self.pendingsizes:
+            self.loopchunks.append(np.array(self.pendingloops, dtype=np.int32))
+            self.sizechunks.append(np.array(self.pendingsizes, dtype=np.int32))
+            self.pendingloops = []
+            self.pendingsizes = []
+
+    # Vertices
+
+    def add_vertex(self, co):
+        self.pendingvertices.append(tuple(co))
+        self.nvertices += 1
+        return self.nvertices - 1
+
+    def add_vertices(self, cos):
+        cos = np.asarray(cos, dtype=np.float64).reshape(-1, 3)
+        self.flush()
+        first = self.nvertices
+        self.vertexchunks.append(cos)
+        self.nvertices += len(cos)
+        return first
+
+    def vertex(self, key, compute):
+        """ Index of the vertex cached under `key`, adding compute() on a miss """
+        try:
+            return self.cache[key]
+        except KeyError:
+            index = self.cache[key] = self.add_vertex(compute())
+            return index
+
+    def weld(self, co):
+        """ Index of a vertex at exactly `co`, shared with earlier welds """
+        key = tuple(co)
+        try:
+            return self.cache[key]
+        except KeyError:
+            index = self.cache[key] = self.add_vertex(key)
+            return index
+
+    # Faces
+
+    def add_face(self, indices):
+        self.pendingloops.extend(indices)
+        self.pendingsizes.append(len(indices))
+
+    def add_faces(self, faces, offset=0):
+        """ Adds an (M, k) array of faces with k vertices each """
+        faces = np.asarray(faces, dtype=np.int32)
+        if len(faces) == 0:
+            return
+        self.flush()
+        self.loopchunks.append((faces + offset).ravel())
+        self.sizechunks.append(np.full(len(faces), faces.shape[1], dtype=np.int32))
+
+    def addface(self, *verts):
+        """ Drop-in for the operators' addface(*verts): welds identical corners """
+        self.add_face([self.weld(vert) for vert in verts])
+
+    def add_mesh(self, vertices, faces):
+        self.add_faces(faces, self.add_vertices(vertices))
+
+    def add_grid(self, points, wrap_u=False, wrap_v=False):
+        """
+        Adds a parametric patch sampled as an (nu, nv, 3) grid of points.
+        Each interior grid point becomes a single vertex shared by up to four
+        quads (i, j), (i, j+1), (i+1, j+1), (i+1, j); wrapping closes the
+        patch along u or v without duplicating the seam.
+        """
+        points = np.asarray(points, dtype=np.float64)
+        nu, nv = points.shape[:2]
+        first = self.add_vertices(points.reshape(-1, 3))
+        index = np.arange(nu*nv, dtype=np.int32).reshape(nu, nv)
+        if wrap_u:
+            index = np.concatenate([index, index[:1]], axis=0)
+        if wrap_v:
+            index = np.concatenate([index, index[:, :1]], axis=1)
+        faces = np.stack([index[:-1, :-1], index[:-1, 1:], index[1:, 1:], index[1:, :-1]], axis=-1)
+        self.add_faces(faces.reshape(-1, 4), first)
+
+    # Output
+
+    def arrays(self):
+        """ (co, vertex_index, loop_start, loop_total) as flat float32/int32 arrays """
+        self.flush()
+        if self.vertexchunks:
+            co = np.concatenate(self.vertexchunks).astype(np.float32).ravel()
+        else:
+            co = np.empty(0, dtype=np.float32)
+        if self.sizechunks:
+            loops = np.concatenate(self.loopchunks).astype(np.int32)
+            totals = np.concatenate(self.sizechunks).astype(np.int32)
+        else:
+            loops = np.empty(0, dtype=np.int32)
+            totals = np.empty(0, dtype=np.int32)
+        starts = np.zeros(len(totals), dtype=np.int32)
+        np.cumsum(totals[:-1], out=starts[1:])
+        return co, loops, starts, totals
+
+    def tomesh(self, mesh, normals=None, uvs=None):
+        return commit(mesh, *self.arrays(), normals=normals, uvs=uvs)
+
+    def pydata(self):
+        """ (vertices, faces) for Mesh.from_pydata """
+        co, loops, starts, totals = self.arrays()
+        return co.reshape(-1, 3), [face.tolist() for face in np.split(loops, starts[1:])] if len(totals) else []
+
+
+def commit(mesh, co, loops, loop_start, loop_total, normals=None, uvs=None):
+    """
+    Fills an empty bpy mesh from flat buffers with foreach_set:
+    co (3*V float32), loops (L int32), loop_start/loop_total (P int32),
+    optionally per-vertex normals (3*V) and per-loop uvs (2*L).
+    """
+    import bpy
+
+    mesh.vertices.add(len(co) // 3)
+    mesh.loops.add(len(loops))
+    mesh.polygons.add(len(loop_start))
+    mesh.vertices.foreach_set("co", np.ascontiguousarray(co, dtype=np.float32))
+    mesh.loops.foreach_set("vertex_index", np.ascontiguousarray(loops, dtype=np.int32))
+    mesh.polygons.foreach_set("loop_start", np.ascontiguousarray(loop_start, dtype=np.int32))
+    if bpy.app.version < (3, 6, 0):
+        # Newer versions derive loop_total from loop_start
+        mesh.polygons.foreach_set("loop_total", np.ascontiguousarray(loop_total, dtype=np.int32))
+
+    if uvs is not None:
+        layer = mesh.uv_layers.new()
+        layer.data.foreach_set("uv", np.ascontiguousarray(uvs, dtype=np.float32))
+
+    mesh.update(calc_edges=True)
+
+    if normals is not None:
+        mesh.polygons.foreach_set("use_smooth", np.ones(len(loop_start), dtype=bool))
+        if bpy.app.version < (4, 1, 0):
+            mesh.use_auto_smooth = True
+        mesh.normals_split_custom_set_from_vertices(np.asarray(normals, dtype=np.float32).reshape(-1, 3))
+
+    return mesh
+